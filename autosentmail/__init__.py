@@ -0,0 +1,4 @@
+# 自動化課程證書寄送
+# 命令列介面見 cli.py (python -m autosentmail)；匯入本套件不會載入任何模組，各模組可個別匯入使用，例如
+#   from autosentmail.config import load_config
+#   from autosentmail.sender import run_send
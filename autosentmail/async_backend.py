@@ -0,0 +1,381 @@
+import asyncio
+import base64
+import signal
+import smtplib
+import time
+
+from .batch_sender import envelope_commands
+from .metrics import Metrics
+from .mime_stream import as_streaming
+from .smtp_pool import create_ssl_context
+
+
+# 以 asyncio 串流實作的 SMTP 用戶端連線，只包含寄信所需的指令
+# 錯誤一律拋出 smtplib 的例外類型，讓結果統計與同步版本一致
+class AsyncSMTPConnection:
+    def __init__(self, timeout=60, metrics=None):
+        self.timeout = timeout
+        self.metrics = metrics or Metrics()
+        self.reader = None
+        self.writer = None
+        self.extensions = {}
+        self.message_count = 0
+        self.reused = False
+        self.last_used = time.monotonic()
+        self.limiter = None
+
+    async def _readline(self):
+        line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+        if not line:
+            raise smtplib.SMTPServerDisconnected("伺服器已關閉連線")
+        return line
+
+    # 讀取一個 (可能多行的) 回應，回傳 (代碼, 訊息)
+    async def getreply(self):
+        lines = []
+        while True:
+            line = await self._readline()
+            try:
+                code = int(line[:3])
+            except ValueError:
+                raise smtplib.SMTPResponseException(-1, line)
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                return code, b'\n'.join(lines)
+
+    async def send(self, data):
+        if isinstance(data, str):
+            data = data.encode('ascii')
+        self.writer.write(data)
+        # drain 在傳送緩衝區滿時會等待，即每條連線各自的背壓
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+
+    async def command(self, line):
+        await self.send(line + '\r\n')
+        return await self.getreply()
+
+    async def ehlo(self):
+        code, resp = await self.command('EHLO localhost')
+        if code != 250:
+            code, resp = await self.command('HELO localhost')
+            if code != 250:
+                raise smtplib.SMTPHeloError(code, resp)
+            self.extensions = {}
+            return
+        self.extensions = {}
+        for line in resp.decode('latin-1').split('\n')[1:]:
+            name, _, params = line.strip().partition(' ')
+            self.extensions[name.lower()] = params
+
+    def has_extn(self, name):
+        return name.lower() in self.extensions
+
+    # mode: 'ssl' 為連線後立即 TLS (SMTPS)，'starttls' 為先以明文連線再升級，'plain' 為不加密
+    # SMTPS 先建立 TCP 連線再進行 TLS 握手，以便分別量測兩者的耗時 (Python 3.10 以前無法分開，連線時間包含握手)
+    async def connect(self, host, port, context, mode):
+        split_tls = mode == 'ssl' and hasattr(asyncio.StreamWriter, 'start_tls')
+        ssl_context = context if mode == 'ssl' and not split_tls else None
+        with self.metrics.timer('connect'):
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=ssl_context), self.timeout)
+        if split_tls:
+            with self.metrics.timer('tls'):
+                await asyncio.wait_for(self.writer.start_tls(context), self.timeout)
+        code, resp = await self.getreply()
+        if code != 220:
+            raise smtplib.SMTPConnectError(code, resp)
+        await self.ehlo()
+        if mode == 'starttls':
+            if not self.has_extn('starttls'):
+                raise smtplib.SMTPNotSupportedError("伺服器不支援 STARTTLS")
+            with self.metrics.timer('tls'):
+                code, resp = await self.command('STARTTLS')
+                if code != 220:
+                    raise smtplib.SMTPResponseException(code, resp)
+                await asyncio.wait_for(self.writer.start_tls(context), self.timeout)
+                await self.ehlo()
+
+    async def login(self, username, password):
+        with self.metrics.timer('auth'):
+            await self._login(username, password)
+
+    async def _login(self, username, password):
+        mechanisms = self.extensions.get('auth', '').upper().split()
+        if 'PLAIN' in mechanisms or 'LOGIN' not in mechanisms:
+            token = base64.b64encode(f"\0{username}\0{password}".encode('utf-8')).decode('ascii')
+            code, resp = await self.command(f'AUTH PLAIN {token}')
+        else:
+            code, resp = await self.command('AUTH LOGIN')
+            for value in (username, password):
+                if code != 334:
+                    break
+                code, resp = await self.command(base64.b64encode(value.encode('utf-8')).decode('ascii'))
+        if code not in (235, 503):
+            raise smtplib.SMTPAuthenticationError(code, resp)
+
+    # 寄出一封郵件，message 為 mime_stream.StreamingMessage (或以 CRLF 換行的完整郵件位元組)；
+    # 回傳被拒收的收件人 {地址: (代碼, 訊息)}
+    async def sendmail(self, from_addr, to_addrs, message):
+        message = as_streaming(message)
+        commands = envelope_commands(from_addr, to_addrs, message.size, self.has_extn)
+        if self.has_extn('pipelining'):
+            await self.send(b''.join(commands))
+            replies = [await self.getreply() for _ in commands]
+        else:
+            replies = []
+            for command in commands:
+                await self.send(command)
+                replies.append(await self.getreply())
+                if replies[0][0] != 250:
+                    break
+
+        code, resp = replies[0]
+        if code != 250:
+            await self.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+        refused = {addr: reply for addr, reply in zip(to_addrs, replies[1:]) if reply[0] not in (250, 251)}
+        if len(refused) == len(to_addrs):
+            await self.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        code, resp = await self.command('DATA')
+        if code != 354:
+            await self.rset()
+            raise smtplib.SMTPDataError(code, resp)
+        # 逐段寫入，每段等待傳送緩衝區消化後再寫下一段，每封郵件只佔用一個區塊的記憶體
+        for chunk in message.data_chunks():
+            await self.send(chunk)
+        code, resp = await self.getreply()
+        if code != 250:
+            await self.rset()
+            raise smtplib.SMTPDataError(code, resp)
+        return refused
+
+    async def rset(self):
+        try:
+            code, _ = await self.command('RSET')
+            return code == 250
+        except Exception:
+            return False
+
+    async def noop(self):
+        try:
+            code, _ = await self.command('NOOP')
+            return code == 250
+        except Exception:
+            return False
+
+    async def close(self):
+        if self.writer is None:
+            return
+        try:
+            await asyncio.wait_for(self.command('QUIT'), 5)
+        except Exception:
+            pass
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+
+# asyncio 版本的 SMTP 連線池，設定與 SMTPConnectionPool 相同
+# 同樣先嘗試 SMTP_SSL，失敗則改用 STARTTLS，並記住成功的方式
+class AsyncSMTPPool:
+    def __init__(self, smtp_settings, limiter_factory=None, metrics=None):
+        self.settings = smtp_settings
+        self.limiter_factory = limiter_factory
+        self.metrics = metrics or Metrics()
+        self.pool_size = max(1, smtp_settings.get('pool_size', 1))
+        self.max_messages = max(0, smtp_settings.get('max_messages_per_connection', 0))
+        self.idle_check_seconds = smtp_settings.get('idle_check_seconds', 30)
+        self.timeout = smtp_settings.get('timeout', 60)
+        self.context = create_ssl_context()
+        self._idle = []
+        self._slots = asyncio.Semaphore(self.pool_size)
+        self._mode = None
+
+    async def _open(self):
+        s = self.settings
+        if not s.get('use_tls', True):
+            conn = AsyncSMTPConnection(self.timeout, self.metrics)
+            try:
+                await conn.connect(s['server'], s['port'], None, 'plain')
+                if s.get('username'):
+                    await conn.login(s['username'], s['password'])
+            except Exception:
+                await conn.close()
+                raise
+            self.metrics.inc('connections_total', mode='plain')
+            return conn
+
+        if self._mode != 'starttls':
+            conn = AsyncSMTPConnection(self.timeout, self.metrics)
+            try:
+                await conn.connect(s['server'], s['port'], self.context, 'ssl')
+            except Exception as e_ssl:
+                await conn.close()
+                if self._mode == 'ssl':
+                    raise
+                print(f"SMTP_SSL 連接失敗: {e_ssl}. 嘗試使用 STARTTLS...")
+            else:
+                # TLS 握手成功後的錯誤 (例如帳號密碼錯誤) 直接拋出，不改用 STARTTLS (同 smtp_pool)
+                self._mode = 'ssl'
+                try:
+                    await conn.login(s['username'], s['password'])
+                except Exception:
+                    await conn.close()
+                    raise
+                self.metrics.inc('connections_total', mode='ssl')
+                return conn
+
+        conn = AsyncSMTPConnection(self.timeout, self.metrics)
+        try:
+            await conn.connect(s['server'], s['port'], self.context, 'starttls')
+            await conn.login(s['username'], s['password'])
+        except Exception:
+            await conn.close()
+            raise
+        self._mode = 'starttls'
+        self.metrics.inc('connections_total', mode='starttls')
+        return conn
+
+    async def _acquire(self):
+        while self._idle:
+            conn = self._idle.pop()
+            if time.monotonic() - conn.last_used < self.idle_check_seconds or await conn.noop():
+                conn.reused = True
+                return conn
+            await conn.close()
+        conn = await self._open()
+        if self.limiter_factory:
+            conn.limiter = self.limiter_factory()
+        return conn
+
+    async def _release(self, conn, broken=False):
+        if broken or (self.max_messages and conn.message_count >= self.max_messages):
+            await conn.close()
+            return
+        conn.last_used = time.monotonic()
+        self._idle.append(conn)
+
+    # 寄出一封郵件，回傳被拒收的收件人，失敗時拋出例外
+    # 每條連線同一時間只處理一筆交易；重複使用的連線若已被伺服器斷開，改用新連線重試一次
+    async def sendmail(self, from_addr, to_addrs, message):
+        async with self._slots:
+            retried = False
+            while True:
+                conn = await self._acquire()
+                if conn.limiter:
+                    await wait_for_limiter(conn.limiter)
+                try:
+                    with self.metrics.timer('data'):
+                        refused = await conn.sendmail(from_addr, to_addrs, message)
+                except smtplib.SMTPServerDisconnected:
+                    await self._release(conn, broken=True)
+                    if conn.reused and not retried:
+                        retried = True
+                        continue
+                    raise
+                except smtplib.SMTPException:
+                    await self._release(conn, broken=not await conn.rset())
+                    raise
+                except BaseException:
+                    # 逾時、取消或網路錯誤：連線狀態不明，直接關閉
+                    await self._release(conn, broken=True)
+                    raise
+                conn.message_count += 1
+                await self._release(conn)
+                return refused
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(conn.close() for conn in idle), return_exceptions=True)
+
+
+# 在事件迴圈中等待速率限制器 (rate_limit.RateLimiter) 的額度，不阻塞其他工作
+async def wait_for_limiter(limiter):
+    while True:
+        wait_seconds = limiter.try_acquire()
+        if wait_seconds <= 0:
+            return
+        await asyncio.sleep(wait_seconds)
+
+
+# asyncio 版本的派送引擎，介面與 dispatcher.dispatch 相同，但 send_func 為協程
+# - concurrency: 同時進行中的寄送數上限 (實際連線數仍受連線池大小限制)
+# - scheduler: 選填的排程器，用法與 dispatcher.dispatch 相同
+# - 收到 SIGINT 時停止派送新郵件，等待進行中的郵件寄完 (或逾時) 後結束；再按一次則立即取消
+# 回傳 True 表示全部派送完成，False 表示因中斷而提前結束
+async def async_dispatch(jobs, send_func, on_result, concurrency=100, limiter=None, scheduler=None):
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    in_flight = {}
+
+    def on_sigint():
+        if not stopping.is_set():
+            print(f"\n收到中斷訊號，停止派送新郵件，等待進行中的 {len(in_flight)} 封寄送完成... (再按一次 Ctrl-C 立即取消)")
+            stopping.set()
+        else:
+            for task in in_flight:
+                task.cancel()
+
+    try:
+        loop.add_signal_handler(signal.SIGINT, on_sigint)
+        handles_signal = True
+    except (NotImplementedError, RuntimeError):
+        handles_signal = False  # 例如 Windows 或非主執行緒
+
+    async def collect(timeout=None):
+        if not in_flight:
+            if timeout:
+                # 沒有進行中的寄送，只是在等待重試或速率額度；收到中斷訊號時提前結束等待
+                try:
+                    await asyncio.wait_for(stopping.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return
+        done, _ = await asyncio.wait(in_flight, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            job = in_flight.pop(task)
+            on_result(job, asyncio.CancelledError("寄送已取消") if task.cancelled() else task.exception())
+
+    jobs = iter(jobs)
+    exhausted = False
+    try:
+        while not stopping.is_set():
+            job = scheduler.pop_ready() if scheduler is not None else None
+            scheduled = job is not None
+            if job is None and not exhausted:
+                job = next(jobs, None)
+                exhausted = job is None
+            if job is None:
+                delay = scheduler.next_delay() if scheduler is not None else None
+                if not in_flight and delay is None:
+                    break
+                await collect(delay)
+                continue
+
+            while len(in_flight) >= concurrency and not stopping.is_set():
+                await collect()
+            while limiter and not stopping.is_set():
+                wait_seconds = limiter.try_acquire()
+                if wait_seconds <= 0:
+                    break
+                await collect(wait_seconds)
+            if stopping.is_set():
+                # 已取出但尚未送出的項目放回排程器，由呼叫端一併處理
+                if scheduled:
+                    scheduler.requeue(job)
+                break
+            in_flight[asyncio.ensure_future(send_func(job))] = job
+            # 讓新建立的工作有機會開始執行，並處理已完成的結果
+            await asyncio.sleep(0)
+            if in_flight:
+                await collect(0)
+        while in_flight:
+            await collect()
+    finally:
+        if handles_signal:
+            loop.remove_signal_handler(signal.SIGINT)
+    return not stopping.is_set()
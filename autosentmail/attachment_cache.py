@@ -0,0 +1,144 @@
+import base64
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from email.mime.base import MIMEBase
+
+
+# 每次讀取並編碼的原始資料大小，需為 57 的倍數 (base64 每行 76 字元對應 57 位元組)
+_ENCODE_BLOCK = 57 * 1024
+
+
+# 與 email.encoders.encode_base64 (MIMEApplication 預設的編碼方式) 相同的編碼結果，
+# 以 CRLF 換行，可直接寫入 SMTP DATA
+def _encode_base64(data):
+    return base64.encodebytes(data).replace(b'\n', b'\r\n')
+
+
+# raw_size 位元組編碼後的大小 (含 CRLF)
+def encoded_size(raw_size):
+    full_lines, rest = divmod(raw_size, 57)
+    return full_lines * 78 + ((rest + 2) // 3 * 4 + 2 if rest else 0)
+
+
+# 產生與 MIMEApplication 相同標頭的附件部分；payload 為已編碼的內容，
+# 串流寄送時為佔位字串，寫出時再換成附件內容 (見 mime_stream.build_streaming_message)
+def _attachment_mime(filename, subtype, payload):
+    part = MIMEBase('application', subtype)
+    part['Content-Transfer-Encoding'] = 'base64'
+    part.set_payload(payload)
+    part.add_header('Content-Disposition', 'attachment', filename=filename)
+    return part
+
+
+# 已完成 base64 編碼的附件，可重複產生 MIME 附件部分而不需重新讀檔與編碼
+class EncodedAttachment:
+    def __init__(self, filename, subtype, encoded, raw_size):
+        self.filename = filename
+        self.subtype = subtype
+        self.encoded = encoded
+        self.raw_size = raw_size
+
+    @property
+    def size(self):
+        return len(self.encoded)
+
+    def to_mime(self, payload=None):
+        return _attachment_mime(self.filename, self.subtype, self.encoded.decode('ascii') if payload is None else payload)
+
+    # 串流寄送時逐段取出已編碼的內容，不複製資料
+    def chunks(self, chunk_size):
+        data = memoryview(self.encoded)
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+
+
+# 超過快取上限的附件不保留編碼結果，寄送時才由檔案逐段讀取並編碼，每封郵件只佔用一個區塊的記憶體
+class StreamedAttachment:
+    def __init__(self, path, subtype, raw_size):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.subtype = subtype
+        self.raw_size = raw_size
+
+    @property
+    def size(self):
+        return encoded_size(self.raw_size)
+
+    def to_mime(self, payload=None):
+        if payload is None:
+            with open(self.path, 'rb') as f:
+                payload = _encode_base64(f.read()).decode('ascii')
+        return _attachment_mime(self.filename, self.subtype, payload)
+
+    # chunk_size 只是建議值，實際以編碼區塊為單位
+    def chunks(self, chunk_size):
+        with open(self.path, 'rb') as f:
+            for block in iter(lambda: f.read(_ENCODE_BLOCK), b''):
+                yield _encode_base64(block)
+
+
+# 附件快取：以 (路徑, 修改時間, 檔案大小) 為鍵保存已編碼的附件，超過記憶體上限時淘汰最久未使用的項目
+# - budget_bytes: 快取可使用的記憶體上限 (以編碼後大小計算)，0 表示停用快取；
+#   編碼後超過上限的檔案回傳 StreamedAttachment，寄送時才逐段讀檔編碼
+# - mmap_threshold: 檔案大小超過此值時以 mmap 讀取，避免先複製一份完整檔案內容
+class AttachmentCache:
+    def __init__(self, budget_bytes=64 * 1024 * 1024, mmap_threshold=1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.mmap_threshold = mmap_threshold
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # 逐區塊編碼後直接填入預先配置的緩衝區，編碼期間不會同時存在完整的原始內容與多份編碼結果
+    def _read_and_encode(self, path, size):
+        encoded = bytearray(encoded_size(size))
+        pos = 0
+
+        def fill(blocks):
+            nonlocal pos
+            for block in blocks:
+                block = _encode_base64(block)
+                encoded[pos:pos + len(block)] = block
+                pos += len(block)
+
+        with open(path, 'rb') as f:
+            if size >= self.mmap_threshold and size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                    fill(view[i:i + _ENCODE_BLOCK] for i in range(0, len(view), _ENCODE_BLOCK))
+            else:
+                fill(iter(lambda: f.read(_ENCODE_BLOCK), b''))
+        del encoded[pos:]  # 檔案在 stat 之後被修改時，大小可能與預估不同
+        return encoded
+
+    def get(self, path, subtype='pdf'):
+        path = os.fspath(path)
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size, subtype)
+
+        with self._lock:
+            attachment = self._entries.get(key)
+            if attachment is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return attachment
+            self.misses += 1
+
+        if encoded_size(st.st_size) > self.budget_bytes:
+            return StreamedAttachment(path, subtype, st.st_size)
+        attachment = EncodedAttachment(os.path.basename(path), subtype,
+                                       self._read_and_encode(path, st.st_size), st.st_size)
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = attachment
+                self.used_bytes += attachment.size
+            while self.used_bytes > self.budget_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.used_bytes -= evicted.size
+                self.evictions += 1
+        return attachment
@@ -0,0 +1,89 @@
+import smtplib
+from collections import OrderedDict
+
+from .mime_stream import as_streaming
+
+
+# 產生 MAIL FROM 與所有 RCPT TO 指令 (以 CRLF 結尾的位元組)，has_extn 為查詢伺服器是否支援某個 ESMTP 擴充的函式
+# 地址含非 ASCII 字元 (國際化信箱) 時與 smtplib.send_message 相同加上 SMTPUTF8 並以 UTF-8 編碼，
+# 伺服器不支援 SMTPUTF8 時拋出 SMTPNotSupportedError
+def envelope_commands(from_addr, to_addrs, size, has_extn):
+    options = f" SIZE={size}" if has_extn('size') else ''
+    encoding = 'ascii'
+    try:
+        ''.join([from_addr, *to_addrs]).encode('ascii')
+    except UnicodeEncodeError:
+        if not has_extn('smtputf8'):
+            raise smtplib.SMTPNotSupportedError("寄件人或收件人地址含非 ASCII 字元，但 SMTP 伺服器不支援 SMTPUTF8")
+        options += ' SMTPUTF8 BODY=8BITMIME'
+        encoding = 'utf-8'
+    commands = [f"MAIL FROM:{smtplib.quoteaddr(from_addr)}{options}"]
+    commands += [f"RCPT TO:{smtplib.quoteaddr(addr)}" for addr in to_addrs]
+    return [(command + '\r\n').encode(encoding) for command in commands]
+
+
+# 以一次 SMTP 交易將同一封郵件寄給多位收件人，回傳被拒收的收件人 {地址: (代碼, 訊息)}
+# 伺服器支援 ESMTP PIPELINING 時，MAIL FROM 與所有 RCPT TO 一次送出再依序讀取回應，
+# 省去每個指令各一次的來回等待；不支援時逐一送出
+# message 為 mime_stream.StreamingMessage (或完整的郵件位元組)，DATA 內容逐段寫入 socket
+# 全部收件人都被拒收時拋出 SMTPRecipientsRefused
+def send_pipelined(server, from_addr, to_addrs, message):
+    message = as_streaming(message)
+    server.ehlo_or_helo_if_needed()
+    commands = envelope_commands(from_addr, to_addrs, message.size, server.has_extn)
+    if server.has_extn('pipelining'):
+        server.send(b''.join(commands))
+        code, resp = server.getreply()
+        rcpt_replies = [server.getreply() for _ in to_addrs]
+    else:
+        server.send(commands[0])
+        code, resp = server.getreply()
+        rcpt_replies = []
+        if code == 250:
+            for command in commands[1:]:
+                server.send(command)
+                rcpt_replies.append(server.getreply())
+    if code != 250:
+        server.rset()
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+    refused = {addr: reply for addr, reply in zip(to_addrs, rcpt_replies) if reply[0] not in (250, 251)}
+    if len(refused) == len(to_addrs):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+
+    send_data(server, message)
+    return refused
+
+
+# 送出 DATA 指令後逐段寫入郵件內容，記憶體中只需保留目前寫出的區塊
+def send_data(server, message):
+    code, resp = server.docmd('DATA')
+    if code != 354:
+        server.rset()
+        raise smtplib.SMTPDataError(code, resp)
+    for chunk in message.data_chunks():
+        server.send(chunk)
+    code, resp = server.getreply()
+    if code != 250:
+        server.rset()
+        raise smtplib.SMTPDataError(code, resp)
+
+
+# 將內容完全相同的寄送項目分組，每組最多 max_recipients 位收件人
+# - key_func(job): 回傳代表郵件內容的鍵，鍵相同代表內容逐位元組相同
+# - max_pending_groups: 等待湊滿的組數上限，超過時先送出最早的一組，避免串流讀取時佔用過多記憶體
+# 每組以 {'batch': [job, ...]} 產生
+def group_identical(jobs, key_func, max_recipients=50, max_pending_groups=1000):
+    pending = OrderedDict()
+    for job in jobs:
+        key = key_func(job)
+        group = pending.setdefault(key, [])
+        group.append(job)
+        if len(group) >= max_recipients:
+            yield {'batch': pending.pop(key)}
+        elif len(pending) > max_pending_groups:
+            _, oldest = pending.popitem(last=False)
+            yield {'batch': oldest}
+    for group in pending.values():
+        yield {'batch': group}
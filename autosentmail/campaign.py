@@ -0,0 +1,216 @@
+import configparser
+from collections import deque
+from pathlib import Path
+
+from .rate_limit import RateLimiter
+
+# 未指定工作檔、config.ini 也沒有 [JOB] 區段時使用的寄送工作 (相對於目前工作目錄)
+DEFAULT_JOB = {
+    'course_name': "2025 未來造浪 AI Studio",
+    'contacts': "data/0419 聯絡資料.xlsx",
+    'certificate_dir': "data/0419 證書"
+}
+
+
+# 工作檔格式錯誤
+class JobFileError(Exception):
+    pass
+
+
+# 讀取一個寄送工作 (課程) 的設定，section 為 configparser 中的 [JOB] 區段
+# 路徑相對於 base_dir；範本未設定時為 None，由呼叫端改用 config.ini [TEMPLATE] 的範本
+def read_job(config, section, base_dir, name=None, defaults=DEFAULT_JOB):
+    def path(key, fallback=None):
+        value = config.get(section, key, fallback='').strip()
+        if not value:
+            return Path(fallback) if fallback else None
+        value = Path(value)
+        return value if value.is_absolute() else Path(base_dir) / value
+
+    contacts = path('contacts', defaults.get('contacts'))
+    return {
+        # 課程代號，用於輸出訊息、寄送指標與事件記錄，預設為工作檔或聯絡資料的檔名
+        'name': config.get(section, 'name', fallback='').strip() or name or (contacts.stem if contacts else 'JOB'),
+        'course_name': config.get(section, 'course_name', fallback=defaults.get('course_name', '')).strip(),
+        'contacts': contacts,
+        'certificate_dir': path('certificate_dir', defaults.get('certificate_dir')),
+        'subject': path('subject'),
+        'body': path('body'),
+        'html_body': path('html_body'),
+        'journal': path('journal'), # 未設定時為聯絡資料檔旁的 .journal.jsonl
+        # 證書範本 PDF (選填)：設定時寄送前先依聯絡資料產生證書到 certificate_dir (certgen.py)
+        'certificate_template': path('certificate_template'),
+        'certificate_text': config.get(section, 'certificate_text', fallback='').strip(), # 證書上的文字與位置，每行一段
+        'certificate_filename': config.get(section, 'certificate_filename', fallback='').strip(), # 產生的證書檔名範本
+        # 與其他同時執行的課程分享連線與全域速率的比例，以及此課程自己的上限 (0 表示不限)
+        'weight': config.getfloat(section, 'weight', fallback=1),
+        'rate_per_minute': config.getfloat(section, 'rate_per_minute', fallback=0),
+        'rate_per_hour': config.getfloat(section, 'rate_per_hour', fallback=0),
+        'burst': config.getint(section, 'burst', fallback=1),
+        'max_concurrency': config.getint(section, 'max_concurrency', fallback=0)
+    }
+
+
+# 讀取工作檔 (例如 jobs/0419.ini)，檔案中需有 [JOB] 區段，名稱預設為檔名
+def load_job_file(path):
+    path = Path(path)
+    config = configparser.ConfigParser()
+    try:
+        if not config.read(path, encoding='utf-8'):
+            raise JobFileError(f"工作檔 '{path}' 不存在")
+    except configparser.Error as e:
+        raise JobFileError(f"工作檔 '{path}' 格式錯誤: {e}")
+    if 'JOB' not in config:
+        raise JobFileError(f"工作檔 '{path}' 缺少 [JOB] 區段")
+    job = read_job(config, 'JOB', path.parent, path.stem, defaults={})
+    missing = [key for key in ('contacts', 'certificate_dir') if job[key] is None]
+    if missing:
+        raise JobFileError(f"工作檔 '{path}' 缺少 {', '.join(missing)} 設定")
+    return job
+
+
+# 一個寄送工作 (課程) 執行期間的狀態與統計
+class Campaign:
+    def __init__(self, job, template):
+        self.name = job['name']
+        self.job = job
+        self.course_name = job['course_name']
+        self.contacts_path = Path(job['contacts'])
+        self.certificate_dir = Path(job['certificate_dir'])
+        self.template = template
+        self.tag = ''  # 同時執行多個課程時加在輸出訊息前，例如 [0419]
+        self.contacts = None
+        self.certificate_index = None
+        self.preflight = None
+        self.send_rows = []
+        self.journal = None
+        self.retries = None  # 此課程的 retry.RetryScheduler
+        self.rows = 0  # 已讀取的聯絡資料筆數
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.already_sent = 0
+        self.not_sent = 0
+        self.failed_info = []
+
+
+# 沒有其他排程需求時的項目來源：新項目依序取出，到期的重試優先
+# 提供與 domain_scheduler.DomainScheduler 相同的 pop_ready() / next_delay() / done() / requeue() / drain()
+class JobSource:
+    def __init__(self, jobs, retries=None):
+        self.jobs = iter(jobs)
+        self.exhausted = False
+        self.retries = retries
+        self.requeued = deque()
+
+    def __len__(self):
+        return len(self.requeued) + (len(self.retries) if self.retries is not None else 0)
+
+    def pop_ready(self):
+        if self.requeued:
+            return self.requeued.popleft()
+        if self.retries is not None:
+            job = self.retries.pop_ready()
+            if job is not None:
+                return job
+        if not self.exhausted:
+            job = next(self.jobs, None)
+            if job is not None:
+                return job
+            self.exhausted = True
+        return None
+
+    def next_delay(self):
+        if self.requeued or not self.exhausted:
+            return 0.0
+        return self.retries.next_delay() if self.retries is not None else None
+
+    def done(self, job):
+        pass
+
+    def requeue(self, job):
+        self.requeued.appendleft(job)
+
+    def drain(self):
+        jobs = list(self.requeued)
+        self.requeued.clear()
+        if self.retries is not None:
+            jobs += self.retries.drain()
+        return jobs
+
+
+# 同時執行多個課程時，公平分配共用的連線與全域速率：
+# 每次輪到送出時，選擇 (已送出數 / weight) 最小且有項目可寄送的課程，被限速或暫時沒有項目的課程不會卡住其他課程
+# - sources: [(Campaign, 項目來源)]，來源為 JobSource 或 domain_scheduler.DomainScheduler
+# 各課程可另外以 job 的 rate_per_minute / rate_per_hour / max_concurrency 設定自己的上限
+# 項目需含 'campaign' 欄位；介面與 DomainScheduler 相同，可直接交給派送引擎
+class CampaignScheduler:
+    def __init__(self, sources):
+        self.sources = sources
+        self.limiters = {}
+        self.in_flight = {}
+        self.dispatched = {}
+        for campaign, _ in sources:
+            job = campaign.job
+            limiter = RateLimiter(job['rate_per_minute'], job['rate_per_hour'], job['burst'])
+            self.limiters[campaign.name] = limiter if limiter.buckets else None
+            self.in_flight[campaign.name] = 0
+            self.dispatched[campaign.name] = 0
+
+    def __len__(self):
+        return sum(len(source) for _, source in self.sources)
+
+    def _at_capacity(self, campaign):
+        cap = campaign.job['max_concurrency']
+        return bool(cap) and self.in_flight[campaign.name] >= cap
+
+    def _fair_order(self):
+        return sorted(self.sources, key=lambda item: self.dispatched[item[0].name] / max(0.001, item[0].job['weight']))
+
+    def pop_ready(self):
+        for campaign, source in self._fair_order():
+            if self._at_capacity(campaign):
+                continue
+            limiter = self.limiters[campaign.name]
+            if limiter and limiter.delay() > 0:
+                continue
+            job = source.pop_ready()
+            if job is None:
+                continue
+            if limiter:
+                limiter.try_acquire()
+            self.in_flight[campaign.name] += 1
+            self.dispatched[campaign.name] += 1
+            return job
+        return None
+
+    # 距離任一課程可能有項目可寄送的秒數；只能等待進行中的寄送完成 (或已全部寄完) 時回傳 None
+    def next_delay(self):
+        delays = []
+        for campaign, source in self.sources:
+            if self._at_capacity(campaign):
+                continue
+            source_delay = source.next_delay()
+            if source_delay is None:
+                continue
+            limiter = self.limiters[campaign.name]
+            delays.append(max(source_delay, limiter.delay() if limiter else 0.0))
+        return min(delays) if delays else None
+
+    def _source(self, job):
+        campaign = job['campaign'] if 'batch' not in job else job['batch'][0]['campaign']
+        return campaign, next(source for c, source in self.sources if c is campaign)
+
+    def done(self, job):
+        campaign, source = self._source(job)
+        self.in_flight[campaign.name] -= 1
+        source.done(job)
+
+    def requeue(self, job):
+        campaign, source = self._source(job)
+        self.in_flight[campaign.name] -= 1
+        self.dispatched[campaign.name] -= 1
+        source.requeue(job)
+
+    def drain(self):
+        return [job for _, source in self.sources for job in source.drain()]
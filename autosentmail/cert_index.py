@@ -0,0 +1,129 @@
+import difflib
+import json
+import os
+import re
+import unicodedata
+from pathlib import Path
+
+# 預設檔名格式：「課程名稱證書-姓名.pdf」或「證書-姓名.pdf」，取最後一個 '-' 之後為姓名
+DEFAULT_FILENAME_PATTERNS = [r'^(?:.*-)?(?P<name>[^-]+)$']
+INDEX_CACHE_VERSION = 1
+
+
+# 正規化姓名：NFKC（全形/半形、相容字元統一）、移除所有空白、不分大小寫
+def normalize_name(name):
+    name = unicodedata.normalize('NFKC', str(name))
+    return ''.join(name.split()).casefold()
+
+
+# 預設索引快取放在證書目錄旁（放在目錄內會改變目錄的修改時間，使快取永遠失效）
+def default_cache_path(directory):
+    directory = Path(directory)
+    return directory.parent / f".{directory.name}.cert_index.json"
+
+
+# 證書索引：以正規化後的姓名查找證書 PDF
+# - patterns: 從檔名 (不含副檔名) 取出姓名的正規表示式，需包含名為 name 的群組，依序嘗試
+# - cache_path: 索引快取檔；目錄修改時間未變時直接使用快取，不需重新掃描
+#   目錄有變動時只解析新出現的檔名，已刪除的檔案自動移除
+# - fuzzy / fuzzy_cutoff: 找不到完全相符的姓名時，改用相似度比對（0~1，越高越嚴格）
+class CertificateIndex:
+    def __init__(self, directory, patterns=None, cache_path=None, fuzzy=False, fuzzy_cutoff=0.85):
+        self.directory = Path(directory)
+        self.pattern_sources = list(patterns or DEFAULT_FILENAME_PATTERNS)
+        self.patterns = [re.compile(p) for p in self.pattern_sources]
+        self.cache_path = Path(cache_path) if cache_path else default_cache_path(self.directory)
+        self.fuzzy = fuzzy
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.files = {}  # 檔名 -> 正規化姓名 (無法解析時為空字串)
+        self.by_name = {}  # 正規化姓名 -> [證書路徑, ...]
+        self.duplicates = {}  # 同一姓名對應多個檔案
+        self.reused_count = 0
+        self.parsed_count = 0
+        self._fuzzy_cache = {}
+
+    def _extract_name(self, stem):
+        for pattern in self.patterns:
+            match = pattern.search(stem)
+            if match and match.group('name').strip():
+                return normalize_name(match.group('name'))
+        return ''
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cache.get('version') != INDEX_CACHE_VERSION or cache.get('patterns') != self.pattern_sources:
+            return None
+        return cache
+
+    def _save_cache(self, dir_mtime):
+        cache = {
+            'version': INDEX_CACHE_VERSION,
+            'directory': str(self.directory),
+            'patterns': self.pattern_sources,
+            'dir_mtime': dir_mtime,
+            'files': self.files
+        }
+        tmp_path = self.cache_path.with_name(self.cache_path.name + '.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"警告: 無法寫入證書索引快取 '{self.cache_path}': {e}")
+
+    # 建立（或從快取載入）索引
+    def build(self):
+        dir_mtime = os.stat(self.directory).st_mtime_ns
+        cache = self._load_cache()
+        cached_files = cache['files'] if cache else {}
+
+        if cache and cache.get('dir_mtime') == dir_mtime:
+            self.files = cached_files
+            self.reused_count = len(cached_files)
+        else:
+            self.files = {}
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.name.lower().endswith('.pdf') or not entry.is_file():
+                        continue
+                    if entry.name in cached_files:
+                        self.files[entry.name] = cached_files[entry.name]
+                        self.reused_count += 1
+                    else:
+                        self.files[entry.name] = self._extract_name(entry.name[:-4])
+                        self.parsed_count += 1
+            self._save_cache(dir_mtime)
+
+        self.by_name = {}
+        for file_name, key in sorted(self.files.items()):
+            if key:
+                self.by_name.setdefault(key, []).append(self.directory / file_name)
+        self.duplicates = {key: paths for key, paths in self.by_name.items() if len(paths) > 1}
+        return self
+
+    def __len__(self):
+        return len(self.by_name)
+
+    # 查找證書，回傳 (路徑, 比對方式)
+    # 比對方式: 'exact'、'fuzzy'、'duplicate' (同名多個檔案，無法判斷，路徑為 None) 或 None (找不到)
+    def lookup(self, name):
+        key = normalize_name(name)
+        paths = self.by_name.get(key)
+        if not paths and self.fuzzy and key:
+            if key not in self._fuzzy_cache:
+                matches = difflib.get_close_matches(key, self.by_name.keys(), n=1, cutoff=self.fuzzy_cutoff)
+                self._fuzzy_cache[key] = matches[0] if matches else None
+            fuzzy_key = self._fuzzy_cache[key]
+            if fuzzy_key:
+                paths = self.by_name[fuzzy_key]
+                if len(paths) == 1:
+                    return paths[0], 'fuzzy'
+        if not paths:
+            return None, None
+        if len(paths) > 1:
+            return None, 'duplicate'
+        return paths[0], 'exact'
@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+from .mail_template import Template, TemplateError
+from .pdf_writer import PageOverlay
+
+# 證書產生：以證書範本 (PDF 的第一頁) 加上每位學員的姓名等文字，產生「課程名稱證書-姓名.pdf」放入證書目錄，
+# 並回傳每一行對應的證書路徑，寄送時直接使用 (不再依檔名解析姓名)；多份證書以行程池並行產生 (每個行程只載入一次範本)，
+# 並依內容雜湊記錄於快取，範本、文字位置與姓名都沒有變動的證書不會重新產生
+
+RENDER_CACHE_VERSION = 1
+DEFAULT_FILENAME = '${課程名稱}證書-${姓名}.pdf'
+ALIGNMENTS = ('left', 'center', 'right')
+# 檔名中不能使用的字元
+_UNSAFE_FILENAME = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+_COLOR = re.compile(r'^#([0-9A-Fa-f]{6})$')
+
+
+class LayoutError(Exception):
+    pass
+
+
+# 解析證書上的文字設定，每行一段文字: <文字範本> @ x, y, 字級[, 對齊][, 顏色]
+# - 文字範本與郵件範本相同以 ${欄位名稱} 引用聯絡資料欄位，例如 ${姓名}
+# - x, y 為點 (1/72 英吋)，以頁面左下角為原點；對齊為 left (預設)、center、right，x 為對齊的位置
+# - 顏色為 #RRGGBB，預設為黑色
+# 例如: ${姓名} @ 421, 300, 36, center, #8B0000
+def parse_layout(source):
+    layout = []
+    for line in source.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        text, separator, params = line.rpartition('@')
+        fields = [field.strip() for field in params.split(',')]
+        if not separator or not text.strip() or len(fields) < 3:
+            raise LayoutError(f"證書文字設定格式錯誤: '{line}' (格式: <文字> @ x, y, 字級[, 對齊][, 顏色])")
+        try:
+            x, y, size = (float(field) for field in fields[:3])
+        except ValueError:
+            raise LayoutError(f"證書文字設定的位置或字級不是數字: '{line}'")
+        align, color = 'left', (0.0, 0.0, 0.0)
+        for field in fields[3:]:
+            match = _COLOR.match(field)
+            if match:
+                color = tuple(int(match.group(1)[i:i + 2], 16) / 255 for i in (0, 2, 4))
+            elif field.lower() in ALIGNMENTS:
+                align = field.lower()
+            elif field:
+                raise LayoutError(f"證書文字設定的對齊方式或顏色錯誤: '{field}' (對齊: {', '.join(ALIGNMENTS)}，顏色: #RRGGBB)")
+        layout.append((Template(text.strip(), '證書文字'), x, y, size, align, color))
+    if not layout:
+        raise LayoutError("未設定證書上的文字 (certificate_text)")
+    return layout
+
+
+# 預設產生快取放在證書目錄旁 (與 cert_index 的索引快取相同位置)
+def default_cache_path(directory):
+    directory = Path(directory)
+    return directory.parent / f".{directory.name}.certgen.json"
+
+
+# 行程池中每個行程的證書範本，由 _init_worker 在行程啟動時設定一次
+_overlay = None
+
+
+def _init_worker(overlay):
+    global _overlay
+    _overlay = overlay
+
+
+# 產生一份證書：先寫入暫存檔再以 rename 取代，中斷時不會留下不完整的證書
+# 回傳 (路徑, 檔案大小, 修改時間)，失敗時大小為 None，修改時間為錯誤訊息
+def _render_one(task):
+    path, texts = task
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            _overlay.write(f, texts)
+        os.replace(tmp_path, path)
+        stat = os.stat(path)
+        return path, stat.st_size, stat.st_mtime_ns
+    except Exception as e:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        return path, None, str(e)
+
+
+# 一次產生的結果統計
+class RenderResult:
+    def __init__(self):
+        self.rendered = 0
+        self.reused = 0
+        self.skipped = 0  # 姓名等檔名欄位為空白
+        self.conflicts = []  # 檔名相同但內容不同的行 (只產生第一行)
+        self.errors = []  # (行號或路徑, 錯誤訊息)
+        self.paths = {}  # 行號 -> 證書路徑 (新產生或沿用的證書；略過、衝突或產生失敗的行不列入)
+        self.workers = 1  # 實際使用的行程數
+        self.elapsed = 0.0
+
+
+# 證書產生器：
+# - template_path: 證書範本 PDF，只使用第一頁
+# - layout: parse_layout 的結果
+# - filename: 證書檔名範本，檔名不能使用的字元以 _ 取代
+# - workers: 行程數 (0 表示 CPU 核心數)，待產生的證書不多時直接在目前行程產生
+class CertificateRenderer:
+    def __init__(self, template_path, layout, filename=DEFAULT_FILENAME, font='MSung-Light', workers=0, cache_path=None):
+        with open(template_path, 'rb') as f:
+            data = f.read()
+        self.overlay = PageOverlay(data, font)
+        self.template_digest = hashlib.sha256(data).hexdigest()
+        self.layout = layout
+        self.filename = Template(filename, '證書檔名')
+        self.font = font
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_path = Path(cache_path) if cache_path else None
+
+    # 文字與檔名用到的所有欄位
+    @property
+    def variables(self):
+        return self.filename.variables.union(*(text.variables for text, *_ in self.layout))
+
+    @staticmethod
+    def _load_cache(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return cache.get('files', {}) if cache.get('version') == RENDER_CACHE_VERSION else {}
+
+    @staticmethod
+    def _save_cache(cache_path, files):
+        tmp_path = cache_path.with_name(cache_path.name + '.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': RENDER_CACHE_VERSION, 'files': files}, f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"警告: 無法寫入證書產生快取 '{cache_path}': {e}")
+
+    # 產生 output_dir 中的證書，rows 為 (行號, 欄位值)；force 時忽略快取全部重新產生
+    def render(self, output_dir, rows, force=False):
+        result = RenderResult()
+        start = time.perf_counter()
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        cache_path = self.cache_path or default_cache_path(output_dir)
+        cache = self._load_cache(cache_path)
+
+        # 在目前行程算出每份證書的檔名、文字與內容雜湊，只有雜湊或檔案有變動的證書交給行程池產生
+        planned = {}  # 檔名 -> 內容雜湊
+        row_files = []  # (行號, 檔名)，檔名與內容都相同的多行對應同一份證書
+        tasks = []
+        for row_num, variables in rows:
+            try:
+                if any(not variables.get(name, '').strip() for name in self.filename.variables):
+                    result.skipped += 1
+                    continue
+                file_name = _UNSAFE_FILENAME.sub('_', self.filename.render(variables)).strip()
+                texts = [(text.render(variables), x, y, size, align, color) for text, x, y, size, align, color in self.layout]
+            except TemplateError as e:
+                result.errors.append((row_num, str(e)))
+                continue
+            key = hashlib.sha256(json.dumps([RENDER_CACHE_VERSION, self.template_digest, self.font, texts],
+                                            ensure_ascii=False).encode('utf-8')).hexdigest()
+            if file_name in planned:
+                if planned[file_name] != key:
+                    result.conflicts.append((row_num, file_name))
+                else:
+                    row_files.append((row_num, file_name))
+                continue
+            planned[file_name] = key
+            row_files.append((row_num, file_name))
+            path = output_dir / file_name
+            cached = cache.get(file_name)
+            if not force and cached and cached[0] == key:
+                try:
+                    stat = os.stat(path)
+                    if [stat.st_size, stat.st_mtime_ns] == cached[1:]:
+                        result.reused += 1
+                        continue
+                except OSError:
+                    pass
+            tasks.append((str(path), texts))
+
+        keys = {str(output_dir / name): (name, key) for name, key in planned.items()}
+        try:
+            if len(tasks) < 2 * self.workers or self.workers == 1:
+                _init_worker(self.overlay)
+                self._collect(map(_render_one, tasks), keys, cache, result)
+            else:
+                # 只有需要行程池時才載入 multiprocessing (試執行與寄送的啟動路徑不需要)
+                from concurrent.futures import ProcessPoolExecutor
+                result.workers = self.workers
+                chunk_size = max(1, min(64, len(tasks) // (self.workers * 4)))
+                with ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.overlay,)) as pool:
+                    self._collect(pool.map(_render_one, tasks, chunksize=chunk_size), keys, cache, result)
+        finally:
+            if tasks:
+                self._save_cache(cache_path, cache)
+        failed = {where for where, _ in result.errors if isinstance(where, str)}
+        for row_num, file_name in row_files:
+            path = output_dir / file_name
+            if str(path) not in failed:
+                result.paths[row_num] = path
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    @staticmethod
+    def _collect(results, keys, cache, result):
+        for path, size, mtime in results:
+            name, key = keys[path]
+            if size is None:
+                cache.pop(name, None)
+                result.errors.append((path, mtime))
+                continue
+            cache[name] = [key, size, mtime]
+            result.rendered += 1
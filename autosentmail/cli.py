@@ -0,0 +1,137 @@
+import argparse
+import sys
+
+# 命令列介面：python -m autosentmail <子命令> [選項]
+# 此模組只使用標準函式庫的 argparse，寄送、檢查等模組在執行對應子命令時才載入，
+# 顯示說明或參數錯誤時不需載入 SMTP、asyncio、openpyxl 等模組
+
+COMMANDS = ('send', 'dry-run', 'resume', 'render', 'spool', 'daemon', 'bench')
+
+# 各子命令未提供的選項的預設值，寄送與檢查模組以相同的屬性讀取
+OPTION_DEFAULTS = {
+    'config': None,
+    'job': None,
+    'contacts': None,
+    'certificate_dir': None,
+    'journal': None,
+    'no_journal': False,
+    'retry_failed': False,
+    'dry_run': False,
+    'resume': False,
+    'report': None,
+    'queue': None,
+    'spool': None,
+    'once': False,
+    'requeue_failed': False,
+    'force': False
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='autosentmail', description="自動化課程證書寄送")
+    subparsers = parser.add_subparsers(dest='command', metavar='<子命令>')
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', help="配置文件路徑 (預設為專案目錄的 config.ini)")
+    common.add_argument('--job', nargs='+', action='extend', metavar='JOB_FILE',
+                        help="寄送工作檔 (例如 jobs/*.ini)，可指定多個同時執行 (預設使用配置文件的 [JOB] 區段)")
+    common.add_argument('--contacts', help="聯絡資料檔路徑 (覆寫預設的聯絡資料檔)")
+    common.add_argument('--certificate-dir', help="證書資料夾路徑 (覆寫預設的證書資料夾)")
+
+    journal = argparse.ArgumentParser(add_help=False)
+    journal.add_argument('--journal', help="寄送日誌檔路徑 (預設為聯絡資料檔旁的 .journal.jsonl)")
+    journal.add_argument('--retry-failed', action='store_true', help="只重寄寄送日誌中記錄為失敗或狀態不明的行")
+
+    send = subparsers.add_parser('send', parents=[common, journal], help="寄送證書郵件",
+                                 description="寄送證書郵件，已寄出的記錄依寄送日誌自動略過")
+    send.add_argument('--no-journal', action='store_true', help="不使用寄送日誌 (不支援中斷後續傳)")
+    send.add_argument('--queue', help="工作佇列 (JSONL) 路徑：只寄送先前 dry-run 產生的佇列中的記錄")
+    send.add_argument('--dry-run', action='store_true', help="同 dry-run 子命令")
+    send.add_argument('--report', help="同 dry-run 子命令的 --report")
+
+    dry_run = subparsers.add_parser('dry-run', parents=[common], help="只檢查聯絡資料並產生報告與工作佇列，不寄送",
+                                    description="整批檢查聯絡資料與證書，寫入檢查報告與工作佇列，不開啟任何 SMTP 連線")
+    dry_run.add_argument('--report', help="寄送前檢查報告 (JSON) 的路徑 (預設為聯絡資料檔旁的 .preflight.json)")
+    dry_run.add_argument('--queue', help="工作佇列 (JSONL) 的寫入路徑 (預設為聯絡資料檔旁的 .queue.jsonl)")
+    dry_run.set_defaults(dry_run=True)
+
+    resume = subparsers.add_parser('resume', parents=[common, journal], help="依寄送日誌繼續中斷的寄送",
+                                   description="繼續先前中斷的寄送：寄送日誌需已存在，已寄出的記錄不會重寄")
+    resume.set_defaults(resume=True)
+
+    render = subparsers.add_parser('render', parents=[common], help="依證書範本產生證書，不寄送",
+                                   description="依工作設定的證書範本 (certificate_template) 為聯絡資料中的每位學員產生證書 PDF，"
+                                               "內容未變動的證書沿用上次產生的檔案；send、dry-run 與 spool 執行前也會自動產生")
+    render.add_argument('--force', action='store_true', help="忽略快取，重新產生所有證書")
+
+    spool = subparsers.add_parser('spool', parents=[common, journal], help="產生郵件並放入 spool，由 daemon 寄出",
+                                  description="兩階段寄送的產生端：執行寄送前檢查後將每封郵件產生為 spool 中的一個檔案，不連線 SMTP")
+    spool.add_argument('--no-journal', action='store_true', help="不使用寄送日誌 (daemon 不記錄寄送結果)")
+    spool.add_argument('--queue', help="工作佇列 (JSONL) 路徑：只產生先前 dry-run 產生的佇列中的記錄")
+    spool.add_argument('--spool', metavar='DIR', help="spool 目錄 (預設為配置文件 [SPOOL] directory)")
+
+    daemon = subparsers.add_parser('daemon', help="持續寄出 spool 中的郵件",
+                                   description="兩階段寄送的寄送端：持續寄出 spool 中的郵件並定期檢查新產生的郵件，Ctrl+C 或 SIGTERM 結束")
+    daemon.add_argument('--config', help="配置文件路徑 (預設為專案目錄的 config.ini)")
+    daemon.add_argument('--spool', metavar='DIR', help="spool 目錄 (預設為配置文件 [SPOOL] directory)")
+    daemon.add_argument('--once', action='store_true', help="spool 中的郵件 (含等待重試) 都處理完即結束")
+    daemon.add_argument('--requeue-failed', action='store_true', help="啟動時將 failed 目錄中的郵件放回重新寄送")
+
+    subparsers.add_parser('bench', help="以本機模擬 SMTP 伺服器執行效能測試 (bench/run_bench.py)",
+                          description="執行 bench/run_bench.py，其餘參數 (例如 --rows 200) 原樣傳入，只能在原始碼目錄中使用")
+    return parser
+
+
+# 讀取配置文件 (config.load_config)，格式錯誤時結束程式
+def load_settings(args):
+    from .config import load_config
+    try:
+        return load_config(args.config)
+    except Exception as e:
+        print(f"讀取配置文件時發生未預期錯誤: {str(e)}")
+        exit(1)
+
+
+def run_bench(bench_args):
+    import subprocess
+    from .config import PROJECT_DIR
+    script = PROJECT_DIR / 'bench' / 'run_bench.py'
+    if not script.exists():
+        print(f"錯誤: 找不到效能測試程式 '{script}'，bench 子命令只能在原始碼目錄中使用。")
+        return 1
+    return subprocess.call([sys.executable, str(script)] + bench_args)
+
+
+# default_command: 未指定子命令時使用的子命令 (main.py 為 send，相容舊的執行方式)；None 時顯示說明
+def main(argv=None, default_command=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if default_command and not (argv and argv[0] in COMMANDS):
+        argv.insert(0, default_command)
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    if args.command == 'bench':
+        return run_bench(extra)
+    if extra:
+        parser.error(f"無法辨識的參數: {' '.join(extra)}")
+
+    options = argparse.Namespace(**{**OPTION_DEFAULTS, **vars(args)})
+    settings = load_settings(options)
+    if options.command == 'render':
+        from .prepare import run_render
+        run_render(settings, options)
+    elif options.command == 'spool':
+        from .spool import run_spool
+        run_spool(settings, options)
+    elif options.command == 'daemon':
+        from .daemon import run_daemon
+        run_daemon(settings, options)
+    elif options.dry_run:
+        from .prepare import run_dry_run
+        run_dry_run(settings, options)
+    else:
+        from .sender import run_send
+        run_send(settings, options)
+    return 0
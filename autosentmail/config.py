@@ -0,0 +1,234 @@
+import configparser
+from pathlib import Path
+
+from .campaign import read_job
+
+# 專案目錄 (main.py、config.ini 與 templates 所在目錄)
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_CONFIG_PATH = PROJECT_DIR / 'config.ini'
+
+
+# 讀取配置文件，config_path 未指定時使用專案目錄的 config.ini
+def load_config(config_path=None):
+    config = configparser.ConfigParser()
+    config_path = Path(config_path) if config_path else DEFAULT_CONFIG_PATH
+
+    if not config_path.exists():
+        # 如果 config.ini 不存在，創建一個包含預設值的
+        config['SMTP'] = {
+            'server': 'smtp.example.com',
+            'port': '465',
+            'username': 'your_username',
+            'password': 'your_password',
+            'sender_email': 'sender@example.com',
+            'use_tls': 'True',
+            'pool_size': '2', # 同時保持的 SMTP 連線數
+            'max_messages_per_connection': '50', # 每條連線寄送幾封後重新連線 (0 表示不限)
+            'idle_check_seconds': '30', # 連線閒置超過此秒數時，重用前先以 NOOP 檢查
+            'timeout': '60'
+        }
+        config['TEST'] = {
+            'recipient_name': '測試姓名', # 用於測試模式下查找證書和郵件稱呼
+            'recipient_email': 'test_recipient@example.com', # 測試郵件的接收地址
+            'enable_test_mode': 'False' # 設為 True 則只發送測試郵件
+        }
+        config['SEND'] = {
+            'workers': '2', # 同時寄送的工作執行緒數
+            'rate_per_minute': '60', # 全域每分鐘寄送上限 (0 表示不限)
+            'rate_per_hour': '0', # 全域每小時寄送上限 (0 表示不限)
+            'burst': '5', # 允許的瞬間突發封數
+            'connection_rate_per_minute': '0' # 每條 SMTP 連線每分鐘寄送上限 (0 表示不限)
+        }
+        with open(config_path, 'w', encoding='utf-8') as configfile:
+            config.write(configfile)
+        print(f"配置文件 '{config_path}' 不存在，已創建預設配置。請修改後再運行。")
+        exit(1) # 首次創建後退出，讓用戶修改
+
+    config.read(config_path, encoding='utf-8')
+    
+    # 讀取一個 SMTP 帳號的設定；[SMTP.<名稱>] 區段中未設定的項目沿用 [SMTP] 的值
+    def smtp_value(section, key, getter='get', fallback=None):
+        if section != 'SMTP' and config.has_option('SMTP', key):
+            fallback = getattr(config, getter)('SMTP', key)
+        value = getattr(config, getter)(section, key, fallback=fallback)
+        if value is None:
+            raise ValueError(f"[{section}] 缺少 {key} 設定")
+        return value
+
+    def smtp_profile(section):
+        return {
+            'server': smtp_value(section, 'server'),
+            'port': smtp_value(section, 'port', 'getint'),
+            'username': smtp_value(section, 'username'),
+            'password': smtp_value(section, 'password'),
+            'sender_email': smtp_value(section, 'sender_email'),
+            'use_tls': smtp_value(section, 'use_tls', 'getboolean', True),
+            # concurrency 為此帳號的連線數上限，與 pool_size 相同
+            'pool_size': smtp_value(section, 'concurrency', 'getint', smtp_value(section, 'pool_size', 'getint', 2)),
+            'max_messages_per_connection': smtp_value(section, 'max_messages_per_connection', 'getint', 50),
+            'idle_check_seconds': smtp_value(section, 'idle_check_seconds', 'getfloat', 30),
+            'timeout': smtp_value(section, 'timeout', 'getfloat', 60),
+            'weight': smtp_value(section, 'weight', 'getfloat', 1), # 負載分配的權重
+            'daily_quota': smtp_value(section, 'daily_quota', 'getint', 0), # 每日寄送收件人數上限 (0 表示不限)
+            'domains': smtp_value(section, 'domains', fallback='').replace(',', ' ').split() # 專門寄送的收件網域
+        }
+
+    # 可設定多個 SMTP 帳號 [SMTP.1]、[SMTP.2]...，寄送時依權重分配並在帳號無法使用時自動切換；
+    # 沒有 [SMTP.<名稱>] 區段時只使用 [SMTP]
+    profile_sections = [section for section in config.sections() if section.startswith('SMTP.')]
+    smtp_profiles = {section[len('SMTP.'):]: smtp_profile(section) for section in profile_sections}
+    if not smtp_profiles:
+        smtp_profiles = {'SMTP': smtp_profile('SMTP')}
+    smtp_settings = next(iter(smtp_profiles.values())) # 第一個帳號，作為預設寄件人
+    quota_file = Path(config.get('SMTP', 'quota_file', fallback='.smtp_quota.json'))
+    relay_settings = {
+        'profiles': smtp_profiles,
+        # 每日額度使用量記錄檔 (相對於配置文件所在目錄)，只在有設定 daily_quota 時使用
+        'quota_file': quota_file if quota_file.is_absolute() else config_path.parent / quota_file
+    }
+
+    test_settings = {}
+    if 'TEST' in config:
+        test_settings = {
+            'recipient_name_config': config['TEST'].get('recipient_name', ''),
+            'recipient_email_config': config['TEST'].get('recipient_email', ''),
+            'enable_test_mode': config['TEST'].getboolean('enable_test_mode', False) # 預設為 False
+        }
+    else: # 如果 TEST 區段不存在，也提供預設值
+        test_settings = {
+            'recipient_name_config': '測試學員',
+            'recipient_email_config': 'test@example.com',
+            'enable_test_mode': False
+        }
+
+    # [SEND] 區段為選填，未設定時使用預設值
+    send_settings = {
+        'workers': config.getint('SEND', 'workers', fallback=2),
+        'rate_per_minute': config.getfloat('SEND', 'rate_per_minute', fallback=60),
+        'rate_per_hour': config.getfloat('SEND', 'rate_per_hour', fallback=0),
+        'burst': config.getint('SEND', 'burst', fallback=5),
+        'connection_rate_per_minute': config.getfloat('SEND', 'connection_rate_per_minute', fallback=0),
+        'connection_rate_per_hour': config.getfloat('SEND', 'connection_rate_per_hour', fallback=0),
+        'backend': config.get('SEND', 'backend', fallback='thread').strip().lower(), # thread 或 asyncio
+        'async_concurrency': config.getint('SEND', 'async_concurrency', fallback=100) # asyncio 後端同時進行中的寄送數
+    }
+
+    # [CERTIFICATE] 區段為選填：證書檔名格式 (每行一個正規表示式，需含 (?P<name>...) 群組)、模糊比對與索引快取
+    patterns = config.get('CERTIFICATE', 'filename_patterns', fallback='').strip()
+    certificate_settings = {
+        'filename_patterns': [p.strip() for p in patterns.splitlines() if p.strip()],
+        'fuzzy_match': config.getboolean('CERTIFICATE', 'fuzzy_match', fallback=False),
+        'fuzzy_cutoff': config.getfloat('CERTIFICATE', 'fuzzy_cutoff', fallback=0.85),
+        'index_cache': config.get('CERTIFICATE', 'index_cache', fallback='').strip()
+    }
+
+    # [CERTGEN] 區段為選填：由證書範本產生證書 (工作設定 certificate_template 時) 的行程數、字型與產生快取
+    certgen_settings = {
+        'workers': config.getint('CERTGEN', 'workers', fallback=0), # 0 表示 CPU 核心數
+        'font': config.get('CERTGEN', 'font', fallback='MSung-Light').strip() or 'MSung-Light', # MSung-Light (明體) 或 MHei-Medium (黑體)
+        'cache': config.get('CERTGEN', 'cache', fallback='').strip() # 空白時為證書目錄旁的 .<目錄名稱>.certgen.json
+    }
+
+    # [ATTACHMENT] 區段為選填：已編碼附件的快取上限，以及改用 mmap 讀取的檔案大小門檻
+    attachment_settings = {
+        'cache_mb': config.getfloat('ATTACHMENT', 'cache_mb', fallback=64),
+        'mmap_threshold_kb': config.getint('ATTACHMENT', 'mmap_threshold_kb', fallback=1024)
+    }
+
+    # [TEMPLATE] 區段為選填：郵件主旨與內容範本檔 (相對於專案目錄)，HTML 內容為選填
+    template_dir = PROJECT_DIR
+    html_body = config.get('TEMPLATE', 'html_body', fallback='').strip()
+    template_settings = {
+        'subject': template_dir / config.get('TEMPLATE', 'subject', fallback='templates/certificate_subject.txt'),
+        'body': template_dir / config.get('TEMPLATE', 'body', fallback='templates/certificate_body.txt'),
+        'html_body': template_dir / html_body if html_body else None
+    }
+
+    # [BATCH] 區段為選填：內容完全相同的郵件合併為一次交易寄給多位收件人 (密件副本方式)
+    batch_settings = {
+        'enabled': config.getboolean('BATCH', 'enabled', fallback=False),
+        'max_recipients': config.getint('BATCH', 'max_recipients', fallback=50),
+        'max_pending_groups': config.getint('BATCH', 'max_pending_groups', fallback=1000),
+        'to_header': config.get('BATCH', 'to_header', fallback='undisclosed-recipients:;')
+    }
+
+    # [RETRY] 區段為選填：4xx 暫時性錯誤 (灰名單、伺服器忙碌) 以指數退避稍後重試，5xx 永久性錯誤不重試
+    retry_settings = {
+        'enabled': config.getboolean('RETRY', 'enabled', fallback=True),
+        'max_attempts': config.getint('RETRY', 'max_attempts', fallback=3), # 每封郵件最多嘗試次數 (含第一次)
+        'base_delay_seconds': config.getfloat('RETRY', 'base_delay_seconds', fallback=30),
+        'max_delay_seconds': config.getfloat('RETRY', 'max_delay_seconds', fallback=600),
+        'budget': config.getint('RETRY', 'budget', fallback=0), # 整批寄送最多重試總次數 (0 表示不限)
+        'deadline_minutes': config.getfloat('RETRY', 'deadline_minutes', fallback=30) # 開始寄送後超過此時間不再重試 (0 表示不限)
+    }
+
+    # [DOMAIN] 區段為選填：每個收件網域各自的速率與同時寄送上限 (0 表示不限)
+    # [DOMAIN.<名稱>] 區段為個別網域 (或以 domains 列出的一組網域) 的限制，例如 [DOMAIN.gmail.com]
+    def domain_limits(section, fallback):
+        return {
+            'rate_per_minute': config.getfloat(section, 'rate_per_minute', fallback=fallback.get('rate_per_minute', 0)),
+            'rate_per_hour': config.getfloat(section, 'rate_per_hour', fallback=fallback.get('rate_per_hour', 0)),
+            'burst': config.getint(section, 'burst', fallback=fallback.get('burst', 1)),
+            'max_concurrency': config.getint(section, 'max_concurrency', fallback=fallback.get('max_concurrency', 0))
+        }
+    default_domain_limits = domain_limits('DOMAIN', {})
+    domain_groups = {}
+    for section in config.sections():
+        if section.startswith('DOMAIN.'):
+            group = domain_limits(section, default_domain_limits)
+            group['domains'] = config.get(section, 'domains', fallback='').replace(',', ' ').split()
+            domain_groups[section[len('DOMAIN.'):]] = group
+    domain_settings = {
+        'default': default_domain_limits,
+        'groups': domain_groups,
+        'lookahead': config.getint('DOMAIN', 'lookahead', fallback=1000) # 預先讀取並依網域分組的筆數
+    }
+
+    # [PREFLIGHT] 區段為選填：寄送前整批檢查的設定
+    mx_cache = Path(config.get('PREFLIGHT', 'mx_cache', fallback='.mx_cache.json'))
+    preflight_settings = {
+        'check_mx': config.getboolean('PREFLIGHT', 'check_mx', fallback=False), # 查詢收件網域是否有 MX 記錄
+        'dns_server': config.get('PREFLIGHT', 'dns_server', fallback='').strip(), # 空白時使用 /etc/resolv.conf 的設定
+        'mx_cache': mx_cache if mx_cache.is_absolute() else config_path.parent / mx_cache,
+        'mx_cache_days': config.getfloat('PREFLIGHT', 'mx_cache_days', fallback=7),
+        'max_attachment_mb': config.getfloat('PREFLIGHT', 'max_attachment_mb', fallback=20) # 編碼後附件大小上限 (0 表示不限)
+    }
+
+    # [METRICS] 區段為選填：結構化量測的輸出 (路徑相對於配置文件所在目錄，空白表示不輸出)
+    def metrics_path(key):
+        value = config.get('METRICS', key, fallback='').strip()
+        return (Path(value) if Path(value).is_absolute() else config_path.parent / value) if value else None
+    metrics_settings = {
+        'events_file': metrics_path('events_file'), # 每封郵件的結果與耗時 (JSON Lines)
+        'prometheus_file': metrics_path('prometheus_file'), # Prometheus 文字格式，寄送期間定期覆寫
+        'export_interval_seconds': config.getfloat('METRICS', 'export_interval_seconds', fallback=10),
+        'http_host': config.get('METRICS', 'http_host', fallback='127.0.0.1').strip(),
+        'http_port': config.getint('METRICS', 'http_port', fallback=0) # 在此埠提供 /metrics (0 表示不啟用)
+    }
+
+    # [SPOOL] 區段為選填：兩階段寄送 (spool 子命令產生郵件、daemon 子命令寄出) 的佇列目錄
+    spool_dir = Path(config.get('SPOOL', 'directory', fallback='spool').strip() or 'spool')
+    spool_settings = {
+        'directory': spool_dir if spool_dir.is_absolute() else config_path.parent / spool_dir, # 相對於配置文件所在目錄
+        'poll_interval_seconds': config.getfloat('SPOOL', 'poll_interval_seconds', fallback=5), # daemon 檢查新郵件的間隔
+        'keep_done': config.getboolean('SPOOL', 'keep_done', fallback=True) # 已寄出的郵件保留在 done 目錄
+    }
+
+    return {
+        'smtp': smtp_settings,
+        'relays': relay_settings,
+        'test': test_settings,
+        'send': send_settings,
+        'certificate': certificate_settings,
+        'certgen': certgen_settings,
+        'attachment': attachment_settings,
+        'template': template_settings,
+        'batch': batch_settings,
+        'retry': retry_settings,
+        'domain': domain_settings,
+        'preflight': preflight_settings,
+        'metrics': metrics_settings,
+        'spool': spool_settings,
+        # [JOB] 區段為選填：未以 --job 指定工作檔時的寄送工作，格式與工作檔相同 (路徑相對於配置文件所在目錄)
+        'job': read_job(config, 'JOB', config_path.parent)
+    }
@@ -0,0 +1,81 @@
+import csv
+import json
+from pathlib import Path
+
+
+# 將儲存格的值轉為字串，空白儲存格視為空字串
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+# 串流讀取聯絡資料，逐行產生 (行號, {欄位名稱: 值})，不會一次載入整個檔案
+# 支援格式：
+# - .xlsx: 使用 openpyxl 唯讀模式，行號與 Excel 相同（標頭為第 1 行）
+# - .csv: 第一行為標頭，行號同樣從 2 開始
+# - .jsonl: 每行一個 JSON 物件，行號即檔案行號
+# 建立時即檢查檔案與標頭，讓格式錯誤在開始寄送前就被發現
+class ContactReader:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.suffix = self.path.suffix.lower()
+        if not self.path.exists():
+            raise FileNotFoundError(f"聯絡資料檔案 '{self.path}' 不存在")
+        if self.suffix not in ('.xlsx', '.xlsm', '.csv', '.jsonl'):
+            raise ValueError(f"不支援的聯絡資料格式: '{self.suffix}' (支援 .xlsx、.csv、.jsonl)")
+        self.columns = self._read_header()
+
+    # 僅讀取標頭即可，之後每次迭代都會重新開啟檔案
+    def _read_header(self):
+        iter(self).close()
+        return self._header
+
+    def _iter_xlsx(self):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ImportError("讀取 .xlsx 聯絡資料需要 openpyxl，請執行 pip install openpyxl")
+        workbook = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            self._header = [_cell_text(v) for v in next(rows, ())]
+            yield
+            for row_num, values in enumerate(rows, start=2):
+                if all(v is None for v in values):
+                    continue
+                yield row_num, {col: _cell_text(v) for col, v in zip(self._header, values) if col}
+        finally:
+            workbook.close()
+
+    def _iter_csv(self):
+        with open(self.path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            self._header = [_cell_text(v) for v in next(reader, [])]
+            yield
+            for row_num, values in enumerate(reader, start=2):
+                if not any(v.strip() for v in values):
+                    continue
+                yield row_num, {col: _cell_text(v) for col, v in zip(self._header, values) if col}
+
+    def _iter_jsonl(self):
+        self._header = None
+        yield
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for row_num, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                yield row_num, {str(k): _cell_text(v) for k, v in record.items()}
+
+    def __iter__(self):
+        if self.suffix == '.csv':
+            rows = self._iter_csv()
+        elif self.suffix == '.jsonl':
+            rows = self._iter_jsonl()
+        else:
+            rows = self._iter_xlsx()
+        next(rows)  # 先讀取標頭
+        return rows
@@ -0,0 +1,314 @@
+import signal
+import smtplib
+import threading
+import time
+from collections import OrderedDict, deque
+
+from .batch_sender import send_pipelined
+from .dispatcher import dispatch
+from .domain_scheduler import recipient_domain
+from .metrics import Metrics
+from .mime_stream import StreamingMessage
+from .rate_limit import create_limiter
+from .relays import RelaySet
+from .retry import RetryScheduler
+from .send_journal import SendJournal
+from .sender import describe_refusal, error_code
+from .spool import Spool, parse_name
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 fcntl，不檢查是否已有其他 daemon
+    fcntl = None
+
+
+# 以檔案鎖確認同一個 spool 只有一個 daemon 在執行，回傳鎖定的檔案 (需保持開啟)
+def lock_spool(spool):
+    lock_file = open(spool.path / '.daemon.lock', 'w')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+    return lock_file
+
+
+# 郵件以產生時的寄件人產生；由寄件人不同的 SMTP 帳號寄出時改寫標頭的 From
+def replace_sender(message, old_sender, new_sender):
+    head = message.segments[0]
+    end = head.find(b'\r\n\r\n')
+    old_line = f"From: {old_sender}\r\n".encode('utf-8')
+    header = head[:end + 2]
+    if old_line not in header:
+        return message
+    header = header.replace(old_line, f"From: {new_sender}\r\n".encode('utf-8'), 1)
+    return StreamingMessage([header + head[end + 2:]] + message.segments[1:])
+
+
+# spool 的項目來源，提供與 domain_scheduler.DomainScheduler 相同的 pop_ready() / next_delay() / done() / requeue() / drain()
+# 每 poll_interval 秒重新掃描 new 目錄，新產生的課程不需重新啟動 daemon 就會開始寄送；
+# 同時有多個課程時輪流取出各課程的郵件。once 為 True 時 spool 中沒有郵件 (含等待重試) 即結束
+class SpoolSource:
+    def __init__(self, spool, poll_interval=5, once=False):
+        self.spool = spool
+        self.poll_interval = max(0.1, poll_interval)
+        self.once = once
+        self.ready = deque()
+        self.next_scan = 0.0
+        self.empty = False  # 最後一次掃描時 new 目錄是否沒有任何郵件
+        self.stopping = False
+
+    def __len__(self):
+        return len(self.ready)
+
+    def stop(self):
+        self.stopping = True
+
+    # 下次呼叫 pop_ready() 時立即重新掃描 (例如剛放回一封等待重試的郵件)
+    def rescan(self):
+        self.next_scan = 0.0
+        self.empty = False
+
+    def _scan(self):
+        now = time.time()
+        by_campaign = OrderedDict()
+        next_retry = None
+        names = sorted(self.spool.names('new'), key=lambda name: (parse_name(name) or ('', 1, 0))[2])
+        for name in names:
+            parsed = parse_name(name)
+            if parsed is None:
+                continue
+            if parsed[2] > now:
+                next_retry = parsed[2] if next_retry is None else min(next_retry, parsed[2])
+                continue
+            by_campaign.setdefault(parsed[0].split('.', 1)[0], deque()).append(name)
+        self.ready.clear()
+        while by_campaign:
+            for campaign in list(by_campaign):
+                self.ready.append(by_campaign[campaign].popleft())
+                if not by_campaign[campaign]:
+                    del by_campaign[campaign]
+        self.empty = not names
+        self.next_scan = now + self.poll_interval
+        if next_retry is not None:
+            self.next_scan = min(self.next_scan, next_retry)
+
+    def pop_ready(self):
+        if self.stopping:
+            return None
+        if not self.ready and time.time() >= self.next_scan:
+            self._scan()
+        while self.ready:
+            name = self.ready.popleft()
+            path = self.spool.claim(name)
+            if path is not None:
+                return {'name': name, 'path': path, 'attempt': parse_name(name)[1]}
+        return None
+
+    def next_delay(self):
+        if self.stopping or (self.once and self.empty and not self.ready):
+            return None
+        if self.ready:
+            return 0.0
+        return max(0.0, self.next_scan - time.time())
+
+    def done(self, job):
+        pass
+
+    def requeue(self, job):
+        self.spool.release(job['name'])
+        self.ready.appendleft(job['name'])
+
+    def drain(self):
+        self.ready.clear()
+        return []
+
+
+# 兩階段寄送的寄送端：持續取出 spool 中的郵件，以 [SEND] 的同時寄送數與速率寄出
+# 暫時性錯誤依 [RETRY] 退避後重試 (重試時間記錄在檔名，重新啟動後仍有效)，寄送結果寫入產生時指定的寄送日誌
+class DeliveryDaemon:
+    def __init__(self, settings, spool, once=False):
+        self.settings = settings
+        self.spool = spool
+        self.send_config = settings['send']
+        self.keep_done = settings['spool']['keep_done']
+        self.source = SpoolSource(spool, settings['spool']['poll_interval_seconds'], once)
+        retry_config = settings['retry']
+        # 重試的次數預算與期限是針對單次執行，daemon 長時間執行只限制每封郵件的嘗試次數
+        self.retries = RetryScheduler(max_attempts=retry_config['max_attempts'] if retry_config['enabled'] else 1,
+                                      base_delay=retry_config['base_delay_seconds'],
+                                      max_delay=retry_config['max_delay_seconds'])
+        self.journals = {}
+        self.journal_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+        metrics_config = settings['metrics']
+        try:
+            self.metrics = Metrics(metrics_config['events_file'])
+        except Exception as e:
+            print(f"開啟事件記錄檔 '{metrics_config['events_file']}' 失敗: {str(e)}")
+            exit(1)
+        relay_config = settings['relays']
+        self.relay_set = RelaySet(relay_config['profiles'],
+                                  relay_config['quota_file'] if any(p['daily_quota'] for p in relay_config['profiles'].values()) else None,
+                                  lambda: create_limiter(self.send_config, 'connection_'),
+                                  self.metrics)
+
+    # 各課程的寄送日誌，第一次用到時才開啟
+    def journal(self, path):
+        if not path:
+            return None
+        with self.journal_lock:
+            if path not in self.journals:
+                self.journals[path] = SendJournal(path)
+            return self.journals[path]
+
+    # 啟動時處理上次中斷時仍在 cur 的郵件：依寄送日誌已寄出的移到 done，
+    # 狀態不明 (已開始寄送但沒有結果) 的移到 failed 避免重複寄送，尚未開始寄送的放回 new
+    def recover(self, requeue_failed=False):
+        for name in self.spool.names('cur'):
+            try:
+                info = Spool.read_info(self.spool.path / 'cur' / name)
+                journal = self.journal(info.get('journal'))
+                status = journal.status(info['row'], info['email']) if journal else None
+            except Exception as e:
+                print(f"警告: 無法讀取 spool 檔案 '{name}': {str(e)}，移到 failed")
+                self.spool.finish(name, 'failed')
+                continue
+            if status == 'sent':
+                self.spool.finish(name, 'done', self.keep_done)
+            elif status == 'pending':
+                print(f"[{info['campaign']}] 警告 (Excel 第 {info['row']} 行，學員: {info['name']}): 上次中斷時正在寄送，狀態不明，移到 failed "
+                      f"(確認後可用 --requeue-failed 重寄)")
+                self.spool.finish(name, 'failed')
+            else:
+                self.spool.release(name)
+        if requeue_failed:
+            names = self.spool.names('failed')
+            for name in names:
+                self.spool.retry(name, 1, 0, folder='failed')
+            if names:
+                print(f"已將 failed 中的 {len(names)} 封郵件放回 new 重新寄送")
+
+    # 在工作執行緒中寄出一封 spool 中的郵件，失敗時拋出例外
+    def send_job(self, job):
+        job['started'] = time.perf_counter()
+        info, message = Spool.read(job['path'])
+        job.update(info=info, campaign=info['campaign'], row_num=info['row'], email=info['email'])
+        journal = self.journal(info.get('journal'))
+        print(f"\n[{info['campaign']}] 準備發送郵件給 (Excel 第 {info['row']} 行): {info['name']} <{info['email']}> ...")
+        if journal:
+            journal.record(info['row'], info['email'], 'pending', info.get('certificate_path'))
+        self.metrics.inc('message_bytes_total', message.size)
+        build = lambda sender: message if sender == info['sender'] else replace_sender(message, info['sender'], sender)
+        refused = self.relay_set.send(recipient_domain(job), [info['email']], build, send_pipelined)
+        if refused:
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if journal:
+            journal.record(info['row'], info['email'], 'sent', info.get('certificate_path'))
+        print(f"[{info['campaign']}] 郵件成功寄送至: {info['email']}")
+
+    def record_outcome(self, job, outcome, error=None, **fields):
+        campaign = job.get('campaign', '')
+        self.metrics.inc('messages_total', result=outcome, campaign=campaign)
+        if error is not None:
+            self.metrics.inc('smtp_errors_total', code=error_code(job, error))
+        self.metrics.event(outcome, campaign=campaign, row=job.get('row_num'), email=job.get('email'), spool=job['name'],
+                           attempt=job.get('attempt', 1), code=error_code(job, error) if error is not None else None,
+                           error=str(error) if error is not None else None, seconds=round(job['seconds'], 4), **fields)
+
+    # 由派送引擎在主執行緒中呼叫：依結果將檔案移到 done、放回 new 等待重試或移到 failed
+    def on_result(self, job, error):
+        job['seconds'] = time.perf_counter() - job.get('started', time.perf_counter())
+        self.metrics.observe('send_seconds', job['seconds'])
+        name = job['name']
+        info = job.get('info')
+        tag = f"[{job['campaign']}] " if info else ''
+        if error is None:
+            self.sent += 1
+            self.spool.finish(name, 'done', self.keep_done)
+            self.record_outcome(job, 'sent')
+            return
+        reason = error
+        if isinstance(error, smtplib.SMTPRecipientsRefused) and job.get('email') in error.recipients:
+            reason = describe_refusal(*error.recipients[job['email']])
+        journal = self.journal(info.get('journal')) if info else None
+        delay, give_up_reason = self.retries.next_attempt(job, error)
+        if delay is not None:
+            print(f"{tag}郵件暫時無法寄送: {job.get('email', name)}, 原因: {reason}，將於 {delay:.1f} 秒後重試 (第 {job['attempt']} 次嘗試)")
+            self.retried += 1
+            self.spool.retry(name, job['attempt'], time.time() + delay)
+            self.source.rescan()
+            self.record_outcome(job, 'retried', error, retry_in=round(delay, 3))
+        else:
+            if give_up_reason != '永久性錯誤':
+                reason = f"{reason} (不再重試: {give_up_reason})"
+            print(f"{tag}郵件寄送失敗: {job.get('email', name)}, 原因: {reason}")
+            self.failed += 1
+            self.spool.finish(name, 'failed')
+            self.record_outcome(job, 'failed', error)
+        if journal:
+            journal.record(info['row'], info['email'], 'failed', info.get('certificate_path'), reason=str(reason))
+
+    def run(self):
+        send_config = self.send_config
+        metrics_config = self.settings['metrics']
+        try:
+            self.metrics.start_exporter(metrics_config['prometheus_file'], metrics_config['export_interval_seconds'],
+                                        metrics_config['http_host'], metrics_config['http_port'])
+        except Exception as e:
+            print(f"啟動指標輸出失敗: {str(e)}")
+            exit(1)
+
+        # 收到 SIGINT / SIGTERM 時不再取出新的郵件，等待進行中的寄送完成後結束；再按一次 Ctrl+C 時取消尚未開始的寄送
+        # (進行中的 SMTP 交易仍會等待完成，見 dispatcher.dispatch)
+        def request_stop(signum, frame):
+            print("\n*** 收到停止訊號，等待進行中的郵件寄送完成後結束 ***")
+            self.source.stop()
+            signal.signal(signal.SIGINT, previous_sigint)
+        previous_sigint = signal.signal(signal.SIGINT, request_stop)
+        previous_sigterm = signal.signal(signal.SIGTERM, request_stop)
+        try:
+            dispatch((), self.send_job, self.on_result, workers=send_config['workers'],
+                     limiter=create_limiter(send_config), scheduler=self.source)
+        finally:
+            signal.signal(signal.SIGINT, previous_sigint)
+            signal.signal(signal.SIGTERM, previous_sigterm)
+            self.relay_set.close()
+            for journal in self.journals.values():
+                journal.close()
+            try:
+                self.metrics.close()
+            except Exception as e:
+                print(f"警告: 寫入寄送指標失敗: {str(e)}")
+
+        counts = self.spool.counts()
+        print("\n" + "="*30 + " 寄送統計 " + "="*30)
+        print(f"成功發送: {self.sent}")
+        print(f"失敗發送: {self.failed}")
+        print(f"暫時性錯誤重試: {self.retried} 次")
+        print(f"spool 等待寄送 {counts['new']} 封，已寄出 {counts['done']} 封，失敗 {counts['failed']} 封")
+        print("="*70)
+
+
+# 寄送端：持續寄出 spool 中的郵件，直到收到停止訊號 (--once 時 spool 清空即結束)
+def run_daemon(settings, options):
+    spool = Spool(options.spool or settings['spool']['directory'])
+    lock = lock_spool(spool)
+    if lock is None:
+        print(f"錯誤: spool '{spool.path}' 已有其他 daemon 在執行。")
+        exit(1)
+    try:
+        spool.clean_tmp()
+        daemon = DeliveryDaemon(settings, spool, options.once)
+        daemon.recover(options.requeue_failed)
+        counts = spool.counts()
+        print(f"--- 開始寄送 spool '{spool.path}' 中的郵件 (等待寄送 {counts['new']} 封) ---")
+        print(f"同時寄送數: {daemon.send_config['workers']}，全域速率上限: 每分鐘 {daemon.send_config['rate_per_minute'] or '不限'} 封，"
+              + ("spool 清空後結束" if options.once else f"每 {daemon.source.poll_interval:g} 秒檢查新郵件，Ctrl+C 結束"))
+        daemon.run()
+    finally:
+        lock.close()
@@ -0,0 +1,78 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+# 並行派送引擎
+# - jobs: 待寄送項目，可為產生器，會依需要逐筆讀取
+# - send_func(job): 在工作執行緒中執行，成功直接回傳，失敗拋出例外
+# - on_result(job, error): 在呼叫端執行緒中依完成順序呼叫，error 為 None 表示成功
+# - limiter: 全域速率限制器，在送出工作前取得額度，不佔用工作執行緒等待
+# - scheduler: 選填的排程器 (例如 retry.RetryScheduler 或 domain_scheduler.DomainScheduler)，
+#   pop_ready() 取出的項目優先於 jobs 中的新項目送出；排程器中的項目等待期間仍會繼續寄送其他項目
+# - 收到 KeyboardInterrupt (Ctrl-C) 時停止派送新郵件，取消尚未開始的寄送並放回排程器，等待進行中的郵件寄完後結束；
+#   工作執行緒中的 SMTP 交易無法中途取消 (最多等待連線逾時)，等待期間再按 Ctrl-C 也會繼續等待，
+#   避免寄送結果 (寄送日誌) 在呼叫端關閉日誌後才寫入
+# 回傳 True 表示全部派送完成，False 表示因中斷而提前結束 (與 async_backend.async_dispatch 相同)
+def dispatch(jobs, send_func, on_result, workers=1, limiter=None, scheduler=None):
+    workers = max(1, workers)
+    jobs = iter(jobs)
+    in_flight = {}
+    pending = None
+    scheduled = False  # pending 是否由排程器取出
+    exhausted = False
+
+    def collect(timeout):
+        if not in_flight:
+            if timeout:
+                time.sleep(timeout)
+            return
+        done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            job = in_flight.pop(future)
+            on_result(job, future.exception())
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            while True:
+                if pending is None and scheduler is not None:
+                    pending = scheduler.pop_ready()
+                    scheduled = pending is not None
+                if pending is None and not exhausted:
+                    pending = next(jobs, None)
+                    exhausted = pending is None
+
+                if pending is None:
+                    delay = scheduler.next_delay() if scheduler is not None else None
+                    if not in_flight and delay is None:
+                        return True
+                    # 等待進行中的結果 (可能產生新的重試) 或排程器中的下一個項目可寄送
+                    collect(delay)
+                    continue
+
+                if len(in_flight) >= workers:
+                    collect(None)
+                    continue
+
+                wait_seconds = limiter.try_acquire() if limiter else 0
+                if wait_seconds > 0:
+                    collect(wait_seconds)
+                    continue
+
+                in_flight[executor.submit(send_func, pending)] = pending
+                pending = None
+        except KeyboardInterrupt:
+            print(f"\n收到中斷訊號，停止派送新郵件，等待進行中的 {len(in_flight)} 封寄送完成...")
+            # 已取出但尚未送出的項目放回排程器，由呼叫端一併處理
+            if pending is not None and scheduled:
+                scheduler.requeue(pending)
+            for future, job in list(in_flight.items()):
+                if future.cancel():
+                    del in_flight[future]
+                    if scheduler is not None:
+                        scheduler.requeue(job)
+            while in_flight:
+                try:
+                    collect(None)
+                except KeyboardInterrupt:
+                    print(f"進行中的 SMTP 交易無法中途取消，仍在等待 {len(in_flight)} 封寄送完成 (最多等待連線逾時時間)...")
+            return False
@@ -0,0 +1,165 @@
+from collections import OrderedDict, deque
+
+from .rate_limit import RateLimiter
+
+
+# 取出收件地址的網域 (小寫)，批次項目以第一位收件人為準
+def recipient_domain(job):
+    if 'batch' in job:
+        job = job['batch'][0]
+    return job['email'].rpartition('@')[2].strip().lower()
+
+
+# 依收件網域分組排程：每組各自的速率上限與同時寄送上限，並以輪流 (round-robin) 方式交錯各組，
+# 被限速的網域只會延後自己的郵件，不會卡住寄往其他網域的郵件
+# - jobs: 新的待寄送項目，最多預先讀取 lookahead 筆分到各網域的佇列中
+# - domain_settings: {'default': {...}, 'groups': {名稱: {'domains': [...], ...}}, 'lookahead': n}
+#   每組設定包含 rate_per_minute、rate_per_hour、burst、max_concurrency (0 表示不限)；
+#   groups 中的網域可用 '*.edu.tw' 表示所有子網域，未列出的網域各自套用 default 的限制
+# - retries: 選填的重試排程器，到期的重試項目排在該網域佇列的最前面
+# - shared_with: 選填的另一個 DomainScheduler，與其共用各網域的速率與同時寄送數 (例如同時執行多個課程時)
+# 與 retry.RetryScheduler 相同提供 pop_ready() / next_delay() / requeue()，可直接交給派送引擎；
+# 每個項目寄送結束後需呼叫 done(job) 釋放同時寄送數
+class DomainScheduler:
+    def __init__(self, jobs, domain_settings, retries=None, shared_with=None):
+        self.jobs = iter(jobs)
+        self.exhausted = False
+        self.retries = retries
+        self.default = domain_settings.get('default', {})
+        self.lookahead = max(1, domain_settings.get('lookahead', 1000))
+        self.group_settings = domain_settings.get('groups', {})
+        self._exact = {}
+        self._suffixes = []
+        for name, group in self.group_settings.items():
+            for domain in group.get('domains') or [name]:
+                domain = domain.strip().lower()
+                if domain.startswith('*.') or domain.startswith('.'):
+                    self._suffixes.append(('.' + domain.lstrip('*.'), name))
+                else:
+                    self._exact[domain] = name
+        self._group_of = {}  # 網域 -> 組名的查詢快取
+        self.queues = OrderedDict()  # 有待寄送項目的組，依輪流順序排列
+        self.queued = 0
+        self.limiters = shared_with.limiters if shared_with is not None else {}
+        self.in_flight = shared_with.in_flight if shared_with is not None else {}
+
+    def __len__(self):
+        return self.queued + (len(self.retries) if self.retries is not None else 0)
+
+    def group_for(self, domain):
+        group = self._group_of.get(domain)
+        if group is None:
+            group = self._exact.get(domain)
+            if group is None:
+                for suffix, name in self._suffixes:
+                    if domain.endswith(suffix) or domain == suffix[1:]:
+                        group = name
+                        break
+                else:
+                    group = domain  # 未設定的網域自成一組
+            self._group_of[domain] = group
+        return group
+
+    def _settings(self, group):
+        return self.group_settings.get(group, self.default)
+
+    def _limiter(self, group):
+        if group not in self.limiters:
+            s = self._settings(group)
+            limiter = RateLimiter(s.get('rate_per_minute', 0), s.get('rate_per_hour', 0), s.get('burst', 1))
+            self.limiters[group] = limiter if limiter.buckets else None
+        return self.limiters[group]
+
+    def _add(self, job, front=False):
+        group = job['domain_group'] = self.group_for(recipient_domain(job))
+        queue = self.queues.get(group)
+        if queue is None:
+            queue = self.queues[group] = deque()
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+        self.queued += 1
+
+    def _fill(self):
+        if self.retries is not None:
+            job = self.retries.pop_ready()
+            while job is not None:
+                self._add(job, front=True)
+                job = self.retries.pop_ready()
+        while not self.exhausted and self.queued < self.lookahead:
+            job = next(self.jobs, None)
+            if job is None:
+                self.exhausted = True
+            else:
+                self._add(job)
+
+    def _at_capacity(self, group):
+        cap = self._settings(group).get('max_concurrency', 0)
+        return bool(cap) and self.in_flight.get(group, 0) >= cap
+
+    # 輪流檢查各組，回傳第一個未達上限的組的下一個項目，全部受限時回傳 None
+    def pop_ready(self):
+        self._fill()
+        for group in list(self.queues):
+            if self._at_capacity(group):
+                continue
+            limiter = self._limiter(group)
+            if limiter and limiter.try_acquire() > 0:
+                continue
+            queue = self.queues.pop(group)
+            job = queue.popleft()
+            if queue:
+                self.queues[group] = queue  # 移到輪流順序的最後
+            self.queued -= 1
+            self.in_flight[group] = self.in_flight.get(group, 0) + 1
+            return job
+        return None
+
+    # 距離下一個項目可能可以寄送的秒數；只能等待進行中的寄送完成 (或已全部寄完) 時回傳 None
+    def next_delay(self):
+        delays = []
+        if self.retries is not None:
+            retry_delay = self.retries.next_delay()
+            if retry_delay is not None:
+                delays.append(retry_delay)
+        for group in self.queues:
+            if self._at_capacity(group):
+                continue
+            limiter = self._limiter(group)
+            delays.append(limiter.delay() if limiter else 0.0)
+        return min(delays) if delays else None
+
+    # 寄送結束 (不論成功或失敗) 後呼叫
+    def done(self, job):
+        group = job.get('domain_group')
+        if group in self.in_flight:
+            self.in_flight[group] -= 1
+
+    # 已取出但未送出的項目放回佇列最前面
+    def requeue(self, job):
+        self.done(job)
+        self._add(job, front=True)
+
+    # 取出所有尚未寄送的項目，包含等待重試的項目 (例如寄送被中斷時)
+    def drain(self):
+        jobs = [job for queue in self.queues.values() for job in queue]
+        self.queues.clear()
+        self.queued = 0
+        if self.retries is not None:
+            jobs += self.retries.drain()
+        return jobs
+
+
+# 是否設定了任何網域限制
+def domain_limits_configured(domain_settings):
+    default = domain_settings.get('default', {})
+    limited = any(default.get(key) for key in ('rate_per_minute', 'rate_per_hour', 'max_concurrency'))
+    return limited or bool(domain_settings.get('groups'))
+
+
+# 依 [DOMAIN] 設定建立網域排程器，未設定任何網域限制時回傳 None
+def create_domain_scheduler(jobs, domain_settings, retries=None, shared_with=None):
+    if not domain_limits_configured(domain_settings):
+        return None
+    return DomainScheduler(jobs, domain_settings, retries, shared_with)
@@ -0,0 +1,102 @@
+import re
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from pathlib import Path
+
+# 範本變數語法：${欄位名稱}，欄位名稱可為任何聯絡資料欄位 (例如 ${姓名})；$$ 代表字面上的 $
+_PLACEHOLDER = re.compile(r'\$(?:\$|\{([^{}]+)\})')
+
+
+class TemplateError(Exception):
+    pass
+
+
+# 預先編譯的文字範本：載入時拆成固定文字與變數片段，每行只需串接字串
+class Template:
+    def __init__(self, source, name='<template>'):
+        self.source = source
+        self.name = name
+        self.segments = []  # (是否為變數, 文字或變數名稱)
+        pos = 0
+        for match in _PLACEHOLDER.finditer(source):
+            literal = source[pos:match.start()] + ('$' if match.group(1) is None else '')
+            if literal:
+                self._append_literal(literal)
+            if match.group(1) is not None:
+                self.segments.append((True, match.group(1).strip()))
+            pos = match.end()
+        if pos < len(source):
+            self._append_literal(source[pos:])
+        self.variables = {value for is_var, value in self.segments if is_var}
+
+    def _append_literal(self, text):
+        if self.segments and not self.segments[-1][0]:
+            self.segments[-1] = (False, self.segments[-1][1] + text)
+        else:
+            self.segments.append((False, text))
+
+    @classmethod
+    def from_file(cls, path):
+        path = Path(path)
+        return cls(path.read_text(encoding='utf-8').rstrip('\n'), path.name)
+
+    @property
+    def is_static(self):
+        return not self.variables
+
+    def render(self, variables):
+        try:
+            return ''.join(variables[value] if is_var else value for is_var, value in self.segments)
+        except KeyError as e:
+            raise TemplateError(f"範本 '{self.name}' 缺少變數: {e.args[0]}")
+
+
+# 郵件範本：主旨、純文字內容與選填的 HTML 內容
+# 不含變數的內容部分只建立一次並在每封郵件間共用，每封信只需重新產生與收件人有關的部分
+class MessageTemplate:
+    def __init__(self, subject, body, html_body=None, sender=None):
+        self.subject = subject
+        self.body = body
+        self.html_body = html_body
+        self.sender = sender
+        self.variables = subject.variables | body.variables | (html_body.variables if html_body else set())
+        self._static_text_part = MIMEText(body.source, 'plain', 'utf-8') if body.is_static else None
+        self._static_html_part = MIMEText(html_body.source, 'html', 'utf-8') if html_body and html_body.is_static else None
+
+    @classmethod
+    def from_files(cls, subject_path, body_path, html_body_path=None, sender=None):
+        subject = Template.from_file(subject_path)
+        if '\n' in subject.source:
+            raise TemplateError(f"主旨範本 '{subject.name}' 只能有一行")
+        return cls(subject, Template.from_file(body_path),
+                   Template.from_file(html_body_path) if html_body_path else None, sender)
+
+    # 檢查範本用到、但欄位中沒有的變數
+    def missing_variables(self, available):
+        return self.variables - set(available)
+
+    # 代表郵件內容的鍵：主旨與內容都相同時，產生的郵件除收件人外完全一致
+    def content_key(self, variables):
+        return (self.subject.render(variables), self.body.render(variables),
+                self.html_body.render(variables) if self.html_body else None)
+
+    # sender 不為空時覆寫寄件人 (例如以不同的 SMTP 帳號寄出)
+    def build_message(self, variables, to_address, attachment_part=None, sender=None):
+        msg = MIMEMultipart()
+        msg['From'] = sender or self.sender
+        msg['To'] = to_address
+        msg['Subject'] = self.subject.render(variables)
+
+        text_part = self._static_text_part or MIMEText(self.body.render(variables), 'plain', 'utf-8')
+        if self.html_body:
+            html_part = self._static_html_part or MIMEText(self.html_body.render(variables), 'html', 'utf-8')
+            alternative = MIMEMultipart('alternative')
+            alternative.attach(text_part)
+            alternative.attach(html_part)
+            msg.attach(alternative)
+        else:
+            msg.attach(text_part)
+
+        if attachment_part is not None:
+            msg.attach(attachment_part)
+        return msg
@@ -0,0 +1,221 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# 寄送流程的各階段，依時間順序
+PHASES = ('attachment_read', 'mime_build', 'connect', 'tls', 'auth', 'data')
+
+# 耗時直方圖的區間上限 (秒)，涵蓋本機伺服器的毫秒級到遠端伺服器的數十秒
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRIC_PREFIX = 'certmail_'
+
+_HELP = {
+    'phase_seconds': '寄送流程各階段的耗時 (秒)',
+    'send_seconds': '每個寄送項目從準備到取得結果的耗時 (秒)',
+    'messages_total': '寄送結果 (每位收件人一筆)',
+    'smtp_errors_total': 'SMTP 錯誤回應代碼 (-1 表示連線或網路錯誤)',
+    'connections_total': '新建立的 SMTP 連線',
+    'message_bytes_total': '產生的郵件內容位元組數',
+    'relay_recipients_total': '各 SMTP 帳號寄出的收件人數'
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in items) + '}'
+
+
+# 固定區間的直方圖，與 Prometheus histogram 相同的累計方式
+class Histogram:
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後一格為超過最大區間的次數
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # 由區間內線性內插估計百分位數
+    def quantile(self, q):
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= target:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (target - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+# 寄送流程的結構化量測：計數器、耗時直方圖與 JSON Lines 事件記錄，可輸出為 Prometheus 文字格式
+# 所有方法皆可在多個工作執行緒與事件迴圈中同時呼叫
+# - events_path: 選填，每個事件以一行 JSON 追加寫入，可在寄送進行中以 tail -f 或其他工具監看
+class Metrics:
+    def __init__(self, events_path=None):
+        self.counters = {}  # 名稱 -> {標籤: 數值}
+        self.histograms = {}  # 名稱 -> {標籤: Histogram}
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._events = open(events_path, 'a', encoding='utf-8', buffering=1) if events_path else None
+        self._exporter = None
+        self._server = None
+
+    def inc(self, name, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    # 量測一個寄送階段的耗時，例如 with metrics.timer('connect'): ...
+    @contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('phase_seconds', time.perf_counter() - start, phase=phase)
+
+    def event(self, event, **fields):
+        if self._events is None:
+            return
+        record = {'ts': datetime.now().isoformat(timespec='milliseconds'), 'event': event}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            self._events.write(line)
+
+    def counter_value(self, name, **labels):
+        with self._lock:
+            return self.counters.get(name, {}).get(_label_key(labels), 0)
+
+    # 各階段的次數、總耗時、平均與估計的 p50 / p99 (秒)，依流程順序排列
+    def phase_summary(self):
+        with self._lock:
+            series = {dict(key).get('phase'): h for key, h in self.histograms.get('phase_seconds', {}).items()}
+            summary = {}
+            for phase in sorted(series, key=lambda p: PHASES.index(p) if p in PHASES else len(PHASES)):
+                h = series[phase]
+                summary[phase] = {'count': h.count, 'sum': h.sum, 'avg': h.sum / h.count if h.count else 0.0,
+                                  'p50': h.quantile(0.5), 'p99': h.quantile(0.99)}
+            return summary
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                full_name = METRIC_PREFIX + name
+                lines.append(f"# HELP {full_name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {full_name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{full_name}{_format_labels(key)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                full_name = METRIC_PREFIX + name
+                lines.append(f"# HELP {full_name} {_HELP.get(name, name)}")
+                lines.append(f"# TYPE {full_name} histogram")
+                for key, h in sorted(series.items()):
+                    cumulative = 0
+                    for upper, n in zip(h.buckets, h.counts):
+                        cumulative += n
+                        lines.append(f"{full_name}_bucket{_format_labels(key, [('le', upper)])} {cumulative}")
+                    lines.append(f"{full_name}_bucket{_format_labels(key, [('le', '+Inf')])} {h.count}")
+                    lines.append(f"{full_name}_sum{_format_labels(key)} {h.sum:.6f}")
+                    lines.append(f"{full_name}_count{_format_labels(key)} {h.count}")
+        lines.append(f"# TYPE {METRIC_PREFIX}start_time_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}start_time_seconds {self.started:.3f}")
+        return '\n'.join(lines) + '\n'
+
+    # 以暫存檔加上 rename 寫入，讀取端 (例如 node_exporter 的 textfile collector) 不會讀到寫到一半的內容
+    def write_prometheus(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+    # 寄送期間定期輸出指標：每 interval 秒覆寫 Prometheus 文字檔，及/或在 host:port 提供 /metrics
+    def start_exporter(self, textfile=None, interval=10, host='127.0.0.1', port=0):
+        if port:
+            # 只有啟用 /metrics 時才需要 http.server
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+            metrics = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] not in ('/', '/metrics'):
+                        self.send_error(404)
+                        return
+                    body = metrics.render_prometheus().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass  # 不將每次抓取輸出到終端機
+
+            self._server = ThreadingHTTPServer((host, port), Handler)
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+
+        if textfile:
+            stop = threading.Event()
+
+            def export_loop():
+                while not stop.wait(interval):
+                    try:
+                        self.write_prometheus(textfile)
+                    except OSError as e:
+                        print(f"警告: 寫入指標檔 '{textfile}' 失敗: {e}")
+            thread = threading.Thread(target=export_loop, name='metrics-export', daemon=True)
+            thread.start()
+            self._exporter = (stop, thread, textfile)
+
+    # 停止輸出，並寫入最後一次的指標檔與事件記錄的彙總
+    def close(self):
+        if self._exporter is not None:
+            stop, thread, textfile = self._exporter
+            stop.set()
+            thread.join()
+            self.write_prometheus(textfile)
+            self._exporter = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._events is not None:
+            self.event('summary', phases=self.phase_summary(),
+                       counters={name: {','.join(f'{k}={v}' for k, v in key) or 'total': value for key, value in series.items()}
+                                 for name, series in self.counters.items()})
+            with self._lock:
+                self._events.close()
+                self._events = None
@@ -0,0 +1,117 @@
+import io
+import re
+import uuid
+from email.generator import BytesGenerator
+
+# 每次寫入 socket 的大小上限
+CHUNK_SIZE = 64 * 1024
+
+_LINE_STARTING_WITH_DOT = re.compile(br'(?m)^\.')
+
+
+# 將郵件轉為以 CRLF 換行的位元組，與 smtplib.send_message 的轉換方式相同
+def flatten_message(msg):
+    with io.BytesIO() as buffer:
+        BytesGenerator(buffer, policy=msg.policy).flatten(msg, linesep='\r\n')
+        return buffer.getvalue()
+
+
+# 以片段組成、可逐段寫入 SMTP DATA 的郵件，不需先在記憶體中組成完整內容
+# segments 中每個片段為：
+# - bytes: 標頭、內文等較小的部分，寫出時處理以 . 開頭的行 (dot-stuffing)
+# - 附件物件 (attachment_cache 的 EncodedAttachment 或 StreamedAttachment): 提供 size 與 chunks()，
+#   內容為以 CRLF 換行的 base64，不會有以 . 開頭的行，直接寫出
+# 每個片段都需從一行的開頭開始，內容皆以 CRLF 換行
+class StreamingMessage:
+    def __init__(self, segments):
+        self.segments = [segment for segment in segments if not isinstance(segment, bytes) or segment]
+
+    # 郵件大小 (位元組，未含 dot-stuffing)，用於 ESMTP SIZE
+    @property
+    def size(self):
+        return sum(len(s) if isinstance(s, bytes) else s.size for s in self.segments)
+
+    # 依序產生寫入 DATA 的內容，最後包含結束的 <CRLF>.<CRLF>
+    # 各片段先累積到至少 chunk_size 再寫出，結束符號與最後一段一起寫出：
+    # 標頭、結束符號等小片段若各自寫入 socket，會因 Nagle 演算法與伺服器的延遲 ACK 使每封郵件多等約 40 ms
+    def data_chunks(self, chunk_size=CHUNK_SIZE):
+        buffer = bytearray()
+        tail = b'\r\n'
+        for segment in self.segments:
+            if isinstance(segment, bytes):
+                chunks = (_LINE_STARTING_WITH_DOT.sub(b'..', segment),)
+            else:
+                chunks = segment.chunks(chunk_size)
+            for chunk in chunks:
+                if not len(chunk):
+                    continue
+                tail = bytes(chunk[-2:])
+                buffer += chunk
+                if len(buffer) >= chunk_size:
+                    yield bytes(buffer)
+                    buffer.clear()
+        buffer += b'.\r\n' if tail.endswith(b'\r\n') else b'\r\n.\r\n'
+        yield bytes(buffer)
+
+    # 完整的郵件內容 (未含 dot-stuffing)，只在需要整封郵件時使用
+    def to_bytes(self):
+        return b''.join(s if isinstance(s, bytes) else b''.join(s.chunks(CHUNK_SIZE)) for s in self.segments)
+
+    # 附件片段在郵件內容中的 (位置, 長度)，寫入檔案後可以 FileSegment 直接由檔案寫出這些片段
+    def spans(self):
+        spans = []
+        offset = 0
+        for segment in self.segments:
+            if isinstance(segment, bytes):
+                offset += len(segment)
+            else:
+                spans.append((offset, segment.size))
+                offset += segment.size
+        return spans
+
+    # 將郵件內容 (未含 dot-stuffing) 逐段寫入檔案，附件不需先組成完整內容
+    def write_to(self, f):
+        for segment in self.segments:
+            if isinstance(segment, bytes):
+                f.write(segment)
+            else:
+                for chunk in segment.chunks(CHUNK_SIZE):
+                    f.write(chunk)
+
+
+# 檔案中的一段已編碼內容 (例如 spool 檔案中的附件)，寄送時才逐段讀取，與附件物件相同提供 size 與 chunks()
+class FileSegment:
+    def __init__(self, path, offset, size):
+        self.path = path
+        self.offset = offset
+        self.size = size
+
+    def chunks(self, chunk_size):
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            remaining = self.size
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise EOFError(f"檔案 '{self.path}' 的內容不完整")
+                remaining -= len(chunk)
+                yield chunk
+
+
+# 已是完整位元組的郵件也可直接寄送
+def as_streaming(message):
+    return message if isinstance(message, StreamingMessage) else StreamingMessage([message])
+
+
+# 以郵件範本產生可串流寄送的郵件：標頭與內文照常產生 (每封只有數 KB)，
+# 附件部分先以佔位字串產生 MIME 結構，再換成附件物件本身，寄送時才逐段寫出已編碼的內容，
+# 產生的內容與將附件放入 MIME 後整封轉為位元組的結果完全相同
+def build_streaming_message(template, variables, to_address, attachment=None, sender=None):
+    if attachment is None:
+        return StreamingMessage([flatten_message(template.build_message(variables, to_address, None, sender))])
+    placeholder = f"ATTACHMENT-{uuid.uuid4().hex}"
+    msg_bytes = flatten_message(template.build_message(variables, to_address, attachment.to_mime(placeholder), sender))
+    head, found, tail = msg_bytes.partition(placeholder.encode('ascii'))
+    if not found:
+        raise ValueError("產生郵件時找不到附件的位置")
+    return StreamingMessage([head, attachment, tail])
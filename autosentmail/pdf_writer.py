@@ -0,0 +1,492 @@
+import re
+import zlib
+from collections import namedtuple
+
+# 最小的 PDF 讀寫 (純 Python)：讀取既有 PDF (證書範本) 的第一頁，以增量更新 (incremental update) 在頁面上加上文字
+# 範本的內容原樣保留，只在檔尾附加新的物件 (字型、文字內容與取代原頁面的頁面物件) 與交互參照表，
+# 不需解析或重新編排頁面內容；支援傳統交互參照表與 PDF 1.5 的交互參照串流、物件串流，不支援加密的 PDF
+
+# 文字使用 PDF 閱讀器內建的 Adobe-CNS1 中文字型 (不嵌入字型檔)，以 UTF-16 編碼，可顯示所有 Unicode 中文字
+# 寬度：ASCII 可列印字元為半形 (500)，其餘字元為全形 (1000)，用於置中與靠右對齊
+FONTS = {
+    'MSung-Light': {'Flags': 6, 'FontBBox': [-160, -249, 1015, 1071], 'Ascent': 880, 'Descent': -120,
+                    'CapHeight': 880, 'StemV': 93},
+    'MHei-Medium': {'Flags': 4, 'FontBBox': [-45, -250, 1015, 887], 'Ascent': 880, 'Descent': -120,
+                    'CapHeight': 880, 'StemV': 58}
+}
+
+
+class PdfError(Exception):
+    pass
+
+
+# PDF 物件在 Python 中的表示：
+# - 名稱 (/Type) 為 Name，字典的鍵也是 Name (不含斜線)
+# - 間接參照 (12 0 R) 為 Ref
+# - 字串不需解讀，以 RawString 保留原始的寫法 ((...) 或 <...>)，寫回時原樣輸出
+# - 數字、布林值與 null 為 int / float / bool / None，陣列為 list，字典為 dict
+class Name(str):
+    pass
+
+
+Ref = namedtuple('Ref', 'num gen')
+
+
+class RawString(bytes):
+    pass
+
+
+class Keyword(bytes):
+    pass
+
+
+class Stream:
+    def __init__(self, attrs, data):
+        self.attrs = attrs
+        self.data = data
+
+
+_WHITESPACE = rb'\x00\t\n\x0c\r '
+_SKIP = re.compile(rb'(?:[' + _WHITESPACE + rb']+|%[^\r\n]*)*')
+_REGULAR = re.compile(rb'[^' + _WHITESPACE + rb'()<>\[\]{}/%]+')
+_REF_TAIL = re.compile(rb'[' + _WHITESPACE + rb']+(\d+)[' + _WHITESPACE + rb']+R(?![^' + _WHITESPACE + rb'()<>\[\]{}/%])')
+_INTEGER = re.compile(rb'[+-]?\d+$')
+_REAL = re.compile(rb'[+-]?(?:\d+\.\d*|\.\d+)$')
+_NAME_ESCAPE = re.compile(rb'#([0-9A-Fa-f]{2})')
+_OBJECT_HEADER = re.compile(rb'[' + _WHITESPACE + rb']*(\d+)[' + _WHITESPACE + rb']+(\d+)[' + _WHITESPACE + rb']+obj')
+_XREF_SUBSECTION = re.compile(rb'(\d+)[' + _WHITESPACE + rb']+(\d+)')
+_XREF_ENTRY = re.compile(rb'[' + _WHITESPACE + rb']*(\d{10})[' + _WHITESPACE + rb']+(\d{5})[' + _WHITESPACE + rb']+([nf])')
+_STARTXREF = re.compile(rb'startxref[' + _WHITESPACE + rb']+(\d+)')
+
+
+# 由 data 的 pos 位置開始逐一解析 PDF 物件
+class _Parser:
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def skip(self):
+        self.pos = _SKIP.match(self.data, self.pos).end()
+
+    def parse(self):
+        self.skip()
+        data = self.data
+        char = data[self.pos:self.pos + 1]
+        if char == b'/':
+            match = _REGULAR.match(data, self.pos + 1)
+            self.pos = match.end() if match else self.pos + 1
+            raw = match.group() if match else b''
+            return Name(_NAME_ESCAPE.sub(lambda m: bytes([int(m.group(1), 16)]), raw).decode('latin-1'))
+        if data.startswith(b'<<', self.pos):
+            self.pos += 2
+            result = {}
+            while True:
+                self.skip()
+                if data.startswith(b'>>', self.pos):
+                    self.pos += 2
+                    return result
+                key = self.parse()
+                if not isinstance(key, Name):
+                    raise PdfError(f"位置 {self.pos} 的字典格式錯誤")
+                result[key] = self.parse()
+        if char == b'<':
+            end = data.index(b'>', self.pos)
+            token = data[self.pos:end + 1]
+            self.pos = end + 1
+            return RawString(token)
+        if char == b'[':
+            self.pos += 1
+            items = []
+            while True:
+                self.skip()
+                if data.startswith(b']', self.pos):
+                    self.pos += 1
+                    return items
+                items.append(self.parse())
+        if char == b'(':
+            depth = 0
+            i = self.pos
+            while True:
+                c = data[i]
+                if c == 0x5c:  # 反斜線跳脫下一個字元
+                    i += 2
+                    continue
+                if c == 0x28:
+                    depth += 1
+                elif c == 0x29:
+                    depth -= 1
+                    if not depth:
+                        break
+                i += 1
+            token = data[self.pos:i + 1]
+            self.pos = i + 1
+            return RawString(token)
+        match = _REGULAR.match(data, self.pos)
+        if not match:
+            raise PdfError(f"無法解析位置 {self.pos} 的內容")
+        token = match.group()
+        self.pos = match.end()
+        if _INTEGER.match(token):
+            ref = _REF_TAIL.match(data, self.pos)
+            if ref:
+                self.pos = ref.end()
+                return Ref(int(token), int(ref.group(1)))
+            return int(token)
+        if _REAL.match(token):
+            return float(token)
+        if token == b'true':
+            return True
+        if token == b'false':
+            return False
+        if token == b'null':
+            return None
+        return Keyword(token)
+
+
+# 將 PDF 物件寫回 PDF 語法
+def serialize(obj):
+    if isinstance(obj, Name):
+        return b'/' + ''.join(c if '!' <= c <= '~' and c not in '()<>[]{}/%#' else f'#{ord(c):02X}'
+                              for c in obj).encode('latin-1')
+    if isinstance(obj, bool):
+        return b'true' if obj else b'false'
+    if obj is None:
+        return b'null'
+    if isinstance(obj, Ref):
+        return b'%d %d R' % obj
+    if isinstance(obj, int):
+        return b'%d' % obj
+    if isinstance(obj, float):
+        return (f'{obj:.4f}'.rstrip('0').rstrip('.') or '0').encode('ascii')
+    if isinstance(obj, bytes):
+        return bytes(obj)
+    if isinstance(obj, dict):
+        return b'<<' + b''.join(serialize(Name(k)) + b' ' + serialize(v) for k, v in obj.items()) + b'>>'
+    if isinstance(obj, (list, tuple)):
+        return b'[' + b' '.join(serialize(v) for v in obj) + b']'
+    raise PdfError(f"無法寫入的物件: {obj!r}")
+
+
+# PNG 預測器 (交互參照串流與物件串流常用的 /DecodeParms << /Predictor 12 >>)
+def _png_unpredict(data, columns, bpp):
+    row_size = columns * bpp
+    output = bytearray()
+    previous = bytearray(row_size)
+    for start in range(0, len(data), row_size + 1):
+        kind = data[start]
+        row = bytearray(data[start + 1:start + 1 + row_size])
+        for i in range(len(row)):
+            left = row[i - bpp] if i >= bpp else 0
+            up = previous[i]
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xff
+            elif kind == 2:
+                row[i] = (row[i] + up) & 0xff
+            elif kind == 3:
+                row[i] = (row[i] + ((left + up) >> 1)) & 0xff
+            elif kind == 4:
+                upper_left = previous[i - bpp] if i >= bpp else 0
+                p = left + up - upper_left
+                pa, pb, pc = abs(p - left), abs(p - up), abs(p - upper_left)
+                row[i] = (row[i] + (left if pa <= pb and pa <= pc else up if pb <= pc else upper_left)) & 0xff
+        output += row
+        previous = row
+    return bytes(output)
+
+
+# 讀取 PDF 檔案的交互參照表與物件
+class PdfReader:
+    def __init__(self, data):
+        self.data = data
+        self.xref = {}  # 物件編號 -> (世代, 檔案中的位置)
+        self.compressed = {}  # 存放在物件串流中的物件: 物件編號 -> (物件串流編號, 串流中的索引)
+        self._objects = {}
+        self._object_streams = {}
+        matches = list(_STARTXREF.finditer(data, max(0, len(data) - 4096)))
+        if not data.startswith(b'%PDF-') or not matches:
+            raise PdfError("不是 PDF 檔案或檔案不完整 (找不到 startxref)")
+        self.startxref = int(matches[-1].group(1))
+        self.trailer = None
+        self.uses_xref_stream = False
+        offset, seen = self.startxref, set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            trailer, is_stream = self._read_xref_section(offset)
+            if self.trailer is None:
+                self.trailer, self.uses_xref_stream = trailer, is_stream
+            if 'XRefStm' in trailer:
+                self._read_xref_section(trailer['XRefStm'])
+            offset = trailer.get('Prev')
+        if 'Encrypt' in self.trailer:
+            raise PdfError("不支援加密 (有密碼保護) 的 PDF")
+        if 'Root' not in self.trailer:
+            raise PdfError("PDF 缺少 /Root")
+
+    # 讀取一段交互參照，較新的記錄優先 (已有記錄的物件編號不覆寫)；回傳 (trailer, 是否為交互參照串流)
+    def _read_xref_section(self, offset):
+        data = self.data
+        pos = _SKIP.match(data, offset).end()
+        if data.startswith(b'xref', pos):
+            pos += 4
+            while True:
+                pos = _SKIP.match(data, pos).end()
+                if data.startswith(b'trailer', pos):
+                    return _Parser(data, pos + 7).parse(), False
+                match = _XREF_SUBSECTION.match(data, pos)
+                if not match:
+                    raise PdfError(f"位置 {pos} 的交互參照表格式錯誤")
+                first, count = int(match.group(1)), int(match.group(2))
+                pos = match.end()
+                for num in range(first, first + count):
+                    entry = _XREF_ENTRY.match(data, pos)
+                    if not entry:
+                        raise PdfError(f"位置 {pos} 的交互參照表格式錯誤")
+                    pos = entry.end()
+                    if entry.group(3) == b'n' and num not in self.xref and num not in self.compressed:
+                        self.xref[num] = (int(entry.group(2)), int(entry.group(1)))
+        stream = self._parse_indirect(offset)[1]
+        if not isinstance(stream, Stream) or stream.attrs.get('Type') != 'XRef':
+            raise PdfError(f"位置 {offset} 不是交互參照表")
+        widths = stream.attrs['W']
+        entries = decode_stream(stream)
+        index = stream.attrs.get('Index', [0, stream.attrs['Size']])
+        pos = 0
+        for first, count in zip(index[::2], index[1::2]):
+            for num in range(first, first + count):
+                fields = []
+                for width in widths:
+                    fields.append(int.from_bytes(entries[pos:pos + width], 'big') if width else None)
+                    pos += width
+                kind = 1 if fields[0] is None else fields[0]
+                if num in self.xref or num in self.compressed:
+                    continue
+                if kind == 1:
+                    self.xref[num] = (fields[2] or 0, fields[1])
+                elif kind == 2:
+                    self.compressed[num] = (fields[1], fields[2])
+        return stream.attrs, True
+
+    # 解析 offset 位置的間接物件，回傳 (Ref, 物件)
+    def _parse_indirect(self, offset):
+        data = self.data
+        header = _OBJECT_HEADER.match(data, offset)
+        if not header:
+            raise PdfError(f"位置 {offset} 不是 PDF 物件")
+        parser = _Parser(data, header.end())
+        obj = parser.parse()
+        if isinstance(obj, dict):
+            parser.skip()
+            if data.startswith(b'stream', parser.pos):
+                start = parser.pos + 6
+                start += 2 if data.startswith(b'\r\n', start) else 1 if data[start:start + 1] in (b'\r', b'\n') else 0
+                length = self.resolve(obj.get('Length'))
+                end = start + length if isinstance(length, int) else -1
+                if end < 0 or not data.startswith(b'endstream', _SKIP.match(data, min(end, len(data))).end()):
+                    # /Length 不正確時改以 endstream 的位置為準
+                    end = data.index(b'endstream', start)
+                    end -= 2 if data[end - 2:end] == b'\r\n' else 1 if data[end - 1:end] in (b'\r', b'\n') else 0
+                obj = Stream(obj, data[start:end])
+        return Ref(int(header.group(1)), int(header.group(2))), obj
+
+    # 取得間接參照指向的物件；其他物件原樣回傳
+    def resolve(self, obj):
+        while isinstance(obj, Ref):
+            obj = self.get(obj.num)
+        return obj
+
+    def get(self, num):
+        if num in self._objects:
+            return self._objects[num]
+        self._objects[num] = None  # 避免循環參照
+        if num in self.xref:
+            obj = self._parse_indirect(self.xref[num][1])[1]
+        elif num in self.compressed:
+            obj = self._get_compressed(*self.compressed[num])
+        else:
+            obj = None
+        self._objects[num] = obj
+        return obj
+
+    def _get_compressed(self, stream_num, index):
+        if stream_num not in self._object_streams:
+            stream = self.get(stream_num)
+            if not isinstance(stream, Stream):
+                raise PdfError(f"物件串流 {stream_num} 不存在")
+            content = decode_stream(stream)
+            parser = _Parser(content)
+            offsets = [(parser.parse(), parser.parse())[1] for _ in range(stream.attrs['N'])]
+            self._object_streams[stream_num] = (content, stream.attrs['First'], offsets)
+        content, first, offsets = self._object_streams[stream_num]
+        return _Parser(content, first + offsets[index]).parse()
+
+    # 第一頁的頁面物件參照、頁面字典，以及含由上層頁面樹繼承的屬性 (Resources、MediaBox 等)
+    def first_page(self):
+        inherited = {}
+        node_ref = self.resolve(self.trailer['Root'])['Pages']
+        for _ in range(64):
+            node = self.resolve(node_ref)
+            if not isinstance(node, dict):
+                break
+            for key in ('Resources', 'MediaBox', 'CropBox', 'Rotate'):
+                if key in node:
+                    inherited[key] = node[key]
+            if node.get('Type') == 'Page' or 'Kids' not in node:
+                return node_ref, node, inherited
+            kids = self.resolve(node['Kids'])
+            if not kids:
+                break
+            node_ref = kids[0]
+        raise PdfError("PDF 中找不到任何頁面")
+
+
+# 解開串流內容，只支援 FlateDecode (含 PNG 預測器)
+def decode_stream(stream):
+    filters = stream.attrs.get('Filter') or []
+    params = stream.attrs.get('DecodeParms') or []
+    filters = filters if isinstance(filters, list) else [filters]
+    params = params if isinstance(params, list) else [params]
+    data = stream.data
+    for i, name in enumerate(filters):
+        if name not in ('FlateDecode', 'Fl'):
+            raise PdfError(f"不支援的壓縮方式: /{name}")
+        data = zlib.decompress(data)
+        param = params[i] if i < len(params) and isinstance(params[i], dict) else {}
+        if param.get('Predictor', 1) >= 10:
+            bpp = max(1, param.get('Colors', 1) * param.get('BitsPerComponent', 8) // 8)
+            data = _png_unpredict(data, param.get('Columns', 1), bpp)
+    return data
+
+
+# 證書範本：讀入一次範本 PDF 並預先算好增量更新需要的內容，之後每份證書只需產生文字內容
+# 可在行程間傳遞 (pickle)，供 certgen 的行程池使用
+class PageOverlay:
+    RESOURCE_FONT = 'CertFont'
+
+    def __init__(self, data, font='MSung-Light'):
+        if font not in FONTS:
+            raise PdfError(f"不支援的字型 '{font}' (可用: {', '.join(FONTS)})")
+        reader = PdfReader(data)
+        self.base = data
+        self.font = font
+        self.uses_xref_stream = reader.uses_xref_stream
+        self.startxref = reader.startxref
+        self.size = max([reader.trailer.get('Size', 0)] + [n + 1 for n in list(reader.xref) + list(reader.compressed)])
+        self.trailer = {key: reader.trailer[key] for key in ('Root', 'Info', 'ID') if key in reader.trailer}
+        self.page_ref, page, inherited = reader.first_page()
+        if not isinstance(self.page_ref, Ref):
+            raise PdfError("第一頁的頁面不是間接物件")
+
+        # 頁面座標以 MediaBox 的左下角為原點
+        box = reader.resolve(inherited.get('MediaBox')) or [0, 0, 612, 792]
+        self.origin = (min(box[0], box[2]), min(box[1], box[3]))
+        self.page_size = (abs(box[2] - box[0]), abs(box[3] - box[1]))
+
+        # 原本的內容串流 (可能是參照、參照陣列，或指向參照陣列的參照)
+        contents = page.get('Contents')
+        if isinstance(contents, Ref) and isinstance(reader.resolve(contents), list):
+            contents = reader.resolve(contents)
+        self.contents = contents if isinstance(contents, list) else [contents] if contents is not None else []
+
+        # 頁面的資源字典加上文字使用的字型 (Resources 可能繼承自上層或為參照，一律改為直接寫在頁面中)
+        resources = dict(reader.resolve(inherited.get('Resources')) or {})
+        fonts = dict(reader.resolve(resources.get('Font')) or {})
+        self.font_key = self.RESOURCE_FONT
+        while self.font_key in fonts:
+            self.font_key += '_'
+        self.resources = resources
+        self.fonts = fonts
+        self.page = {key: value for key, value in page.items() if key not in ('Contents', 'Resources')}
+        for key in ('MediaBox', 'CropBox', 'Rotate'):
+            if key in inherited and key not in self.page:
+                self.page[key] = inherited[key]
+
+    @classmethod
+    def from_file(cls, path, font='MSung-Light'):
+        with open(path, 'rb') as f:
+            return cls(f.read(), font)
+
+    # 文字寬度 (單位為字級的千分之一)，與字型的 /W 設定一致
+    @staticmethod
+    def text_width(text):
+        return sum(500 if ' ' <= c <= '~' else 1000 for c in text)
+
+    # texts: [(文字, x, y, 字級, 對齊 left/center/right, (r, g, b)), ...]，座標單位為點 (1/72 英吋)，以頁面左下角為原點
+    def content(self, texts):
+        ops = [b'Q']
+        for text, x, y, size, align, color in texts:
+            if not text:
+                continue
+            width = self.text_width(text) * size / 1000
+            x -= width / 2 if align == 'center' else width if align == 'right' else 0
+            ops.append(b'BT ' + serialize(Name(self.font_key)) + b' ' + serialize(float(size)) + b' Tf ' +
+                       b' '.join(serialize(float(c)) for c in color) + b' rg 1 0 0 1 ' +
+                       serialize(float(x + self.origin[0])) + b' ' + serialize(float(y + self.origin[1])) + b' Tm <' +
+                       text.encode('utf-16-be').hex().upper().encode('ascii') + b'> Tj ET')
+        return b'\n'.join(ops) + b'\n'
+
+    # 附加在範本之後的增量更新內容
+    def update(self, texts):
+        n = self.size
+        font_ref, cid_font_ref, descriptor_ref, before_ref, after_ref = (Ref(n + i, 0) for i in range(5))
+        descriptor = dict(FONTS[self.font], Type=Name('FontDescriptor'), FontName=Name(self.font), ItalicAngle=0)
+        descriptor['FontBBox'] = list(descriptor['FontBBox'])
+        page = dict(self.page)
+        # 原本的內容以 q ... Q 包住，避免改變後的繪圖狀態影響加上的文字
+        page['Contents'] = [before_ref] + self.contents + [after_ref]
+        page['Resources'] = dict(self.resources, Font=dict(self.fonts, **{self.font_key: font_ref}))
+        objects = [
+            (font_ref, {'Type': Name('Font'), 'Subtype': Name('Type0'), 'BaseFont': Name(self.font),
+                        'Encoding': Name('UniCNS-UTF16-H'), 'DescendantFonts': [cid_font_ref]}),
+            (cid_font_ref, {'Type': Name('Font'), 'Subtype': Name('CIDFontType0'), 'BaseFont': Name(self.font),
+                            'CIDSystemInfo': {'Registry': RawString(b'(Adobe)'), 'Ordering': RawString(b'(CNS1)'),
+                                              'Supplement': 4},
+                            'FontDescriptor': descriptor_ref, 'DW': 1000, 'W': [1, 95, 500]}),
+            (descriptor_ref, {key: descriptor[key] for key in ('Type', 'FontName', 'Flags', 'FontBBox', 'ItalicAngle',
+                                                               'Ascent', 'Descent', 'CapHeight', 'StemV')}),
+            (before_ref, Stream({}, b'q\n')),
+            (after_ref, Stream({}, self.content(texts))),
+            (self.page_ref, page)
+        ]
+
+        base_length = len(self.base)
+        output = bytearray() if self.base.endswith((b'\n', b'\r')) else bytearray(b'\n')
+        offsets = {}
+        for ref, obj in objects:
+            offsets[ref] = base_length + len(output)
+            output += b'%d %d obj\n' % ref
+            if isinstance(obj, Stream):
+                output += serialize(dict(obj.attrs, Length=len(obj.data))) + b'\nstream\n' + obj.data + b'\nendstream'
+            else:
+                output += serialize(obj)
+            output += b'\nendobj\n'
+
+        trailer = dict(self.trailer, Prev=self.startxref)
+        sections = [(self.page_ref.num, [offsets[self.page_ref]])]
+        sections.append((n, [offsets[ref] for ref, _ in objects[:5]]))
+        xref_offset = base_length + len(output)
+        if self.uses_xref_stream:
+            # 範本使用交互參照串流時，增量更新也以交互參照串流記錄 (W = [1 4 2]，未壓縮)
+            xref_ref = Ref(n + 5, 0)
+            sections[1][1].append(xref_offset)
+            gens = {self.page_ref.num: self.page_ref.gen}
+            rows = b''.join(b'\x01' + offset.to_bytes(4, 'big') + gens.get(first + i, 0).to_bytes(2, 'big')
+                            for first, entries in sections for i, offset in enumerate(entries))
+            attrs = dict(Type=Name('XRef'), Size=n + 6, W=[1, 4, 2],
+                         Index=[v for first, entries in sections for v in (first, len(entries))], **trailer)
+            output += b'%d %d obj\n' % xref_ref + serialize(dict(attrs, Length=len(rows))) + b'\nstream\n' + rows + \
+                b'\nendstream\nendobj\n'
+        else:
+            output += b'xref\n0 1\n0000000000 65535 f\r\n'
+            for first, entries in sections:
+                output += b'%d %d\n' % (first, len(entries))
+                for i, offset in enumerate(entries):
+                    gen = self.page_ref.gen if first + i == self.page_ref.num else 0
+                    output += b'%010d %05d n\r\n' % (offset, gen)
+            output += b'trailer\n' + serialize(dict(trailer, Size=n + 5)) + b'\n'
+        output += b'startxref\n%d\n%%%%EOF\n' % xref_offset
+        return bytes(output)
+
+    # 將加上文字的證書寫入已開啟的檔案
+    def write(self, f, texts):
+        f.write(self.base)
+        f.write(self.update(texts))
@@ -0,0 +1,335 @@
+import json
+import os
+import random
+import re
+import socket
+import struct
+import time
+import unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from .attachment_cache import encoded_size
+
+# 實務上可寄送的地址格式：local part 為 dot-atom，網域至少兩段且每段不以 - 開頭或結尾
+_LOCAL_PART = re.compile(r"^[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*$")
+_DOMAIN_LABEL = re.compile(r'^(?!-)[A-Za-z0-9-]{1,63}(?<!-)$')
+
+# 問題代碼與說明；error 的記錄不會寄送，warning 只列入報告
+ISSUES = {
+    'missing_name': ('error', '姓名為空'),
+    'missing_email': ('error', 'Email 為空'),
+    'invalid_email': ('error', 'Email 格式錯誤'),
+    'fullwidth_email': ('error', 'Email 含全形字元'),
+    'duplicate': ('error', '與前面的記錄重複 (相同姓名與 Email)'),
+    'shared_email': ('warning', '與其他學員使用相同 Email'),
+    'no_mail_domain': ('error', 'Email 網域不存在或不收信'),
+    'dns_unknown': ('warning', '無法查詢 Email 網域的 MX 記錄'),
+    'missing_certificate': ('error', '找不到對應的證書檔案'),
+    'duplicate_certificate': ('error', '找到多個同名證書檔案'),
+    'fuzzy_certificate': ('warning', '以相似姓名比對到證書'),
+    'empty_certificate': ('error', '證書檔案為空'),
+    'attachment_too_large': ('error', '證書檔案超過附件大小上限'),
+}
+
+
+# 檢查 Email 格式，回傳問題代碼或 None
+def check_email_syntax(address):
+    if unicodedata.normalize('NFKC', address) != address:
+        return 'fullwidth_email'  # 例如全形的 ＠ 或英數字，常見於中文輸入法
+    if len(address) > 254 or address.count('@') != 1:
+        return 'invalid_email'
+    local, domain = address.split('@')
+    if not local or len(local) > 64 or not _LOCAL_PART.match(local):
+        return 'invalid_email'
+    try:
+        ascii_domain = domain.encode('idna').decode('ascii')
+    except UnicodeError:
+        return 'invalid_email'
+    labels = ascii_domain.split('.')
+    if len(labels) < 2 or not all(_DOMAIN_LABEL.match(label) for label in labels) or labels[-1].isdigit():
+        return 'invalid_email'
+    return None
+
+
+def normalize_email(address):
+    return address.strip().lower()
+
+
+# 讀取系統設定的 DNS 伺服器 (通常為本機的解析服務，例如 127.0.0.53)
+def system_nameserver():
+    try:
+        with open('/etc/resolv.conf', 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == 'nameserver':
+                    return parts[1]
+    except OSError:
+        pass
+    return '127.0.0.1'
+
+
+# 以 UDP 查詢 MX 記錄的最小 DNS 用戶端 (只使用標準函式庫)，結果快取於 JSON 檔
+# 查詢結果：'ok' (有 MX，或沒有 MX 但有 A 記錄，依 RFC 5321 可直接投遞)、
+# 'no_mail' (網域不存在，或 RFC 7505 的 null MX 表示不收信)、'unknown' (逾時或查詢失敗)
+class MXResolver:
+    QTYPE_A = 1
+    QTYPE_MX = 15
+    QTYPE_AAAA = 28
+
+    # nameserver 可寫成 host:port，例如本機在非標準埠號的 DNS 轉送服務
+    def __init__(self, nameserver=None, cache_path=None, cache_days=7, timeout=2.0, retries=2):
+        self.nameserver = nameserver or system_nameserver()
+        self.port = 53
+        if self.nameserver.count(':') == 1:
+            host, _, port = self.nameserver.partition(':')
+            self.nameserver, self.port = host, int(port)
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.cache_seconds = cache_days * 86400
+        self.timeout = timeout
+        self.retries = retries
+        self.cache = {}
+        if self.cache_path and self.cache_path.exists():
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    self.cache = json.load(f)
+            except (OSError, ValueError):
+                self.cache = {}
+
+    def _query(self, name, qtype):
+        query_id = random.randrange(65536)
+        question = b''.join(bytes([len(label)]) + label for label in name.encode('idna').split(b'.') if label)
+        packet = struct.pack('>HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + question + b'\0' + struct.pack('>HH', qtype, 1)
+        with socket.socket(socket.AF_INET6 if ':' in self.nameserver else socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(self.timeout)
+            for _ in range(self.retries):
+                try:
+                    sock.sendto(packet, (self.nameserver, self.port))
+                    while True:
+                        data = sock.recv(4096)
+                        if len(data) >= 12 and struct.unpack('>H', data[:2])[0] == query_id:
+                            return self._parse(data, qtype)
+                except socket.timeout:
+                    continue
+        raise TimeoutError(f"DNS 伺服器 {self.nameserver} 沒有回應")
+
+    # 回傳 (rcode, [rdata, ...])，只取與查詢類型相同的答案
+    @staticmethod
+    def _parse(data, qtype):
+        flags, qdcount, ancount = struct.unpack('>HHH', data[2:8])
+        offset = 12
+
+        def skip_name(offset):
+            while True:
+                length = data[offset]
+                if length == 0:
+                    return offset + 1
+                if length & 0xC0 == 0xC0:  # 名稱壓縮指標
+                    return offset + 2
+                offset += length + 1
+
+        for _ in range(qdcount):
+            offset = skip_name(offset) + 4
+        answers = []
+        for _ in range(ancount):
+            offset = skip_name(offset)
+            rtype, _, _, rdlength = struct.unpack('>HHIH', data[offset:offset + 10])
+            offset += 10
+            if rtype == qtype:
+                answers.append(data[offset:offset + rdlength])
+            offset += rdlength
+        return flags & 0x000F, answers
+
+    def _lookup(self, domain):
+        try:
+            rcode, answers = self._query(domain, self.QTYPE_MX)
+            if rcode == 3:  # NXDOMAIN
+                return 'no_mail'
+            if rcode != 0:
+                return 'unknown'
+            if answers:
+                # null MX: 優先順序 0、主機名稱為根網域 "."
+                if len(answers) == 1 and answers[0][2:3] == b'\0':
+                    return 'no_mail'
+                return 'ok'
+            for qtype in (self.QTYPE_A, self.QTYPE_AAAA):
+                rcode, answers = self._query(domain, qtype)
+                if rcode == 0 and answers:
+                    return 'ok'
+            return 'no_mail'
+        except (OSError, IndexError, struct.error):
+            return 'unknown'
+
+    # 查詢多個網域 (重複的網域只查一次)，回傳 {網域: 結果}；未過期的快取結果不重新查詢
+    def lookup_many(self, domains, workers=16):
+        now = time.time()
+        results = {}
+        pending = []
+        for domain in set(domains):
+            cached = self.cache.get(domain)
+            if cached and now - cached[1] < self.cache_seconds:
+                results[domain] = cached[0]
+            else:
+                pending.append(domain)
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+                for domain, status in zip(pending, executor.map(self._lookup, pending)):
+                    results[domain] = status
+                    if status != 'unknown':  # 查詢失敗不快取，下次重新查詢
+                        self.cache[domain] = [status, now]
+            self.save()
+        return results
+
+    def save(self):
+        if not self.cache_path:
+            return
+        tmp_path = self.cache_path.with_name(self.cache_path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.cache, f)
+        os.replace(tmp_path, self.cache_path)
+
+
+# 寄送前的整批檢查結果
+# - queue: 可寄送的記錄 [(行號, 欄位, 證書路徑), ...]，已去除重複，依原始順序排列
+# - issues: 每個問題一筆 {'row', 'name', 'email', 'level', 'code', 'message'}
+class PreflightResult:
+    def __init__(self, total_rows, queue, issues):
+        self.total_rows = total_rows
+        self.queue = queue
+        self.issues = issues
+
+    @property
+    def excluded_rows(self):
+        return len({issue['row'] for issue in self.issues if issue['level'] == 'error'})
+
+    def counts(self):
+        return Counter(issue['code'] for issue in self.issues)
+
+    def write_report(self, path, contacts_path=None):
+        report = {
+            'generated': datetime.now().isoformat(timespec='seconds'),
+            'contacts_file': str(contacts_path) if contacts_path else None,
+            'total_rows': self.total_rows,
+            'valid_rows': len(self.queue),
+            'excluded_rows': self.excluded_rows,
+            'issue_counts': dict(self.counts()),
+            'issues': self.issues
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    # 工作佇列：每行一筆 {"row": 行號, "certificate": 證書路徑, "fields": 欄位}
+    def write_queue(self, path):
+        tmp_path = Path(str(path) + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for row_num, row, certificate_path in self.queue:
+                f.write(json.dumps({'row': row_num, 'certificate': str(certificate_path), 'fields': row},
+                                   ensure_ascii=False) + '\n')
+        os.replace(tmp_path, path)
+
+
+# 讀取 write_queue 產生的工作佇列，逐筆產生 (行號, 欄位, 證書路徑)
+def read_work_queue(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record['row'], record['fields'], Path(record['certificate'])
+
+
+# 一次檢查整份聯絡資料，在開啟任何 SMTP 連線前找出所有問題
+# 先逐行做不需外部資源的檢查並收集網域，再一次查詢所有不重複網域的 MX 記錄
+# - settings: {'max_attachment_mb': 編碼後附件大小上限 (0 表示不限)}
+# - resolver: 選填的 MXResolver，未提供時不檢查網域
+# - certificate_paths: 選填的 {行號: 證書路徑} (由證書範本產生證書時)，提供時直接使用，不以 certificate_index 依姓名查找
+def run_preflight(contacts, certificate_index, settings, resolver=None, certificate_paths=None):
+    max_encoded = settings.get('max_attachment_mb', 0) * 1024 * 1024
+    issues = []
+    candidates = []
+    seen = set()
+    email_names = {}
+    total_rows = 0
+
+    def add_issue(row_num, name, email, code, detail=''):
+        level, message = ISSUES[code]
+        issues.append({'row': row_num, 'name': name, 'email': email, 'level': level, 'code': code,
+                       'message': f"{message}{': ' + detail if detail else ''}"})
+
+    for row_num, row in contacts:
+        total_rows += 1
+        name = row.get('姓名', '')
+        email = row.get('電子郵件', '')
+        errors = 0
+        if not name:
+            add_issue(row_num, name, email, 'missing_name')
+            errors += 1
+        if not email:
+            add_issue(row_num, name, email, 'missing_email')
+            errors += 1
+        else:
+            code = check_email_syntax(email)
+            if code:
+                add_issue(row_num, name, email, code)
+                errors += 1
+
+        if name and email:
+            key = (normalize_email(email), name)
+            if key in seen:
+                add_issue(row_num, name, email, 'duplicate')
+                continue
+            seen.add(key)
+            email_names.setdefault(normalize_email(email), set()).add(name)
+
+        certificate_path = None
+        if name:
+            if certificate_paths is not None:
+                certificate_path = certificate_paths.get(row_num)
+                match = 'exact' if certificate_path else None
+            else:
+                certificate_path, match = certificate_index.lookup(name)
+            if match == 'duplicate':
+                add_issue(row_num, name, email, 'duplicate_certificate')
+                errors += 1
+            elif not certificate_path:
+                add_issue(row_num, name, email, 'missing_certificate')
+                errors += 1
+            else:
+                if match == 'fuzzy':
+                    add_issue(row_num, name, email, 'fuzzy_certificate', certificate_path.name)
+                size = certificate_path.stat().st_size
+                # 與寄送時相同的 base64 編碼後大小 (每行 76 字元加 CRLF)
+                attachment_size = encoded_size(size)
+                if size == 0:
+                    add_issue(row_num, name, email, 'empty_certificate', certificate_path.name)
+                    errors += 1
+                elif max_encoded and attachment_size > max_encoded:
+                    add_issue(row_num, name, email, 'attachment_too_large',
+                              f"{certificate_path.name} 編碼後 {attachment_size / 1024 / 1024:.1f} MB")
+                    errors += 1
+
+        if not errors:
+            candidates.append((row_num, row, certificate_path))
+
+    for row_num, row, _ in candidates:
+        names = email_names[normalize_email(row['電子郵件'])]
+        if len(names) > 1:
+            add_issue(row_num, row['姓名'], row['電子郵件'], 'shared_email', '、'.join(sorted(names)))
+
+    queue = candidates
+    if resolver is not None and candidates:
+        domain_of = lambda row: row['電子郵件'].rpartition('@')[2].lower()
+        statuses = resolver.lookup_many(domain_of(row) for _, row, _ in candidates)
+        queue = []
+        for row_num, row, certificate_path in candidates:
+            status = statuses[domain_of(row)]
+            if status == 'no_mail':
+                add_issue(row_num, row['姓名'], row['電子郵件'], 'no_mail_domain', domain_of(row))
+                continue
+            if status == 'unknown':
+                add_issue(row_num, row['姓名'], row['電子郵件'], 'dns_unknown', domain_of(row))
+            queue.append((row_num, row, certificate_path))
+
+    issues.sort(key=lambda issue: issue['row'])
+    return PreflightResult(total_rows, queue, issues)
@@ -0,0 +1,321 @@
+from pathlib import Path
+
+from .campaign import Campaign, JobFileError, load_job_file
+from .cert_index import CertificateIndex
+from .contact_reader import ContactReader
+from .mail_template import MessageTemplate
+from .preflight import MXResolver, read_work_queue, run_preflight
+from .send_journal import SendJournal
+
+# 範本預檢：在寄出任何郵件前確認所有範本變數都有對應的欄位，避免寄到一半才出錯
+# 除了聯絡資料欄位外，程式另外提供以下變數
+TEMPLATE_GLOBAL_VARIABLES = {'課程名稱', '測試模式標記', '測試模式說明'}
+
+
+# 寄送工作 (課程)：以 --job 指定一或多個工作檔 (例如 jobs/*.ini) 同時執行，未指定時使用 config.ini 的 [JOB] 區段
+# options 為命令列選項 (cli.py)，任何錯誤都在開始寄送前結束程式
+def load_campaigns(settings, options):
+    try:
+        jobs = [load_job_file(path) for path in options.job] if options.job else [settings['job']]
+    except JobFileError as e:
+        print(f"錯誤: {e}")
+        exit(1)
+    if len(jobs) > 1 and (options.contacts or options.certificate_dir or options.journal or options.report or options.queue):
+        print("錯誤: --contacts、--certificate-dir、--journal、--report 與 --queue 只能在執行單一工作時使用。")
+        exit(1)
+    if options.contacts:
+        jobs[0]['contacts'] = Path(options.contacts)
+    if options.certificate_dir:
+        jobs[0]['certificate_dir'] = Path(options.certificate_dir)
+    duplicate_names = {job['name'] for job in jobs if [j['name'] for j in jobs].count(job['name']) > 1}
+    if duplicate_names:
+        print(f"錯誤: 工作名稱重複: {', '.join(sorted(duplicate_names))} (可在工作檔的 [JOB] name 指定不同的名稱)")
+        exit(1)
+
+    # 郵件範本只在啟動時載入並編譯一次；工作檔未指定的範本沿用 [TEMPLATE]，相同的範本檔只載入一次
+    loaded_templates = {}
+    def load_template(job):
+        paths = tuple(job[key] or settings['template'][key] for key in ('subject', 'body', 'html_body'))
+        if paths not in loaded_templates:
+            loaded_templates[paths] = MessageTemplate.from_files(*paths, sender=settings['smtp']['sender_email'])
+        return loaded_templates[paths]
+
+    campaigns = []
+    for job in jobs:
+        try:
+            campaigns.append(Campaign(job, load_template(job)))
+        except Exception as e:
+            print(f"讀取工作 '{job['name']}' 的郵件範本失敗: {str(e)}")
+            exit(1)
+    if len(campaigns) > 1:
+        for campaign in campaigns:
+            campaign.tag = f"[{campaign.name}] "
+        print(f"同時執行 {len(campaigns)} 個寄送工作: {', '.join(f'{c.name} ({c.course_name})' for c in campaigns)}")
+    return campaigns
+
+
+# 開啟聯絡資料 (串流讀取，寄送時才逐行載入，支援 .xlsx / .csv / .jsonl)
+def open_contacts(campaign):
+    tag = campaign.tag
+    contact_file = campaign.contacts_path
+    try:
+        if not contact_file.exists():
+            print(f"{tag}錯誤: 聯絡資料檔案 '{contact_file}' 不存在。無法執行。")
+            exit(1)
+        campaign.contacts = ContactReader(contact_file)
+        print(f"{tag}成功開啟聯絡資料 '{contact_file}'，將逐行讀取並寄送。")
+    except Exception as e:
+        print(f"{tag}讀取聯絡資料檔案 '{contact_file}' 失敗: {str(e)}")
+        exit(1)
+    return campaign.contacts
+
+
+# 工作設定 certificate_template 時，依聯絡資料以證書範本產生證書到證書目錄 (certgen.py)
+# 內容未變動的證書沿用上次產生的檔案；force 時全部重新產生
+# 證書產生模組只在設定了證書範本時才載入，不影響一般寄送與試執行的啟動時間
+def render_certificates(campaign, settings, force=False):
+    from .certgen import DEFAULT_FILENAME, CertificateRenderer, LayoutError, parse_layout
+    from .pdf_writer import PdfError
+
+    tag = campaign.tag
+    job = campaign.job
+    certgen_config = settings['certgen']
+    try:
+        layout = parse_layout(job['certificate_text'])
+    except LayoutError as e:
+        print(f"{tag}錯誤: 工作 '{campaign.name}' 的證書文字設定 (certificate_text) 有誤: {str(e)}")
+        exit(1)
+    try:
+        renderer = CertificateRenderer(
+            job['certificate_template'],
+            layout,
+            filename=job['certificate_filename'] or DEFAULT_FILENAME,
+            font=certgen_config['font'],
+            workers=certgen_config['workers'],
+            cache_path=certgen_config['cache'] or None
+        )
+    except (OSError, PdfError) as e:
+        print(f"{tag}錯誤: 無法使用證書範本 '{job['certificate_template']}': {str(e)}")
+        exit(1)
+
+    contacts = campaign.contacts
+    if contacts.columns is not None:
+        missing_variables = renderer.variables - set(contacts.columns) - TEMPLATE_GLOBAL_VARIABLES
+        if missing_variables:
+            print(f"{tag}錯誤: 證書文字或檔名使用了聯絡資料中沒有的欄位: {', '.join(sorted(missing_variables))}")
+            exit(1)
+
+    rows = ((row_num, {**row, '課程名稱': campaign.course_name}) for row_num, row in contacts)
+    try:
+        result = renderer.render(campaign.certificate_dir, rows, force)
+    except Exception as e:
+        print(f"{tag}產生證書時發生錯誤: {str(e)}")
+        exit(1)
+    print(f"{tag}產生證書到 '{campaign.certificate_dir}': 新產生 {result.rendered} 份，內容未變動沿用 {result.reused} 份" +
+          (f"，姓名空白略過 {result.skipped} 筆" if result.skipped else "") +
+          f"，耗時 {result.elapsed:.2f} 秒 ({result.workers} 個行程)")
+    for row_num, file_name in result.conflicts[:20]:
+        print(f"  警告 (Excel 第 {row_num} 行): 證書 '{file_name}' 已由前面姓名相同、內容不同的行產生，此行不另外產生")
+    for where, message in result.errors[:20]:
+        print(f"  錯誤 ({f'Excel 第 {where} 行' if isinstance(where, int) else where}): {message}")
+    if len(result.conflicts) > 20 or len(result.errors) > 20:
+        print(f"  ... 共 {len(result.conflicts)} 個檔名衝突、{len(result.errors)} 個錯誤")
+    return result
+
+
+# 開啟一個寄送工作的聯絡資料與證書目錄並執行寄送前檢查，任何錯誤都在開始寄送前結束程式
+def open_campaign(campaign, settings, options):
+    tag = campaign.tag
+    contact_file = campaign.contacts_path
+    certificate_dir = campaign.certificate_dir
+    certificate_config = settings['certificate']
+    preflight_config = settings['preflight']
+
+    contacts = open_contacts(campaign)
+
+    if contacts.columns is not None:
+        missing_variables = campaign.template.missing_variables(set(contacts.columns) | TEMPLATE_GLOBAL_VARIABLES)
+        if missing_variables:
+            print(f"{tag}錯誤: 郵件範本使用了聯絡資料中沒有的欄位: {', '.join(sorted(missing_variables))}")
+            exit(1)
+    else:
+        # 每行欄位可能不同 (例如 .jsonl)，需逐行檢查
+        rows_with_missing = []
+        for row_num, row in contacts:
+            missing_variables = campaign.template.missing_variables(set(row) | TEMPLATE_GLOBAL_VARIABLES)
+            if missing_variables:
+                rows_with_missing.append(f"第 {row_num} 行: {', '.join(sorted(missing_variables))}")
+        if rows_with_missing:
+            print(f"{tag}錯誤: 有 {len(rows_with_missing)} 行聯絡資料缺少郵件範本需要的欄位:")
+            for info in rows_with_missing[:20]:
+                print(f"  - {info}")
+            exit(1)
+
+    # 由證書範本產生證書時直接使用每一行產生的證書路徑，不依檔名解析姓名 (姓名可能含 - 或被取代的字元)；
+    # 否則建立證書索引 (姓名經 NFKC 正規化，並快取於證書目錄旁，目錄未變動時不需重新掃描)
+    certificate_index = certificate_paths = None
+    if campaign.job.get('certificate_template'):
+        certificate_paths = render_certificates(campaign, settings, options.force).paths
+    else:
+        try:
+            if not certificate_dir.exists() or not certificate_dir.is_dir():
+                print(f"{tag}錯誤: 證書目錄 '{certificate_dir}' 不存在或不是一個目錄。")
+                exit(1)
+            certificate_index = campaign.certificate_index = CertificateIndex(
+                certificate_dir,
+                patterns=certificate_config['filename_patterns'],
+                cache_path=certificate_config['index_cache'] or None,
+                fuzzy=certificate_config['fuzzy_match'],
+                fuzzy_cutoff=certificate_config['fuzzy_cutoff']
+            ).build()
+            print(f"{tag}找到 {len(certificate_index)} 個證書檔案並已建立索引 (沿用快取 {certificate_index.reused_count} 個，新解析 {certificate_index.parsed_count} 個)。")
+            if not len(certificate_index):
+                print(f"{tag}警告: 在證書目錄 '{certificate_dir}' 中未找到任何 PDF 證書檔案。")
+            for duplicate_name, duplicate_paths in certificate_index.duplicates.items():
+                print(f"{tag}警告: 姓名 '{duplicate_name}' 對應多個證書檔案，將無法自動選擇: {', '.join(p.name for p in duplicate_paths)}")
+        except Exception as e:
+            print(f"{tag}讀取證書目錄 '{certificate_dir}' 或處理證書檔案時發生錯誤: {str(e)}")
+            exit(1)
+
+    # 寄送前整批檢查：在開啟任何 SMTP 連線前找出資料不完整、Email 格式錯誤、重複、無證書等問題，
+    # 只有通過檢查的記錄會進入工作佇列；指定 --queue 時直接使用先前 --dry-run 產生的工作佇列
+    if options.queue and not options.dry_run:
+        try:
+            campaign.send_rows = list(read_work_queue(options.queue))
+        except Exception as e:
+            print(f"讀取工作佇列 '{options.queue}' 失敗: {str(e)}")
+            exit(1)
+        campaign.rows = len(campaign.send_rows)
+        print(f"使用工作佇列 '{options.queue}'，共 {len(campaign.send_rows)} 筆記錄。")
+    else:
+        resolver = None
+        if preflight_config['check_mx']:
+            resolver = MXResolver(preflight_config['dns_server'] or None, preflight_config['mx_cache'],
+                                  preflight_config['mx_cache_days'])
+        try:
+            preflight_result = campaign.preflight = run_preflight(contacts, certificate_index, preflight_config, resolver,
+                                                                    certificate_paths)
+        except Exception as e:
+            print(f"{tag}檢查聯絡資料時發生錯誤: {str(e)}")
+            exit(1)
+        campaign.send_rows = preflight_result.queue
+        campaign.rows = preflight_result.total_rows
+        counts = preflight_result.counts()
+        print(f"{tag}寄送前檢查: 共 {preflight_result.total_rows} 筆，可寄送 {len(campaign.send_rows)} 筆，排除 {preflight_result.excluded_rows} 筆" +
+              (f" ({', '.join(f'{code} {n}' for code, n in counts.most_common())})" if counts else ""))
+        for issue in preflight_result.issues[:20]:
+            print(f"  {'錯誤' if issue['level'] == 'error' else '提示'} (Excel 第 {issue['row']} 行，學員: {issue['name']} <{issue['email']}>): {issue['message']}")
+        if len(preflight_result.issues) > 20:
+            print(f"  ... 其餘 {len(preflight_result.issues) - 20} 個問題請見報告檔")
+
+        # 寄送前檢查排除的記錄列入略過 (每行只列出第一個問題)
+        excluded = {}
+        for issue in preflight_result.issues:
+            if issue['level'] == 'error':
+                excluded.setdefault(issue['row'], issue)
+        campaign.skipped = len(excluded)
+        for issue in excluded.values():
+            campaign.failed_info.append(f"{tag}Excel 行 {issue['row']}: {issue['name']} <{issue['email']}> - 原因: {issue['message']}")
+
+    if options.dry_run:
+        report_path = Path(options.report) if options.report else contact_file.with_suffix('.preflight.json')
+        queue_path = Path(options.queue) if options.queue else contact_file.with_suffix('.queue.jsonl')
+        try:
+            campaign.preflight.write_report(report_path, contact_file)
+            campaign.preflight.write_queue(queue_path)
+        except Exception as e:
+            print(f"{tag}寫入檢查報告或工作佇列失敗: {str(e)}")
+            exit(1)
+        print(f"\n{tag}檢查報告: {report_path}")
+        print(f"{tag}工作佇列: {queue_path} (以 --queue 指定即可只寄送這些記錄)")
+        return
+
+    # 寄送日誌：已成功寄出的行在重新執行時會自動略過
+    if not options.no_journal:
+        journal_path = Path(options.journal or campaign.job['journal'] or contact_file.with_suffix('.journal.jsonl'))
+        if options.resume and not journal_path.exists():
+            print(f"{tag}錯誤: 找不到寄送日誌 '{journal_path}'，沒有可續傳的寄送。")
+            exit(1)
+        try:
+            campaign.journal = SendJournal(journal_path)
+            print(f"{tag}使用寄送日誌 '{journal_path}'，已有 {len(campaign.journal.entries)} 筆記錄。")
+        except Exception as e:
+            print(f"{tag}開啟寄送日誌 '{journal_path}' 失敗: {str(e)}")
+            exit(1)
+
+
+# 由寄送前檢查通過的工作佇列產生待寄送項目，並依寄送日誌略過已寄出的記錄
+# retry_failed 時只產生日誌中記錄為失敗或狀態不明的行；test_recipient_email 不為空時為測試模式，所有郵件改寄到測試信箱
+def build_send_jobs(campaign, retry_failed=False, test_recipient_email=None):
+    test_mode = bool(test_recipient_email)
+    send_journal = campaign.journal
+    for current_row_num, row, certificate_path in campaign.send_rows: # 行號與 Excel 相同，標頭佔第 1 行
+        try:
+            recipient_name = row.get('姓名', '')
+            original_email = row.get('電子郵件', '')
+            recipient_email = test_recipient_email if test_mode else original_email # 測試模式強制所有信件都寄到測試信箱
+
+            # --retry-failed 只處理日誌中記錄為失敗或狀態不明的行
+            if retry_failed and send_journal.status(current_row_num, recipient_email) not in ('failed', 'pending'):
+                continue
+
+            if send_journal:
+                previous_status = send_journal.status(current_row_num, recipient_email, certificate_path)
+                if previous_status == 'sent':
+                    campaign.already_sent += 1
+                    continue
+                if previous_status == 'pending' and not retry_failed:
+                    # 上次執行在寄出與記錄結果之間中斷，無法確定是否已送達，為避免重複寄送先略過
+                    print(f"{campaign.tag}警告 (Excel 第 {current_row_num} 行，學員: {recipient_name}): 上次執行中斷，寄送狀態不明，跳過此記錄。")
+                    campaign.skipped += 1
+                    campaign.failed_info.append(f"{campaign.tag}Excel 行 {current_row_num}: {recipient_name} <{original_email}> - 原因: 寄送狀態不明 (確認後可用 --retry-failed 重寄)")
+                    continue
+
+            variables = dict(row)
+            variables['課程名稱'] = campaign.course_name
+            variables['測試模式標記'] = " (測試模式)" if test_mode else ""
+            variables['測試模式說明'] = f" (此為測試模式郵件，實際寄送至 {test_recipient_email})" if test_mode else ""
+
+            yield {
+                'campaign': campaign,
+                'row_num': current_row_num,
+                'name': recipient_name,
+                'email': recipient_email,
+                'original_email': original_email,
+                'certificate_path': certificate_path,
+                'variables': variables,
+                'test_mode': test_mode
+            }
+        except Exception as e_loop:
+            print(f"{campaign.tag}處理 Excel 第 {current_row_num} 行 (學員: '{row.get('姓名', '未知')}') 時發生未預期錯誤: {str(e_loop)}")
+            campaign.failed += 1
+            campaign.failed_info.append(f"{campaign.tag}Excel 行 {current_row_num}: {row.get('姓名', '未知')} <{row.get('電子郵件', '未知')}> - 原因: 迴圈中發生錯誤")
+
+
+# 讀取並開啟所有寄送工作，寄送與試執行共用
+def prepare_campaigns(settings, options):
+    if options.no_journal and options.retry_failed:
+        print("錯誤: --retry-failed 需要寄送日誌，不能與 --no-journal 同時使用。")
+        exit(1)
+    campaigns = load_campaigns(settings, options)
+    for campaign in campaigns:
+        open_campaign(campaign, settings, options)
+    return campaigns
+
+
+# 只產生證書：依各寄送工作的證書範本產生 (或更新) 證書，不執行寄送前檢查也不寄送
+def run_render(settings, options):
+    campaigns = load_campaigns(settings, options)
+    for campaign in campaigns:
+        if not campaign.job.get('certificate_template'):
+            print(f"{campaign.tag}錯誤: 工作 '{campaign.name}' 未設定證書範本 (certificate_template)。")
+            exit(1)
+    for campaign in campaigns:
+        open_contacts(campaign)
+        render_certificates(campaign, settings, options.force)
+
+
+# 試執行：只檢查整份聯絡資料並寫入檢查報告與工作佇列，不會載入任何 SMTP 相關模組
+def run_dry_run(settings, options):
+    prepare_campaigns(settings, options)
+    print("--- 試執行結束，未寄送任何郵件 ---")
@@ -0,0 +1,70 @@
+import threading
+import time
+
+
+# 令牌桶：rate 為每秒補充的令牌數，burst 為桶的容量（允許的瞬間突發量）
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # 距離下一個令牌可用還需等待的秒數（不消耗令牌）
+    def delay(self, now):
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+# 由多個令牌桶組成的速率限制器，例如同時限制每分鐘與每小時的寄送量
+# 所有桶都有令牌時才一次扣除，避免只扣到部分桶
+class RateLimiter:
+    def __init__(self, rate_per_minute=0, rate_per_hour=0, burst=1):
+        self.buckets = []
+        if rate_per_minute > 0:
+            self.buckets.append(TokenBucket(rate_per_minute / 60.0, burst))
+        if rate_per_hour > 0:
+            self.buckets.append(TokenBucket(rate_per_hour / 3600.0, burst))
+        self._lock = threading.Lock()
+
+    # 嘗試取得一個寄送額度：成功回傳 0，否則回傳建議等待秒數
+    def try_acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_seconds = max([b.delay(now) for b in self.buckets], default=0.0)
+            if wait_seconds > 0:
+                return wait_seconds
+            for b in self.buckets:
+                b.take()
+            return 0.0
+
+    # 距離下一個寄送額度可用還需等待的秒數 (不消耗額度)
+    def delay(self):
+        with self._lock:
+            now = time.monotonic()
+            return max([b.delay(now) for b in self.buckets], default=0.0)
+
+    # 阻塞直到取得寄送額度
+    def acquire(self):
+        while True:
+            wait_seconds = self.try_acquire()
+            if wait_seconds <= 0:
+                return
+            time.sleep(wait_seconds)
+
+
+# 依 [SEND] 設定建立全域速率限制器，未設定任何速率時回傳 None
+def create_limiter(send_settings, prefix=''):
+    limiter = RateLimiter(send_settings.get(prefix + 'rate_per_minute', 0),
+                          send_settings.get(prefix + 'rate_per_hour', 0),
+                          send_settings.get('burst', 1))
+    return limiter if limiter.buckets else None
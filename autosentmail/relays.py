@@ -0,0 +1,253 @@
+import asyncio
+import json
+import os
+import re
+import smtplib
+import threading
+from datetime import date
+from pathlib import Path
+
+from .smtp_pool import SMTPConnectionPool
+from .async_backend import AsyncSMTPPool
+
+
+# 沒有任何可用的 SMTP 帳號 (皆已停用或達到每日額度)
+class NoRelayAvailable(Exception):
+    pass
+
+
+# 代表寄送額度或頻率限制的回應文字，例如 Gmail 的 550 5.4.5 Daily user sending quota exceeded
+_QUOTA_PATTERN = re.compile(r'quota|limit exceeded|too many (messages|recipients)|sending limit', re.IGNORECASE)
+# 擴充狀態碼 (RFC 3463)，例如 5.2.2
+_ENHANCED_CODE = re.compile(r'\b[245]\.(\d{1,3})\.(\d{1,3})\b')
+
+
+# 判斷錯誤是否代表這個帳號本身無法使用，應改用其他帳號：回傳 'auth'、'quota' 或 None
+# 只有寄件端的限制才算：登入失敗、MAIL FROM 被拒且回應為額度限制，或擴充狀態碼為 X.4.5 (寄送額度) 及
+# X.7.x (安全政策) 且回應為額度限制；X.1.x (收件位址) 與 X.2.x (信箱狀態，例如 5.2.2 信箱已滿) 只影響該收件人
+def relay_error_kind(error):
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return 'auth'
+    if not isinstance(error, smtplib.SMTPResponseException):
+        return None
+    if error.smtp_code == 530:  # 5.7.0 Authentication required
+        return 'auth'
+    message = error.smtp_error.decode(errors='replace') if isinstance(error.smtp_error, bytes) else str(error.smtp_error)
+    enhanced = _ENHANCED_CODE.search(message)
+    if enhanced:
+        subject, detail = int(enhanced.group(1)), int(enhanced.group(2))
+        if subject in (1, 2):
+            return None
+        if (subject, detail) == (4, 5) or (subject == 7 and _QUOTA_PATTERN.search(message)):
+            return 'quota'
+    if isinstance(error, smtplib.SMTPSenderRefused) and _QUOTA_PATTERN.search(message):
+        return 'quota'
+    return None
+
+
+# 單一 SMTP 帳號 (寄送設定檔)
+class Relay:
+    def __init__(self, name, settings):
+        self.name = name
+        self.settings = settings
+        self.sender = settings['sender_email']
+        self.weight = max(0.001, settings.get('weight', 1))
+        self.daily_quota = max(0, settings.get('daily_quota', 0))
+        self.domains = [d.lower() for d in settings.get('domains', [])]
+        self.pool = None
+        self.async_pool = None
+        self.in_flight = 0
+        self.sent = 0  # 本次執行寄出的收件人數
+        self.used_today = 0  # 今日已使用的額度 (含先前執行)
+        self.disabled = None  # 停用原因
+
+    def routes(self, domain):
+        return any(domain == d or (d.startswith('*.') and domain.endswith(d[1:])) for d in self.domains)
+
+    def remaining(self):
+        if not self.daily_quota:
+            return None
+        return self.daily_quota - self.used_today - self.in_flight
+
+
+# 多個 SMTP 帳號的負載平衡與故障轉移
+# - 依權重分配寄送量：選擇 (本次已分配量 / weight) 最小且仍有額度的帳號
+# - 每個帳號各自的連線池，concurrency 即該帳號的連線數上限
+# - 每日額度記錄在 quota_path (JSON)，跨多次執行累計，日期變更後重新計算
+# - 帳號回應驗證失敗或額度用完時，本次執行停用該帳號，郵件自動改由其他帳號寄出
+# - 設定 domains 的帳號專門寄送這些網域；其他網域使用未設定 domains 的帳號，
+#   專用帳號都無法使用時也改用其他帳號
+class RelaySet:
+    def __init__(self, profiles, quota_path=None, limiter_factory=None, metrics=None):
+        self.relays = [Relay(name, settings) for name, settings in profiles.items()]
+        self.quota_path = Path(quota_path) if quota_path else None
+        self.limiter_factory = limiter_factory
+        self.metrics = metrics
+        self.failovers = 0
+        self._assigned = {relay.name: 0 for relay in self.relays}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # 同時只有一個執行緒寫入額度記錄
+        self._unsaved = False
+        self._today = date.today().isoformat()
+        self._load_quota()
+
+    def __len__(self):
+        return len(self.relays)
+
+    def _load_quota(self):
+        if not self.quota_path or not self.quota_path.exists():
+            return
+        try:
+            with open(self.quota_path, 'r', encoding='utf-8') as f:
+                usage = json.load(f).get(self._today, {})
+        except (OSError, ValueError):
+            return  # 記錄損毀時視為尚未使用，寄送時伺服器仍會回報額度錯誤
+        for relay in self.relays:
+            relay.used_today = usage.get(relay.name, 0)
+
+    # 以暫存檔加上 rename 寫入，避免中斷時留下不完整的記錄；只保留今日的記錄
+    # 其他執行緒正在寫入時不等待，只標記有未寫入的使用量，由正在寫入的執行緒寫完後再寫一次最新的數量
+    def save_quota(self):
+        if not self.quota_path:
+            return
+        with self._lock:
+            self._unsaved = True
+        while self._save_lock.acquire(blocking=False):
+            try:
+                with self._lock:
+                    if not self._unsaved:
+                        return
+                    self._unsaved = False
+                    usage = {relay.name: relay.used_today for relay in self.relays}
+                self._write_quota(usage)
+            finally:
+                self._save_lock.release()
+            # 釋放鎖之前其他執行緒可能已標記並放棄寫入，需再檢查一次
+            with self._lock:
+                if not self._unsaved:
+                    return
+
+    def _write_quota(self, usage):
+        tmp_path = self.quota_path.with_name(self.quota_path.name + '.tmp')
+        try:
+            # 先組成字串再一次寫入，比 json.dump 逐段寫入快約一倍 (每次寄出都會寫入)
+            tmp_path.write_text(json.dumps({self._today: usage}, ensure_ascii=False, indent=2), encoding='utf-8')
+            os.replace(tmp_path, self.quota_path)
+        except OSError as e:
+            # 寫入失敗不影響寄送結果的統計，下一次寄出時會再寫入
+            print(f"警告: 無法寫入 SMTP 額度記錄 '{self.quota_path}': {e}")
+
+    # 連線池在第一次使用時建立；多個工作執行緒同時寄送，需在鎖內再次檢查，確保每個帳號只有一個連線池
+    def _pool(self, relay):
+        if relay.pool is None:
+            with self._lock:
+                if relay.pool is None:
+                    relay.pool = SMTPConnectionPool(relay.settings, self.limiter_factory, self.metrics)
+        return relay.pool
+
+    def _async_pool(self, relay):
+        if relay.async_pool is None:
+            with self._lock:
+                if relay.async_pool is None:
+                    relay.async_pool = AsyncSMTPPool(relay.settings, self.limiter_factory, self.metrics)
+        return relay.async_pool
+
+    # 選擇寄送 count 位收件人的帳號並預留額度，沒有可用帳號時拋出 NoRelayAvailable
+    def choose(self, domain, count=1, exclude=()):
+        with self._lock:
+            usable = [r for r in self.relays if r.disabled is None and r.name not in exclude
+                      and (r.remaining() is None or r.remaining() >= count)]
+            routed = [r for r in usable if r.routes(domain)]
+            candidates = routed or [r for r in usable if not r.domains] or usable
+            if not candidates:
+                reasons = '; '.join(f"{r.name}: {r.disabled or '額度已用完'}" for r in self.relays)
+                raise NoRelayAvailable(f"沒有可用的 SMTP 帳號 ({reasons})")
+            # 同時寄送數未滿的帳號優先，再依權重分配
+            relay = min(candidates, key=lambda r: (r.in_flight >= r.settings.get('pool_size', 1),
+                                                   self._assigned[r.name] / r.weight))
+            self._assigned[relay.name] += count
+            relay.in_flight += count
+            return relay
+
+    # 寄送結束後呼叫，delivered 為實際寄出的收件人數 (計入每日額度)
+    # 設定每日額度的帳號每次寄出都立即寫入額度記錄 (檔案很小)：程式被中斷或強制結束時已寄出的數量不會遺失，
+    # 下次執行不會超過每日額度；未設定額度的帳號只在 close() 時寫入。回傳是否需要寫入額度記錄
+    def release(self, relay, count, delivered, save=True):
+        with self._lock:
+            relay.in_flight -= count
+            relay.sent += delivered
+            relay.used_today += delivered
+        if not delivered:
+            return False
+        if self.metrics is not None:
+            self.metrics.inc('relay_recipients_total', delivered, relay=relay.name)
+        if relay.daily_quota and self.quota_path:
+            if save:
+                self.save_quota()
+            return True
+        return False
+
+    def disable(self, relay, kind, error):
+        with self._lock:
+            if relay.disabled is None:
+                relay.disabled = f"{'驗證失敗' if kind == 'auth' else '已達寄送額度'}: {error}"
+                print(f"SMTP 帳號 {relay.name} 無法使用 ({relay.disabled})，改由其他帳號寄送")
+                if self.metrics is not None:
+                    self.metrics.event('relay_disabled', relay=relay.name, kind=kind, error=str(error))
+            self.failovers += 1
+
+    # 寄送一封郵件，帳號驗證失敗或額度用完時自動改用下一個帳號
+    # build(sender) 回傳以該帳號寄件人產生的郵件內容；回傳被拒收的收件人
+    def send(self, domain, to_addrs, build, transaction):
+        tried = []
+        while True:
+            relay = self.choose(domain, len(to_addrs), tried)
+            delivered = 0
+            try:
+                message = build(relay.sender)
+                refused = self._pool(relay).execute(
+                    lambda server: transaction(server, relay.sender, to_addrs, message))
+                delivered = len(to_addrs) - len(refused)
+                return refused
+            except Exception as e:
+                kind = relay_error_kind(e)
+                if kind is None:
+                    raise
+                self.disable(relay, kind, e)
+                tried.append(relay.name)
+            finally:
+                self.release(relay, len(to_addrs), delivered)
+
+    # asyncio 後端使用的版本
+    async def send_async(self, domain, to_addrs, build):
+        tried = []
+        while True:
+            relay = self.choose(domain, len(to_addrs), tried)
+            delivered = 0
+            try:
+                message = build(relay.sender)
+                refused = await self._async_pool(relay).sendmail(relay.sender, to_addrs, message)
+                delivered = len(to_addrs) - len(refused)
+                return refused
+            except Exception as e:
+                kind = relay_error_kind(e)
+                if kind is None:
+                    raise
+                self.disable(relay, kind, e)
+                tried.append(relay.name)
+            finally:
+                # 寫檔在執行緒中進行，不阻塞事件迴圈
+                if self.release(relay, len(to_addrs), delivered, save=False):
+                    await asyncio.to_thread(self.save_quota)
+
+    def close(self):
+        for relay in self.relays:
+            if relay.pool is not None:
+                relay.pool.close()
+        self.save_quota()
+
+    async def close_async(self):
+        for relay in self.relays:
+            if relay.async_pool is not None:
+                await relay.async_pool.close()
+                relay.async_pool = None
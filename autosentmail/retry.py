@@ -0,0 +1,116 @@
+import asyncio
+import heapq
+import itertools
+import random
+import smtplib
+import time
+
+
+# 判斷寄送錯誤是否值得稍後重試
+# - 4xx 回應 (例如 421 伺服器忙碌、450/451 灰名單、452 暫時空間不足) 為暫時性錯誤
+# - 5xx 回應 (例如 550 信箱不存在、552 郵件過大) 為永久性錯誤，重試也不會成功
+# - 連線中斷、逾時等網路錯誤視為暫時性錯誤
+# 回傳 'transient' 或 'permanent'
+def classify_error(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [reply[0] for reply in error.recipients.values()]
+        return 'transient' if codes and all(400 <= code < 500 for code in codes) else 'permanent'
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 'transient' if 400 <= error.smtp_code < 500 else 'permanent'
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return 'transient'
+    if isinstance(error, smtplib.SMTPException):
+        return 'permanent'  # 例如伺服器不支援所需的功能
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return 'transient'
+    if isinstance(error, OSError) and not isinstance(error, FileNotFoundError):
+        return 'transient'  # socket.gaierror 等網路錯誤
+    return 'permanent'
+
+
+# 暫時性錯誤的重試排程器，以最小堆積依下次可寄送的時間排序
+# 派送引擎在寄送其他收件人的同時輪詢 pop_ready()，不會為等待重試而停下
+# - max_attempts: 每個項目最多嘗試次數 (含第一次)
+# - base_delay / max_delay: 指數退避的起始與上限秒數，第 n 次重試等待 base_delay * 2^(n-1)
+#   的一半到全部之間的隨機時間 (jitter)，避免大量重試同時湧向伺服器
+# - budget: 整批寄送最多重試的總次數 (0 表示不限)，伺服器持續拒絕時不會無止盡重試
+# - deadline: 自建立起算的秒數 (0 表示不限)，超過後不再排入新的重試
+class RetryScheduler:
+    def __init__(self, max_attempts=3, base_delay=30, max_delay=600, budget=0, deadline=0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = max(0, base_delay)
+        self.max_delay = max(self.base_delay, max_delay)
+        self.budget = budget
+        self.deadline = time.monotonic() + deadline if deadline > 0 else None
+        self.retries_used = 0
+        self.gave_up = 0  # 暫時性錯誤但因次數、預算或期限而放棄的項目數
+        self._heap = []
+        self._counter = itertools.count()  # 相同時間時維持先進先出，也避免比較 job
+
+    def __len__(self):
+        return len(self._heap)
+
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    # 寄送失敗時呼叫：可重試則排入佇列並回傳等待秒數，否則回傳 None 與不重試的原因
+    def schedule(self, job, error):
+        delay, reason = self.next_attempt(job, error)
+        if delay is not None:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), job))
+        return delay, reason
+
+    # 判斷失敗的項目可否重試，但不排入佇列 (例如由 spool 以檔案記錄重試時間)：
+    # 可重試時將 job['attempt'] 加一並回傳等待秒數，否則回傳 None 與不重試的原因
+    def next_attempt(self, job, error):
+        if classify_error(error) != 'transient':
+            return None, '永久性錯誤'
+        attempt = job.get('attempt', 1)
+        if attempt >= self.max_attempts:
+            self.gave_up += 1
+            return None, f'已嘗試 {attempt} 次'
+        if self.budget and self.retries_used >= self.budget:
+            self.gave_up += 1
+            return None, '已用完重試預算'
+        delay = self.backoff(attempt)
+        ready = time.monotonic() + delay
+        if self.deadline is not None and ready > self.deadline:
+            self.gave_up += 1
+            return None, '超過重試期限'
+        self.retries_used += 1
+        job['attempt'] = attempt + 1
+        return delay, None
+
+    # 取出一個已到重試時間的項目，沒有則回傳 None
+    def pop_ready(self, now=None):
+        if self._heap and self._heap[0][0] <= (time.monotonic() if now is None else now):
+            return heapq.heappop(self._heap)[2]
+        return None
+
+    # 距離下一個項目可重試還需等待的秒數，佇列為空時回傳 None
+    def next_delay(self, now=None):
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - (time.monotonic() if now is None else now))
+
+    # 將已取出但未送出的項目放回佇列，立即可再取出
+    def requeue(self, job):
+        heapq.heappush(self._heap, (time.monotonic(), next(self._counter), job))
+
+    # 取出所有尚未重試的項目 (例如寄送被中斷時)
+    def drain(self):
+        jobs = [entry[2] for entry in sorted(self._heap)]
+        self._heap = []
+        return jobs
+
+
+# 依 [RETRY] 設定建立重試排程器，未啟用時回傳 None
+def create_retry_scheduler(retry_settings):
+    if not retry_settings.get('enabled', True) or retry_settings.get('max_attempts', 1) <= 1:
+        return None
+    return RetryScheduler(max_attempts=retry_settings['max_attempts'],
+                          base_delay=retry_settings.get('base_delay_seconds', 30),
+                          max_delay=retry_settings.get('max_delay_seconds', 600),
+                          budget=retry_settings.get('budget', 0),
+                          deadline=retry_settings.get('deadline_minutes', 0) * 60)
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+# 檔案的快速特徵（大小 + 修改時間），用來判斷是否需要重新計算雜湊
+def file_signature(path):
+    st = os.stat(path)
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# 寄送日誌：每筆寄送狀態以一行 JSON 追加寫入並 fsync，程式中斷後可從上次進度繼續
+# 以 (Excel 行號, 收件 Email) 為鍵，並記錄證書雜湊；證書內容改變視為新的寄送項目
+# 狀態：
+# - pending: 即將寄出（寫在實際寄送之前，若之後沒有結果代表寄送狀態不明）
+# - sent: 已成功寄出
+# - failed: 寄送失敗
+class SendJournal:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # (row, email) -> 最後一筆記錄
+        self._hash_cache = {}  # (path, signature) -> sha256
+        self._lock = threading.Lock()
+        self._load()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 中斷時可能留下寫到一半的最後一行，直接忽略
+                    continue
+                self.entries[(record['row'], record['email'])] = record
+                if record.get('cert'):
+                    self._hash_cache[(record.get('cert_path'), record.get('cert_sig'))] = record['cert']
+
+    def _certificate_hash(self, cert_path):
+        if not cert_path:
+            return None, None
+        cert_path = str(cert_path)
+        sig = file_signature(cert_path)
+        key = (cert_path, sig)
+        cert_hash = self._hash_cache.get(key)
+        if cert_hash is None:
+            cert_hash = file_sha256(cert_path)
+            self._hash_cache[key] = cert_hash
+        return sig, cert_hash
+
+    # 查詢某一行目前的寄送狀態；無記錄或證書已變更時回傳 None
+    def status(self, row, email, cert_path=None):
+        record = self.entries.get((row, email))
+        if record is None:
+            return None
+        if cert_path and record.get('cert'):
+            _, cert_hash = self._certificate_hash(cert_path)
+            if cert_hash != record['cert']:
+                return None
+        return record['status']
+
+    def record(self, row, email, status, cert_path=None, reason=None):
+        sig, cert_hash = self._certificate_hash(cert_path)
+        record = {
+            'row': row,
+            'email': email,
+            'status': status,
+            'cert': cert_hash,
+            'cert_path': str(cert_path) if cert_path else None,
+            'cert_sig': sig,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        if reason:
+            record['reason'] = reason
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.entries[(row, email)] = record
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,404 @@
+import asyncio
+import os
+import smtplib
+import time
+
+from .async_backend import async_dispatch
+from .attachment_cache import AttachmentCache
+from .batch_sender import group_identical, send_pipelined
+from .campaign import CampaignScheduler, JobSource
+from .dispatcher import dispatch
+from .domain_scheduler import create_domain_scheduler, domain_limits_configured, recipient_domain
+from .metrics import Metrics
+from .mime_stream import build_streaming_message
+from .prepare import build_send_jobs, prepare_campaigns
+from .rate_limit import create_limiter
+from .relays import RelaySet
+from .retry import create_retry_scheduler
+
+
+def describe_refusal(code, resp):
+    return f"收件人被拒收 ({code} {resp.decode(errors='replace') if isinstance(resp, bytes) else resp})"
+
+
+# 寄送錯誤的 SMTP 回應代碼，連線或網路錯誤為 -1
+def error_code(job, error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        reply = error.recipients.get(job.get('email')) or next(iter(error.recipients.values()), (-1, b''))
+        return reply[0]
+    return getattr(error, 'smtp_code', -1)
+
+
+# 一次寄送的執行狀態：所有課程共用的 SMTP 帳號連線池、附件快取與寄送指標
+# - settings: config.load_config() 的結果
+# - options: 命令列選項 (cli.py)
+# - campaigns: 已由 prepare.prepare_campaigns 開啟的寄送工作
+class SendRun:
+    def __init__(self, settings, options, campaigns):
+        self.settings = settings
+        self.options = options
+        self.campaigns = campaigns
+        self.send_config = settings['send']
+        self.batch_config = settings['batch']
+        self.domain_config = settings['domain']
+        self.metrics_config = settings['metrics']
+        self.campaign_scheduler = None # 在 run_dispatch 中建立
+        self.domain_stats = {} # 各收件網域的寄送結果 {網域: {'sent': n, 'failed': n, 'retried': n}}
+
+        # 寄送流程各階段耗時、結果計數與事件記錄
+        try:
+            self.metrics = Metrics(self.metrics_config['events_file'])
+        except Exception as e:
+            print(f"開啟事件記錄檔 '{self.metrics_config['events_file']}' 失敗: {str(e)}")
+            exit(1)
+
+        # 每個 SMTP 帳號各自的連線池，所有郵件共用，避免每封信都重新握手與登入
+        # 多個帳號時依權重分配，並在驗證失敗或額度用完時自動改用其他帳號
+        relay_config = settings['relays']
+        self.relay_set = RelaySet(relay_config['profiles'],
+                                  relay_config['quota_file'] if any(p['daily_quota'] for p in relay_config['profiles'].values()) else None,
+                                  lambda: create_limiter(self.send_config, 'connection_'),
+                                  self.metrics)
+
+        # 附件讀取並編碼後快取，同一檔案重寄或寄給多人時不需重新讀檔與編碼
+        attachment_config = settings['attachment']
+        self.attachment_cache = AttachmentCache(int(attachment_config['cache_mb'] * 1024 * 1024),
+                                                attachment_config['mmap_threshold_kb'] * 1024)
+
+    # 以範本變數產生郵件 (含證書附件)，同步與 asyncio 後端共用；sender 為實際寄出的 SMTP 帳號的寄件人
+    # 回傳 mime_stream.StreamingMessage：附件不複製進郵件內容，寄送時才由快取 (或檔案) 逐段寫入 DATA
+    def build_email_with_attachment(self, template, variables, to_header, attachment_path=None, sender=None):
+        attachment = None
+        if attachment_path and os.path.exists(attachment_path):
+            with self.metrics.timer('attachment_read'):
+                attachment = self.attachment_cache.get(attachment_path, 'pdf')
+        with self.metrics.timer('mime_build'):
+            message = build_streaming_message(template, variables, to_header, attachment, sender)
+        self.metrics.inc('message_bytes_total', message.size)
+        return message
+
+    # 批次模式下判斷兩封郵件內容是否相同：同一課程且主旨、內容與附件檔案都相同
+    # 有設定網域限制時，同一批次只包含同一網域的收件人
+    def batch_payload_key(self, job):
+        key = job['campaign'].name, job['campaign'].template.content_key(job['variables']), str(job['certificate_path'])
+        return key + (recipient_domain(job),) if domain_limits_configured(self.domain_config) else key
+
+    # 寄送前準備：輸出進度、寫入寄送日誌，回傳 (收件人列表, 郵件產生函式)
+    # 郵件在選定 SMTP 帳號後才以該帳號的寄件人產生
+    # 批次項目 ({'batch': [...]}) 以一次交易寄給多位收件人，收件人只出現在 RCPT TO 中 (密件副本方式)，
+    # 郵件標頭的 To 為 [BATCH] to_header
+    def prepare_job(self, job):
+        job['started'] = time.perf_counter()
+        if 'batch' in job:
+            items = job['batch']
+            campaign = items[0]['campaign']
+            print(f"\n{campaign.tag}準備以批次寄送給 {len(items)} 位收件人 (Excel 第 {', '.join(str(item['row_num']) for item in items)} 行) ...")
+            to_header = self.batch_config['to_header']
+        else:
+            items = [job]
+            campaign = job['campaign']
+            if job['test_mode']:
+                print(f"\n{campaign.tag}[測試模式] 準備發送郵件給 (Excel 第 {job['row_num']} 行): {job['name']} (實際寄送至 {job['email']}) ...")
+            else:
+                print(f"\n{campaign.tag}準備發送郵件給 (Excel 第 {job['row_num']} 行): {job['name']} <{job['email']}> ...")
+            to_header = job['email']
+        if campaign.journal:
+            for item in items:
+                campaign.journal.record(item['row_num'], item['email'], 'pending', item['certificate_path'])
+        build = lambda sender: self.build_email_with_attachment(campaign.template, items[0]['variables'], to_header,
+                                                                items[0]['certificate_path'], sender)
+        return [item['email'] for item in items], build
+
+    # 寄送成功後記錄結果；refused 為被拒收的收件人，由 on_send_result 列為失敗
+    def finish_job(self, job, refused):
+        job['refused'] = refused
+        items = job['batch'] if 'batch' in job else [job]
+        campaign = items[0]['campaign']
+        if campaign.journal:
+            for item in items:
+                if item['email'] not in refused:
+                    campaign.journal.record(item['row_num'], item['email'], 'sent', item['certificate_path'])
+        if 'batch' in job:
+            print(f"{campaign.tag}批次郵件成功寄送至 {len(items) - len(refused)} 位收件人")
+        else:
+            print(f"{campaign.tag}郵件成功寄送至: {job['email']}")
+
+    # 在工作執行緒中寄出單一項目 (或批次模式下的一組項目)，寄送失敗時拋出例外，由 on_send_result 統計
+    # 伺服器支援 PIPELINING 時，MAIL FROM 與 RCPT TO 會一次送出
+    def send_job(self, job):
+        to_addresses, build = self.prepare_job(job)
+        refused = self.relay_set.send(recipient_domain(job), to_addresses, build, send_pipelined)
+        self.finish_job(job, refused)
+
+    # asyncio 後端使用的版本，在事件迴圈中執行
+    async def send_job_async(self, job):
+        to_addresses, build = self.prepare_job(job)
+        refused = await self.relay_set.send_async(recipient_domain(job), to_addresses, build)
+        self.finish_job(job, refused)
+
+    # 依 [SEND] backend 選擇同步 (多執行緒) 或 asyncio 後端派送所有課程的項目
+    # 每個課程各自的項目來源 (有設定網域限制時為網域排程器，各課程共用網域的限制) 由課程排程器公平輪流取出
+    def run_dispatch(self, test_recipient_email=None):
+        send_config = self.send_config
+        sources = []
+        shared_domains = None
+        for campaign in self.campaigns:
+            send_jobs = build_send_jobs(campaign, self.options.retry_failed, test_recipient_email)
+            if self.batch_config['enabled']:
+                send_jobs = group_identical(send_jobs, self.batch_payload_key, self.batch_config['max_recipients'],
+                                            self.batch_config['max_pending_groups'])
+            source = create_domain_scheduler(send_jobs, self.domain_config, campaign.retries, shared_domains)
+            if source is None:
+                source = JobSource(send_jobs, campaign.retries)
+            elif shared_domains is None:
+                shared_domains = source
+            sources.append((campaign, source))
+        self.campaign_scheduler = CampaignScheduler(sources)
+        if send_config['backend'] != 'asyncio':
+            return dispatch((), self.send_job, self.on_dispatch_result, workers=send_config['workers'],
+                            limiter=create_limiter(send_config), scheduler=self.campaign_scheduler)
+
+        async def run_async():
+            try:
+                return await async_dispatch((), self.send_job_async, self.on_dispatch_result,
+                                            concurrency=send_config['async_concurrency'], limiter=create_limiter(send_config),
+                                            scheduler=self.campaign_scheduler)
+            finally:
+                await self.relay_set.close_async()
+        return asyncio.run(run_async())
+
+    # 由派送引擎在主執行緒中呼叫：釋放課程與網域的同時寄送數後統計結果
+    def on_dispatch_result(self, job, error):
+        self.campaign_scheduler.done(job)
+        self.on_send_result(job, error)
+
+    def count_domain(self, job, outcome):
+        stats = self.domain_stats.setdefault(recipient_domain(job), {'sent': 0, 'failed': 0, 'retried': 0})
+        stats[outcome] += 1
+
+    # 記錄一個收件人的結果：計數器與事件記錄
+    def record_outcome(self, job, outcome, error=None, **fields):
+        campaign = job['campaign']
+        self.metrics.inc('messages_total', result=outcome, campaign=campaign.name)
+        if error is not None:
+            self.metrics.inc('smtp_errors_total', code=error_code(job, error))
+        self.metrics.event(outcome, campaign=campaign.name, row=job['row_num'], email=job['email'], domain=recipient_domain(job),
+                           attempt=job.get('attempt', 1), code=error_code(job, error) if error is not None else None,
+                           error=str(error) if error is not None else None,
+                           seconds=round(job['seconds'], 4) if job.get('seconds') is not None else None, **fields)
+
+    # 統一統計每一行的結果
+    def on_send_result(self, job, error):
+        if 'started' in job:
+            job['seconds'] = time.perf_counter() - job.pop('started')
+            self.metrics.observe('send_seconds', job['seconds'])
+        if 'batch' in job:
+            # 批次中每位收件人各自統計，個別被拒收的收件人列為失敗
+            refused = job.get('refused', {})
+            if isinstance(error, smtplib.SMTPRecipientsRefused):
+                refused, error = error.recipients, None
+            # 需要重試的收件人之後改為個別寄送
+            for item in job['batch']:
+                item['seconds'] = job.get('seconds')
+                item_error = error
+                if item_error is None and item['email'] in refused:
+                    item_error = smtplib.SMTPRecipientsRefused({item['email']: refused[item['email']]})
+                self.on_send_result(item, item_error)
+            return
+        campaign = job['campaign']
+        if error is None:
+            campaign.sent += 1
+            self.count_domain(job, 'sent')
+            self.record_outcome(job, 'sent')
+            return
+        reason = error
+        if isinstance(error, smtplib.SMTPRecipientsRefused) and job['email'] in error.recipients:
+            reason = describe_refusal(*error.recipients[job['email']])
+        if campaign.retries is not None:
+            delay, give_up_reason = campaign.retries.schedule(job, error)
+            if delay is not None:
+                print(f"{campaign.tag}郵件暫時無法寄送: {job['email']}, 原因: {reason}，將於 {delay:.1f} 秒後重試 (第 {job['attempt']} 次嘗試)")
+                self.count_domain(job, 'retried')
+                self.record_outcome(job, 'retried', error, retry_in=round(delay, 3))
+                if campaign.journal:
+                    # 若在等待重試期間中斷，重新執行時會再寄送這一行
+                    campaign.journal.record(job['row_num'], job['email'], 'failed', job['certificate_path'], reason=str(reason))
+                return
+            if give_up_reason != '永久性錯誤':
+                reason = f"{reason} (不再重試: {give_up_reason})"
+        print(f"{campaign.tag}郵件寄送失敗: {job['email']}, 原因: {reason}")
+        if campaign.journal:
+            campaign.journal.record(job['row_num'], job['email'], 'failed', job['certificate_path'], reason=str(reason))
+        campaign.failed += 1
+        self.count_domain(job, 'failed')
+        self.record_outcome(job, 'failed', error)
+        campaign.failed_info.append(f"{campaign.tag}Excel 行 {job['row_num']}: {job['name']} <{job['original_email']}> - 原因: 發送失敗")
+
+    # 執行寄送並輸出發送統計
+    def run(self):
+        campaigns = self.campaigns
+        send_config = self.send_config
+        domain_config = self.domain_config
+        metrics_config = self.metrics_config
+        retry_config = self.settings['retry']
+        test_config = self.settings['test']
+        metrics = self.metrics
+        relay_set = self.relay_set
+
+        print("\n--- 開始郵件發送處理 ---")
+        if domain_limits_configured(domain_config):
+            print(f"依收件網域限速: 已設定 {len(domain_config['groups'])} 組網域限制，其他網域每分鐘 {domain_config['default']['rate_per_minute'] or '不限'} 封 / 同時 {domain_config['default']['max_concurrency'] or '不限'} 封")
+        for campaign in campaigns:
+            campaign.retries = create_retry_scheduler(retry_config) # 暫時性錯誤的重試佇列，等待期間繼續寄送其他收件人
+        if campaigns[0].retries is not None:
+            print(f"暫時性錯誤 (4xx) 將自動重試，每封最多嘗試 {retry_config['max_attempts']} 次")
+        if send_config['backend'] == 'asyncio':
+            print(f"寄送後端: asyncio (同時進行中上限 {send_config['async_concurrency']} 封，連線數上限 {self.settings['smtp']['pool_size']})")
+        if len(relay_set) > 1:
+            print(f"使用 {len(relay_set)} 個 SMTP 帳號: " + "、".join(
+                f"{r.name} (權重 {r.settings['weight']:g}，今日額度 {r.daily_quota - r.used_today if r.daily_quota else '不限'})" for r in relay_set.relays))
+        print(f"同時寄送數: {send_config['workers']}，全域速率上限: 每分鐘 {send_config['rate_per_minute'] or '不限'} 封 / 每小時 {send_config['rate_per_hour'] or '不限'} 封")
+        if len(campaigns) > 1:
+            for campaign in campaigns:
+                job = campaign.job
+                print(f"{campaign.tag}分配權重 {job['weight']:g}，每分鐘 {job['rate_per_minute'] or '不限'} 封，同時 {job['max_concurrency'] or '不限'} 封")
+        try:
+            metrics.start_exporter(metrics_config['prometheus_file'], metrics_config['export_interval_seconds'],
+                                   metrics_config['http_host'], metrics_config['http_port'])
+        except Exception as e:
+            print(f"啟動指標輸出失敗: {str(e)}")
+            exit(1)
+        if metrics_config['http_port']:
+            print(f"寄送指標: http://{metrics_config['http_host']}:{metrics_config['http_port']}/metrics")
+        metrics.event('start', campaigns={c.name: str(c.contacts_path) for c in campaigns},
+                      rows=sum(len(c.send_rows) for c in campaigns), backend=send_config['backend'],
+                      test_mode=bool(test_config.get('enable_test_mode', False)))
+        contact_row_count = sum(c.rows for c in campaigns) # 已讀取的聯絡資料筆數
+
+        # --- 測試模式優先邏輯 ---
+        test_mode = test_config.get('enable_test_mode', False)
+        test_recipient_email = None
+        if test_mode:
+            print("*** 測試模式已啟用 (來自 config.ini) ***")
+            test_recipient_email = test_config.get('recipient_email_config', '').strip()
+
+            # 驗證測試模式的收件人信箱是否有效
+            if not test_recipient_email:
+                print("="*70)
+                print("********** CLI 錯誤: 測試模式設定不完整 **********")
+                print("  測試模式已啟用，但 config.ini 中的 [TEST] recipient_email 未提供或為空。")
+                print(f"  > 設定的測試 Email: '{test_recipient_email}'")
+                print("  請在 config.ini 中提供完整的測試收件人 Email 地址。")
+                print("="*70 + "\n")
+                print("--- 郵件發送處理結束 (因測試模式配置無效) ---")
+                exit(1)
+
+            print(f"將遍歷所有聯絡資料，並將所有郵件內容寄送到測試信箱: {test_recipient_email}")
+        else:
+            # --- 正常批量發送模式 ---
+            print("*** 正常批量發送模式已啟用 (測試模式未啟用或配置無效) ***")
+
+        # 不論正常結束、中斷或發生未預期的錯誤，都關閉寄送日誌與連線池並輸出已完成部分的統計
+        dispatch_completed = False
+        try:
+            dispatch_completed = self.run_dispatch(test_recipient_email)
+            if contact_row_count == 0:
+                print("聯絡資料表格為空，沒有可發送的郵件。")
+            if test_mode:
+                print("--- 測試模式郵件發送完成 --- ")
+        finally:
+            self.finish(contact_row_count, dispatch_completed)
+
+    # 寄送結束 (或中斷) 後關閉寄送日誌、連線池與指標輸出，並輸出發送統計
+    def finish(self, contact_row_count, dispatch_completed):
+        # 因中斷而未執行的重試列為失敗 (寄送日誌中已記錄為失敗，重新執行時會再寄送)
+        # 已讀入網域佇列但尚未寄出的記錄沒有寫入日誌，重新執行時同樣會寄送
+        if self.campaign_scheduler is not None:
+            for unsent in self.campaign_scheduler.drain():
+                for job in unsent['batch'] if 'batch' in unsent else [unsent]:
+                    campaign = job['campaign']
+                    if job.get('attempt', 1) > 1:
+                        campaign.failed += 1
+                        campaign.failed_info.append(f"{campaign.tag}Excel 行 {job['row_num']}: {job['name']} <{job['original_email']}> - 原因: 中斷時仍在等待重試")
+                    else:
+                        campaign.not_sent += 1
+
+        self.relay_set.close()
+        for campaign in self.campaigns:
+            if campaign.journal:
+                campaign.journal.close()
+        try:
+            self.metrics.close()
+        except Exception as e:
+            print(f"警告: 寫入寄送指標失敗: {str(e)}")
+        if not dispatch_completed:
+            print("\n*** 寄送因中斷而提前結束，尚未寄出的記錄可直接重新執行以繼續 ***")
+
+        self.print_summary(contact_row_count)
+
+    # --- 輸出發送統計 ---
+    def print_summary(self, contact_row_count):
+        campaigns = self.campaigns
+        relay_set = self.relay_set
+        attachment_cache = self.attachment_cache
+        domain_stats = self.domain_stats
+        use_journal = any(c.journal for c in campaigns)
+        not_sent_count = sum(c.not_sent for c in campaigns)
+        retries_used = sum(c.retries.retries_used for c in campaigns if c.retries is not None)
+        print("\n" + "="*30 + " 發送統計 " + "="*30)
+        print(f"讀取聯絡資料: {contact_row_count} 筆")
+        print(f"成功發送: {sum(c.sent for c in campaigns)}")
+        print(f"失敗發送: {sum(c.failed for c in campaigns)}")
+        print(f"略過記錄 (未通過寄送前檢查或寄送狀態不明): {sum(c.skipped for c in campaigns)}")
+        if use_journal:
+            print(f"略過已寄送記錄 (依寄送日誌): {sum(c.already_sent for c in campaigns)}")
+        if not_sent_count:
+            print(f"尚未寄出 (因中斷): {not_sent_count}")
+        if retries_used:
+            gave_up = sum(c.retries.gave_up for c in campaigns if c.retries is not None)
+            print(f"暫時性錯誤重試: {retries_used} 次 (達到上限後放棄: {gave_up} 筆)")
+        if len(relay_set) > 1 or relay_set.failovers:
+            for relay in relay_set.relays:
+                quota_info = f"，今日已用 {relay.used_today}/{relay.daily_quota}" if relay.daily_quota else ""
+                print(f"SMTP 帳號 {relay.name}: 寄出 {relay.sent} 位收件人{quota_info}{'，' + relay.disabled if relay.disabled else ''}")
+        if attachment_cache.hits:
+            print(f"附件快取: 命中 {attachment_cache.hits} 次，讀檔編碼 {attachment_cache.misses} 次")
+
+        if len(campaigns) > 1:
+            print("\n--- 各寄送工作統計 ---")
+            for campaign in campaigns:
+                print(f"  {campaign.name} ({campaign.course_name}): 讀取 {campaign.rows} 筆，成功 {campaign.sent}，失敗 {campaign.failed}，"
+                      f"略過 {campaign.skipped}" + (f"，依日誌略過 {campaign.already_sent}" if campaign.journal else "") +
+                      (f"，尚未寄出 {campaign.not_sent}" if campaign.not_sent else ""))
+
+        phase_summary = self.metrics.phase_summary()
+        if phase_summary:
+            # 比較各階段的總耗時，可看出瓶頸在連線握手、附件讀取還是伺服器回應 (p50 / p99 為依區間估計的值)
+            print("\n--- 各階段耗時 ---")
+            for phase, stats in phase_summary.items():
+                print(f"  {phase}: {stats['count']} 次，共 {stats['sum']:.2f} 秒，平均 {stats['avg'] * 1000:.1f} ms，"
+                      f"p50 {stats['p50'] * 1000:.1f} ms，p99 {stats['p99'] * 1000:.1f} ms")
+
+        if domain_stats:
+            print("\n--- 各收件網域統計 ---")
+            # 只列出寄送量最多的前 20 個網域，其餘合併為一行
+            ranked = sorted(domain_stats.items(), key=lambda item: -sum(item[1].values()))
+            for domain, stats in ranked[:20]:
+                print(f"  {domain}: 成功 {stats['sent']}，失敗 {stats['failed']}，暫時失敗後重試 {stats['retried']}")
+            if len(ranked) > 20:
+                others = {key: sum(stats[key] for _, stats in ranked[20:]) for key in ('sent', 'failed', 'retried')}
+                print(f"  其他 {len(ranked) - 20} 個網域: 成功 {others['sent']}，失敗 {others['failed']}，暫時失敗後重試 {others['retried']}")
+
+        failed_recipients_info = [info for campaign in campaigns for info in campaign.failed_info]
+        if failed_recipients_info:
+            print("\n--- 失敗或部分成功記錄詳情 ---")
+            for info in failed_recipients_info:
+                print(f"  - {info}")
+        print("="*70)
+        print("--- 郵件發送處理結束 ---")
+
+
+# 寄送：開啟所有寄送工作並通過寄送前檢查後，才建立 SMTP 連線池開始寄送
+def run_send(settings, options):
+    campaigns = prepare_campaigns(settings, options)
+    SendRun(settings, options, campaigns).run()
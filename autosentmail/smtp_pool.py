@@ -0,0 +1,243 @@
+import smtplib
+import socket
+import ssl
+import threading
+import time
+from contextlib import contextmanager
+
+from .metrics import Metrics
+
+
+# 建立與原本寄信流程相同設定的 SSL context（相容較舊的郵件伺服器）
+def create_ssl_context():
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.set_ciphers('DEFAULT@SECLEVEL=1')
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+# 分別量測 TCP 連線與 TLS 握手時間的 SMTP_SSL (smtplib 在連線時一次完成兩者)
+class _TimedSMTP_SSL(smtplib.SMTP_SSL):
+    def __init__(self, host, port, context, timeout, metrics):
+        self.metrics = metrics
+        super().__init__(host, port, context=context, timeout=timeout)
+
+    def _get_socket(self, host, port, timeout):
+        with self.metrics.timer('connect'):
+            sock = smtplib.SMTP._get_socket(self, host, port, timeout)
+        with self.metrics.timer('tls'):
+            return self.context.wrap_socket(sock, server_hostname=self._host)
+
+
+# 連線池中的單一已登入 SMTP 連線
+class PooledConnection:
+    def __init__(self, server, mode):
+        self.server = server
+        self.mode = mode  # 'ssl' (SMTPS)、'starttls' 或 'plain'
+        self.message_count = 0
+        self.reused = False  # 是否曾經放回連線池後再取出
+        self.last_used = time.monotonic()
+        self.limiter = None  # 每條連線各自的速率限制器
+        # 命令與郵件內容都已整批寫出，關閉 Nagle 演算法避免最後一段等待伺服器的延遲 ACK
+        # (asyncio 後端的連線預設即已關閉)
+        try:
+            server.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (AttributeError, OSError):
+            pass
+
+    def close(self):
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+
+# 可重複使用已登入連線的 SMTP 連線池
+# - pool_size: 同時存在的最大連線數
+# - max_messages_per_connection: 每條連線最多寄送幾封後重新連線 (0 表示不限)
+# - idle_check_seconds: 連線閒置超過此秒數，取出前先以 NOOP 檢查是否仍有效
+# - limiter_factory: 選填，為每條新連線建立各自的速率限制器
+# - metrics: 選填的 metrics.Metrics，記錄連線、TLS、登入與寄送交易各階段的耗時
+class SMTPConnectionPool:
+    def __init__(self, smtp_settings, limiter_factory=None, metrics=None):
+        self.settings = smtp_settings
+        self.limiter_factory = limiter_factory
+        self.metrics = metrics or Metrics()
+        self.pool_size = max(1, smtp_settings.get('pool_size', 1))
+        self.max_messages = max(0, smtp_settings.get('max_messages_per_connection', 0))
+        self.idle_check_seconds = smtp_settings.get('idle_check_seconds', 30)
+        self.timeout = smtp_settings.get('timeout', 60)
+        self.context = create_ssl_context()
+        self._idle = []
+        self._created = 0
+        self._mode = None  # 記住成功過的連線方式，之後不再重複嘗試失敗的方式
+        self._closed = False
+        self._cond = threading.Condition()
+
+    # 建立新連線並登入：先嘗試 SMTP_SSL，失敗則改用 STARTTLS
+    # use_tls 設為 False 時直接以明文連線 (例如本機轉寄伺服器或效能測試)
+    def _open(self):
+        s = self.settings
+        metrics = self.metrics
+        if not s.get('use_tls', True):
+            with metrics.timer('connect'):
+                server = smtplib.SMTP(s['server'], s['port'], timeout=self.timeout)
+            try:
+                if s.get('username'):
+                    with metrics.timer('auth'):
+                        server.login(s['username'], s['password'])
+            except Exception:
+                PooledConnection(server, 'plain').close()
+                raise
+            metrics.inc('connections_total', mode='plain')
+            return PooledConnection(server, 'plain')
+
+        if self._mode != 'starttls':
+            try:
+                server = _TimedSMTP_SSL(s['server'], s['port'], self.context, self.timeout, metrics)
+            except Exception as e_ssl:
+                if self._mode == 'ssl':
+                    raise
+                print(f"SMTP_SSL 連接失敗: {e_ssl}. 嘗試使用 STARTTLS...")
+            else:
+                # TLS 握手成功表示伺服器使用 SMTPS，之後的錯誤 (例如帳號密碼錯誤) 直接拋出，不改用 STARTTLS
+                self._mode = 'ssl'
+                try:
+                    with metrics.timer('auth'):
+                        server.login(s['username'], s['password'])
+                except Exception:
+                    PooledConnection(server, 'ssl').close()
+                    raise
+                metrics.inc('connections_total', mode='ssl')
+                return PooledConnection(server, 'ssl')
+
+        with metrics.timer('connect'):
+            server = smtplib.SMTP(s['server'], s['port'], timeout=self.timeout)
+        try:
+            with metrics.timer('tls'):
+                server.starttls(context=self.context)
+            with metrics.timer('auth'):
+                server.login(s['username'], s['password'])
+        except Exception:
+            PooledConnection(server, 'starttls').close()
+            raise
+        self._mode = 'starttls'
+        metrics.inc('connections_total', mode='starttls')
+        return PooledConnection(server, 'starttls')
+
+    # 閒置過久的連線可能已被伺服器關閉，以 NOOP 確認
+    def _is_healthy(self, conn):
+        if time.monotonic() - conn.last_used < self.idle_check_seconds:
+            return True
+        try:
+            code, _ = conn.server.noop()
+            return code == 250
+        except Exception:
+            return False
+
+    # 交易失敗後以 RSET 清除伺服器端狀態，確認連線仍可使用
+    def _reset(self, conn):
+        try:
+            code, _ = conn.server.rset()
+            return code == 250
+        except Exception:
+            return False
+
+    def acquire(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("SMTP 連線池已關閉")
+                while not self._idle and self._created >= self.pool_size:
+                    self._cond.wait()
+                conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    self._created += 1
+
+            if conn is None:
+                try:
+                    conn = self._open()
+                except Exception:
+                    self._discard(None)
+                    raise
+                if self.limiter_factory:
+                    conn.limiter = self.limiter_factory()
+                return conn
+
+            if self._is_healthy(conn):
+                conn.reused = True
+                return conn
+            # 連線已失效：丟棄後重新取得（可能建立新連線）
+            self._discard(conn)
+
+    def release(self, conn, broken=False):
+        if broken or self._closed or (self.max_messages and conn.message_count >= self.max_messages):
+            self._discard(conn)
+            return
+        conn.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def _discard(self, conn):
+        if conn is not None:
+            conn.close()
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, broken=not self._reset(conn))
+            raise
+        else:
+            self.release(conn)
+
+    # 以連線池中的連線執行一次 SMTP 交易 transaction(server)，回傳其結果，失敗時拋出例外
+    # 重複使用的閒置連線若已被伺服器斷開，會自動重新連線並重試一次
+    def execute(self, transaction):
+        retried = False
+        while True:
+            conn = self.acquire()
+            if conn.limiter:
+                conn.limiter.acquire()
+            try:
+                with self.metrics.timer('data'):
+                    result = transaction(conn.server)
+            except smtplib.SMTPServerDisconnected:
+                self._discard(conn)
+                if conn.reused and not retried:
+                    # 伺服器已關閉這條閒置連線，改用新連線重寄
+                    retried = True
+                    continue
+                raise
+            except smtplib.SMTPException:
+                self.release(conn, broken=not self._reset(conn))
+                raise
+            except Exception:
+                self._discard(conn)
+                raise
+            conn.message_count += 1
+            self.release(conn)
+            return result
+
+    # 透過連線池寄送一封郵件，回傳被拒收的收件人，失敗時拋出例外
+    def send_message(self, msg, from_addr=None, to_addrs=None):
+        return self.execute(lambda server: server.send_message(msg, from_addr, to_addrs))
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
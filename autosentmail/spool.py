@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+from .attachment_cache import AttachmentCache
+from .mime_stream import FileSegment, StreamingMessage, build_streaming_message
+from .prepare import build_send_jobs, prepare_campaigns
+
+# spool 的子目錄，與 maildir 相同以 rename 在目錄間移動，每個檔案在任何時刻只會出現在其中一個目錄
+# - tmp: 寫入中的檔案，寫完並 fsync 後才移到 new
+# - new: 等待寄送 (含等待重試) 的郵件
+# - cur: daemon 正在寄送的郵件
+# - done: 已寄出 ([SPOOL] keep_done = False 時直接刪除)
+# - failed: 永久性錯誤、重試次數用完或寄送狀態不明的郵件
+FOLDERS = ('tmp', 'new', 'cur', 'done', 'failed')
+
+# 檔名: <郵件代號>.msg，等待重試時為 <郵件代號>,<第幾次嘗試>,<可重試的時間 (epoch 秒)>.msg
+_NAME = re.compile(r'^(?P<id>[^,]+?)(?:,(?P<attempt>\d+),(?P<after>\d+))?\.msg$')
+# 課程名稱中不能用在檔名 (及郵件代號分隔) 的字元
+_UNSAFE = re.compile(r'[^\w-]')
+
+
+# 解析 spool 檔名，回傳 (郵件代號, 第幾次嘗試, 可重試的時間)，不是 spool 檔案時回傳 None
+def parse_name(name):
+    match = _NAME.match(name)
+    if not match:
+        return None
+    return match['id'], int(match['attempt'] or 1), int(match['after'] or 0)
+
+
+# 兩階段寄送的郵件佇列目錄：產生端將每封郵件寫成一個檔案，寄送端 (daemon.py) 逐一取出寄送
+# 檔案第一行為 JSON 格式的寄送資訊 (收件人、課程、行號、寄送日誌、附件位置等)，其後為完整的郵件內容 (CRLF 換行)
+class Spool:
+    def __init__(self, path):
+        self.path = Path(path)
+        for folder in FOLDERS:
+            (self.path / folder).mkdir(parents=True, exist_ok=True)
+
+    # 郵件代號由課程、行號與收件人決定，同一封郵件重新產生時代號相同，用來避免重複放入
+    @staticmethod
+    def message_id(campaign, row, email):
+        digest = hashlib.sha1(email.strip().lower().encode('utf-8')).hexdigest()[:10]
+        return f"{_UNSAFE.sub('_', campaign)}.{row}.{digest}"
+
+    def names(self, folder):
+        return [name for name in os.listdir(self.path / folder) if name.endswith('.msg')]
+
+    # 指定目錄中所有郵件的代號
+    def ids(self, *folders):
+        return {parsed[0] for folder in folders for parsed in map(parse_name, self.names(folder)) if parsed}
+
+    def counts(self):
+        return {folder: len(self.names(folder)) for folder in FOLDERS if folder != 'tmp'}
+
+    # 刪除 tmp 中超過 max_age 秒的檔案 (產生端寫入途中被中斷留下的檔案)
+    def clean_tmp(self, max_age=3600):
+        now = time.time()
+        for name in os.listdir(self.path / 'tmp'):
+            path = self.path / 'tmp' / name
+            try:
+                if now - path.stat().st_mtime > max_age:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    # 放入一封郵件：先完整寫入 tmp 並 fsync，再以 rename 移到 new，寄送端不會讀到寫到一半的檔案
+    def put(self, message_id, info, message):
+        info = dict(info, id=message_id, attachments=message.spans())
+        tmp_path = self.path / 'tmp' / f"{message_id}.{os.getpid()}.msg"
+        with open(tmp_path, 'wb') as f:
+            f.write(json.dumps(info, ensure_ascii=False).encode('utf-8') + b'\n')
+            message.write_to(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path / 'new' / f"{message_id}.msg")
+        # 先前寄送失敗的同一封郵件改以新產生的內容重寄
+        (self.path / 'failed' / f"{message_id}.msg").unlink(missing_ok=True)
+
+    # 讀取郵件：回傳 (寄送資訊, mime_stream.StreamingMessage)，附件部分寄送時才由檔案逐段讀取
+    @staticmethod
+    def read(path):
+        with open(path, 'rb') as f:
+            info = json.loads(f.readline())
+            start = f.tell()
+            size = os.fstat(f.fileno()).st_size - start
+            segments = []
+            offset = 0
+            for span_offset, span_size in info.get('attachments', []) + [(size, 0)]:
+                f.seek(start + offset)
+                segments.append(f.read(span_offset - offset))
+                if span_size:
+                    segments.append(FileSegment(path, start + span_offset, span_size))
+                offset = span_offset + span_size
+        return info, StreamingMessage(segments)
+
+    # 只讀取寄送資訊
+    @staticmethod
+    def read_info(path):
+        with open(path, 'rb') as f:
+            return json.loads(f.readline())
+
+    # 取出一封等待寄送的郵件 (new -> cur)，已被其他寄送端取走時回傳 None
+    def claim(self, name):
+        path = self.path / 'cur' / name
+        try:
+            os.rename(self.path / 'new' / name, path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    # 將取出但未寄送的郵件放回 new
+    def release(self, name):
+        os.rename(self.path / 'cur' / name, self.path / 'new' / name)
+
+    # 寄送失敗但可重試：放回 new，並在檔名記錄第幾次嘗試與可重試的時間
+    def retry(self, name, attempt, not_before, folder='cur'):
+        message_id = parse_name(name)[0]
+        os.rename(self.path / folder / name, self.path / 'new' / f"{message_id},{attempt},{int(not_before)}.msg")
+
+    # 寄送結束：移到 done 或 failed (檔名去掉重試資訊)，keep 為 False 時直接刪除
+    def finish(self, name, folder, keep=True, source='cur'):
+        path = self.path / source / name
+        if not keep:
+            path.unlink()
+            return
+        os.rename(path, self.path / folder / f"{parse_name(name)[0]}.msg")
+
+
+# 兩階段寄送的產生端：開啟所有寄送工作並通過寄送前檢查後，將每封郵件產生後放入 spool，不連線 SMTP
+# 已在 spool 中 (等待、寄送中或已寄出) 的郵件與依寄送日誌已寄出的記錄不會重複放入，不使用寄送日誌時也不會重寄 done 中的郵件；
+# failed 中的郵件只在指定 --retry-failed 時以新產生的內容重新放入；寄送日誌由 daemon 寫入
+def run_spool(settings, options):
+    campaigns = prepare_campaigns(settings, options)
+    spool = Spool(options.spool or settings['spool']['directory'])
+    queued = spool.ids('new', 'cur', 'done', *(() if options.retry_failed else ('failed',)))
+    test_config = settings['test']
+    test_recipient_email = None
+    if test_config.get('enable_test_mode', False):
+        test_recipient_email = test_config.get('recipient_email_config', '').strip()
+        if not test_recipient_email:
+            print("錯誤: 測試模式已啟用，但 config.ini 中的 [TEST] recipient_email 未提供或為空。")
+            exit(1)
+        print(f"*** 測試模式已啟用，所有郵件將寄送到測試信箱: {test_recipient_email} ***")
+
+    attachment_config = settings['attachment']
+    attachment_cache = AttachmentCache(int(attachment_config['cache_mb'] * 1024 * 1024),
+                                       attachment_config['mmap_threshold_kb'] * 1024)
+    sender = settings['smtp']['sender_email']
+    print(f"\n--- 產生郵件並放入 spool '{spool.path}' ---")
+    start = time.perf_counter()
+    total = 0
+    for campaign in campaigns:
+        spooled = already_queued = 0
+        for job in build_send_jobs(campaign, options.retry_failed, test_recipient_email):
+            message_id = Spool.message_id(campaign.name, job['row_num'], job['email'])
+            if message_id in queued:
+                already_queued += 1
+                continue
+            certificate_path = job['certificate_path']
+            try:
+                attachment = attachment_cache.get(certificate_path, 'pdf') if certificate_path and os.path.exists(certificate_path) else None
+                message = build_streaming_message(campaign.template, job['variables'], job['email'], attachment, sender)
+                spool.put(message_id, {
+                    'campaign': campaign.name,
+                    'row': job['row_num'],
+                    'name': job['name'],
+                    'email': job['email'],
+                    'original_email': job['original_email'],
+                    # 以絕對路徑記錄，daemon 可在其他目錄執行
+                    'certificate_path': os.path.abspath(certificate_path) if certificate_path else None,
+                    'journal': os.path.abspath(campaign.journal.path) if campaign.journal else None,
+                    'sender': sender,
+                    'test_mode': job['test_mode'],
+                    'created': time.time()
+                }, message)
+            except Exception as e:
+                print(f"{campaign.tag}產生 Excel 第 {job['row_num']} 行 ({job['name']} <{job['email']}>) 的郵件失敗: {str(e)}")
+                campaign.failed += 1
+                continue
+            spooled += 1
+        total += spooled
+        print(f"{campaign.tag}放入 spool: {spooled} 封，已在 spool 中: {already_queued} 封，依寄送日誌略過已寄送: {campaign.already_sent} 筆，"
+              f"略過: {campaign.skipped} 筆" + (f"，產生失敗: {campaign.failed} 筆" if campaign.failed else ""))
+        if campaign.journal:
+            campaign.journal.close()
+    elapsed = time.perf_counter() - start
+    counts = spool.counts()
+    print(f"共放入 {total} 封，耗時 {elapsed:.2f} 秒 ({total / elapsed if elapsed else 0:.1f} 封/秒)")
+    print(f"spool 目前等待寄送 {counts['new']} 封，寄送中 {counts['cur']} 封，已寄出 {counts['done']} 封，失敗 {counts['failed']} 封")
+    print("--- 由 python -m autosentmail daemon 寄出 ---")
@@ -0,0 +1,106 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# 檢查的啟動路徑：(名稱, python 參數)
+COMMANDS = [
+    ('import', ['-c', 'import autosentmail']),
+    ('help', ['-m', 'autosentmail', '--help']),
+    ('send --help', ['-m', 'autosentmail', 'send', '--help']),
+    ('main.py --help', ['main.py', '--help']),
+]
+
+# 以上路徑都不應載入的模組 (只在實際寄送、讀取 .xlsx 或輸出指標時才需要)
+HEAVY_MODULES = ('smtplib', 'ssl', 'asyncio', 'openpyxl', 'pandas', 'email', 'http.server', 'multiprocessing',
+                 'concurrent.futures', 'subprocess', 'autosentmail.config', 'autosentmail.sender',
+                 'autosentmail.certgen', 'autosentmail.pdf_writer')
+
+# 試執行 (未設定證書範本、讀取 CSV 聯絡資料) 不應載入的模組：SMTP 相關模組，以及只有產生證書才需要的行程池與 PDF 模組
+DRY_RUN_HEAVY_MODULES = ('smtplib', 'ssl', 'asyncio', 'openpyxl', 'pandas', 'http.server', 'multiprocessing',
+                         'concurrent.futures.process', 'autosentmail.sender', 'autosentmail.certgen',
+                         'autosentmail.pdf_writer')
+
+
+# 試執行用的工作檔、聯絡資料與證書目錄，報告與工作佇列也寫入同一個暫存目錄
+def dry_run_arguments(directory):
+    directory = Path(directory)
+    (directory / 'certs').mkdir()
+    (directory / 'contacts.csv').write_text('姓名,電子郵件\n王小明,student@example.com\n', encoding='utf-8')
+    (directory / 'certs' / '課程證書-王小明.pdf').write_bytes(b'%PDF-1.4\n%%EOF\n')
+    (directory / 'job.ini').write_text('[JOB]\nname = startup\ncourse_name = 啟動檢查\n'
+                                       'contacts = contacts.csv\ncertificate_dir = certs\n', encoding='utf-8')
+    return ['main.py', 'dry-run', '--job', str(directory / 'job.ini'),
+            '--report', str(directory / 'report.csv'), '--queue', str(directory / 'queue.jsonl')]
+
+
+def median_seconds(arguments, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       cwd=REPO_DIR, check=True)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+# 以 python -X importtime 列出執行時載入的模組，回傳 {模組名稱: 含子模組的匯入時間 (微秒)}
+def imported_modules(arguments):
+    process = subprocess.run([sys.executable, '-X', 'importtime'] + arguments, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, text=True, cwd=REPO_DIR, check=True)
+    modules = {}
+    for line in process.stderr.splitlines():
+        fields = line.split('|')
+        if line.startswith('import time:') and fields[1].strip().isdigit():
+            modules[fields[2].strip()] = int(fields[1])
+    return modules
+
+
+# 列出 modules 中屬於 heavy_modules (含其子模組) 的模組
+def heavy_imports(modules, heavy_modules):
+    return sorted(m for m in modules if any(m == h or m.startswith(h + '.') for h in heavy_modules))
+
+
+def check_command(name, arguments, heavy_modules, budget_ms, baseline, repeat):
+    overhead_ms = (median_seconds(arguments, repeat) - baseline) * 1000
+    heavy = heavy_imports(imported_modules(arguments), heavy_modules)
+    ok = overhead_ms <= budget_ms and not heavy
+    print(f"{'通過' if ok else '未通過'} {name}: {overhead_ms:.1f} ms (上限 {budget_ms:g} ms)" +
+          (f"，載入了 {', '.join(heavy)}" if heavy else ""))
+    return {'command': name, 'overhead_ms': round(overhead_ms, 1), 'heavy_modules': heavy, 'ok': ok}
+
+
+# 啟動時間預算檢查：每個啟動路徑扣除 Python 本身啟動時間後的耗時 (中位數) 需低於 --budget-ms (試執行為 --dry-run-budget-ms)，
+# 且不可載入 HEAVY_MODULES (試執行為 DRY_RUN_HEAVY_MODULES)；任一項不符合時結束代碼為 1，可放在 CI 中避免模組頂層又加入耗時的匯入
+def main():
+    parser = argparse.ArgumentParser(description="檢查命令列的啟動時間與匯入的模組")
+    parser.add_argument('--budget-ms', type=float, default=100, help="每個啟動路徑額外耗時的上限 (毫秒)")
+    parser.add_argument('--dry-run-budget-ms', type=float, default=300,
+                        help="試執行的額外耗時上限 (毫秒)，包含讀取設定、聯絡資料與寫入報告")
+    parser.add_argument('--repeat', type=int, default=11, help="每個路徑執行次數，取中位數")
+    parser.add_argument('--output', help="將結果寫入此 JSON 檔")
+    args = parser.parse_args()
+
+    baseline = median_seconds(['-c', 'pass'], args.repeat)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        commands = [(name, arguments, HEAVY_MODULES, args.budget_ms) for name, arguments in COMMANDS]
+        commands.append(('dry-run', dry_run_arguments(directory), DRY_RUN_HEAVY_MODULES, args.dry_run_budget_ms))
+        for name, arguments, heavy_modules, budget_ms in commands:
+            results.append(check_command(name, arguments, heavy_modules, budget_ms, baseline, args.repeat))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({'baseline_ms': round(baseline * 1000, 1), 'budget_ms': args.budget_ms,
+                                                 'results': results}, ensure_ascii=False, indent=2) + '\n',
+                                     encoding='utf-8')
+    return 0 if all(r['ok'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+import base64
+import random
+import socket
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+
+# 產生自簽憑證供測試用的 TLS 伺服器使用 (需要系統上的 openssl 指令)
+def create_self_signed_context(directory):
+    directory = Path(directory)
+    cert_path, key_path = directory / 'cert.pem', directory / 'key.pem'
+    if not cert_path.exists():
+        try:
+            subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                            '-subj', '/CN=localhost', '-keyout', str(key_path), '-out', str(cert_path)],
+                           check=True, capture_output=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise RuntimeError(f"無法產生測試用 TLS 憑證 (需要 openssl 指令): {e}")
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(str(cert_path), str(key_path))
+    return context
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server.sink
+        sock = self.request
+        # 每個回應立即送出：否則 Nagle 演算法與用戶端的延遲 ACK 會使每筆交易多等約 40 ms，
+        # 量到的延遲主要是模擬伺服器本身而不是用戶端
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            if server.tls == 'smtps':
+                sock = server.ssl_context.wrap_socket(sock, server_side=True)
+            self._session(server, sock)
+        except (OSError, ssl.SSLError, ValueError):
+            pass
+        finally:
+            server._count('connections_closed')
+
+    def _session(self, server, sock):
+        reader = sock.makefile('rb')
+        tls_active = server.tls == 'smtps'
+
+        # 多行回應一次寫出
+        def reply(*lines):
+            sock.sendall(''.join(line + '\r\n' for line in lines).encode('ascii'))
+
+        server._connected()
+        reply('220 bench-sink ESMTP')
+        transaction_start = None
+        rcpt_count = 0
+        utf8 = False
+        username = None
+        while True:
+            line = reader.readline(65536)
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            non_ascii = any(byte >= 0x80 for byte in line)
+            verb = command[:4].upper()
+            if server.command_latency:
+                time.sleep(server.command_latency)
+            if server.drop_rate and random.random() < server.drop_rate:
+                server._count('dropped')
+                sock.close()
+                return
+
+            if verb in ('EHLO', 'HELO'):
+                lines = ['250-bench-sink', '250-AUTH PLAIN LOGIN']
+                if server.tls == 'starttls' and not tls_active:
+                    lines.append('250-STARTTLS')
+                if server.pipelining:
+                    lines.append('250-PIPELINING')
+                if server.smtputf8:
+                    lines += ['250-8BITMIME', '250-SMTPUTF8']
+                reply(*lines, '250 SIZE 104857600')
+            elif verb == 'STAR':
+                reply('220 ready to start TLS')
+                sock = server.ssl_context.wrap_socket(sock, server_side=True)
+                reader = sock.makefile('rb')
+                tls_active = True
+            elif verb == 'AUTH':
+                server._count('logins')
+                words = command.split()
+                if len(words) > 1 and words[1].upper() == 'LOGIN':
+                    # AUTH LOGIN 可能直接附上帳號 (initial response)，否則依序詢問帳號與密碼
+                    credentials = words[2:3]
+                    while len(credentials) < 2:
+                        reply('334 ')
+                        credentials.append(reader.readline().strip())
+                    username = _decode(credentials[0])
+                else:
+                    username = (_decode(words[-1]).split('\0')[1:2] or [''])[0]
+                if username in server.reject_users:
+                    reply('535 5.7.8 authentication credentials invalid')
+                else:
+                    reply('235 authenticated')
+            elif verb == 'MAIL':
+                if server.user_quota and server._user_messages(username) >= server.user_quota:
+                    reply('550 5.4.5 Daily user sending quota exceeded')
+                    continue
+                # 國際化信箱地址 (RFC 6531) 需在 MAIL FROM 加上 SMTPUTF8
+                utf8 = server.smtputf8 and 'SMTPUTF8' in command.upper().split()
+                if non_ascii and not utf8:
+                    reply('553 5.6.7 non-ASCII address requires SMTPUTF8')
+                    continue
+                transaction_start = time.monotonic()
+                rcpt_count = 0
+                reply('250 sender ok')
+            elif verb == 'RCPT':
+                if non_ascii and not utf8:
+                    reply('553 5.6.7 non-ASCII address requires SMTPUTF8')
+                    continue
+                code = server._inject_error()
+                if code:
+                    reply(f'{code} injected failure')
+                else:
+                    rcpt_count += 1
+                    reply('250 recipient ok')
+            elif verb == 'DATA':
+                if not rcpt_count:
+                    reply('554 no valid recipients')
+                    continue
+                reply('354 end with .')
+                size = 0
+                while True:
+                    data_line = reader.readline(1 << 20)
+                    if not data_line:
+                        return
+                    if data_line == b'.\r\n':
+                        break
+                    size += len(data_line)
+                if server.data_latency:
+                    time.sleep(server.data_latency)
+                code = server._inject_error()
+                if code:
+                    reply(f'{code} injected failure')
+                else:
+                    server._record_delivery(transaction_start, rcpt_count, size, username)
+                    reply('250 queued')
+                transaction_start = None
+            elif verb in ('RSET', 'NOOP'):
+                reply('250 ok')
+            elif verb == 'QUIT':
+                reply('221 bye')
+                return
+            else:
+                reply('502 command not implemented')
+
+
+def _decode(token):
+    try:
+        return base64.b64decode(token).decode('utf-8', 'replace')
+    except ValueError:
+        return ''
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+# 在同一個行程內執行的 SMTP 接收端，只計數不轉寄，用於效能測試
+# - tls: 'off' (明文)、'smtps' (連線即 TLS) 或 'starttls'
+# - data_latency / command_latency: DATA 完成後與每個指令的延遲秒數
+# - error_rate: 每個 RCPT / DATA 注入錯誤回應的機率，回應代碼隨機取自 4xx / 5xx
+# - drop_rate: 每個指令後直接中斷連線的機率
+# - reject_users: 登入時回應 535 的帳號；user_quota: 每個帳號可寄出的封數，超過後回應 550 5.4.5
+# - smtputf8: 是否支援 SMTPUTF8，不支援或 MAIL FROM 未指定時拒絕含非 ASCII 字元的地址
+class FakeSMTPServer:
+    TEMPORARY_CODES = (421, 451, 452)
+    PERMANENT_CODES = (550, 552, 554)
+
+    def __init__(self, host='127.0.0.1', port=0, tls='off', data_latency=0.0, command_latency=0.0,
+                 error_rate=0.0, drop_rate=0.0, pipelining=True, reject_users=(), user_quota=0, smtputf8=True, workdir=None):
+        self.tls = tls
+        self.data_latency = data_latency
+        self.command_latency = command_latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.pipelining = pipelining
+        self.reject_users = set(reject_users)
+        self.user_quota = user_quota
+        self.smtputf8 = smtputf8
+        self.ssl_context = None
+        if tls != 'off':
+            self._tmpdir = None if workdir else tempfile.TemporaryDirectory()
+            self.ssl_context = create_self_signed_context(workdir or self._tmpdir.name)
+        self._lock = threading.Lock()
+        self.reset()
+        self._server = _Server((host, port), _Handler)
+        self._server.sink = self
+        self.host, self.port = self._server.server_address
+        self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self.counters = {'connections': 0, 'connections_closed': 0, 'logins': 0, 'messages': 0,
+                             'recipients': 0, 'bytes': 0, 'dropped': 0, 'injected_4xx': 0, 'injected_5xx': 0}
+            self.latencies = []
+            self.messages_by_user = {}
+            self.first_connection = None
+            self.first_delivery = None
+            self.last_delivery = None
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def _connected(self):
+        with self._lock:
+            self.counters['connections'] += 1
+            if self.first_connection is None:
+                self.first_connection = time.monotonic()
+
+    def _inject_error(self):
+        if not self.error_rate or random.random() >= self.error_rate:
+            return None
+        if random.random() < 0.5:
+            self._count('injected_4xx')
+            return random.choice(self.TEMPORARY_CODES)
+        self._count('injected_5xx')
+        return random.choice(self.PERMANENT_CODES)
+
+    def _user_messages(self, username):
+        with self._lock:
+            return self.messages_by_user.get(username, 0)
+
+    def _record_delivery(self, transaction_start, rcpt_count, size, username=None):
+        now = time.monotonic()
+        with self._lock:
+            self.messages_by_user[username] = self.messages_by_user.get(username, 0) + 1
+            self.counters['messages'] += 1
+            self.counters['recipients'] += rcpt_count
+            self.counters['bytes'] += size
+            if transaction_start is not None:
+                self.latencies.append(now - transaction_start)
+            if self.first_delivery is None:
+                self.first_delivery = now
+            self.last_delivery = now
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
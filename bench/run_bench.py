@@ -0,0 +1,241 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from fake_smtp import FakeSMTPServer
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# 各寄送模式對應的設定 (覆寫到產生的 config.ini)，{concurrency} 以命令列參數代入
+MODES = {
+    'serial': {'SMTP': {'pool_size': '1'}, 'SEND': {'backend': 'thread', 'workers': '1'}},
+    'thread': {'SMTP': {'pool_size': '{concurrency}'}, 'SEND': {'backend': 'thread', 'workers': '{concurrency}'}},
+    'asyncio': {'SMTP': {'pool_size': '{concurrency}'}, 'SEND': {'backend': 'asyncio', 'async_concurrency': '{concurrency}'}},
+}
+
+
+# 產生最小但結構正確的 PDF，以隨機內容填充到指定大小 (避免附件被壓縮或內容重複)
+def synthetic_pdf(size_bytes):
+    header = b"%PDF-1.4\n1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n" \
+             b"2 0 obj << /Type /Pages /Kids [] /Count 0 >> endobj\n"
+    padding = max(0, size_bytes - len(header) - 64)
+    stream = os.urandom(padding)
+    return header + f"3 0 obj << /Length {padding} >> stream\n".encode('ascii') + stream + \
+        b"\nendstream endobj\ntrailer << /Root 1 0 R >>\n%%EOF\n"
+
+
+# 產生測試用聯絡資料 (CSV) 與證書資料夾；相同參數的資料已存在時直接沿用
+def generate_dataset(workdir, rows, pdf_kb, domains):
+    dataset_dir = Path(workdir) / f"dataset_{rows}_{pdf_kb}kb_{domains}d"
+    contacts_path = dataset_dir / 'contacts.csv'
+    certificate_dir = dataset_dir / 'certificates'
+    if contacts_path.exists():
+        return contacts_path, certificate_dir
+
+    certificate_dir.mkdir(parents=True, exist_ok=True)
+    with open(contacts_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['姓名', '電子郵件'])
+        for i in range(rows):
+            name = f"學員{i:05d}"
+            writer.writerow([name, f"user{i:05d}@domain{i % domains}.test"])
+            (certificate_dir / f"證書-{name}.pdf").write_bytes(synthetic_pdf(pdf_kb * 1024))
+    return contacts_path, certificate_dir
+
+
+def write_config(path, port, tls, mode, concurrency, overrides=()):
+    sections = {
+        'SMTP': {'server': '127.0.0.1', 'port': str(port), 'username': 'bench', 'password': 'bench',
+                 'sender_email': 'bench@example.test', 'use_tls': str(tls != 'off'),
+                 'max_messages_per_connection': '0', 'timeout': '30'},
+        'TEST': {'enable_test_mode': 'False'},
+        'SEND': {'rate_per_minute': '0', 'rate_per_hour': '0'},
+    }
+    for section, values in MODES[mode].items():
+        for key, value in values.items():
+            sections[section][key] = value.format(concurrency=concurrency)
+    for override in overrides:
+        name, _, value = override.partition('=')
+        section, _, key = name.rpartition('.')
+        sections.setdefault(section, {})[key] = value
+    with open(path, 'w', encoding='utf-8') as f:
+        for section, values in sections.items():
+            f.write(f"[{section}]\n")
+            for key, value in values.items():
+                f.write(f"{key} = {value}\n")
+            f.write("\n")
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+# 由事件記錄最後的 summary 事件取出各階段耗時 (毫秒)
+def read_phase_summary(events_path):
+    summary = None
+    if events_path.exists():
+        with open(events_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if '"event": "summary"' in line:
+                    summary = json.loads(line)
+    if summary is None:
+        return None
+    return {phase: {'count': stats['count'], 'total_seconds': round(stats['sum'], 4),
+                    'avg_ms': round(stats['avg'] * 1000, 3),
+                    'p50_ms': round(stats['p50'] * 1000, 3), 'p99_ms': round(stats['p99'] * 1000, 3)}
+            for phase, stats in summary['phases'].items()}
+
+
+# 以子行程執行一次 main.py，回傳該次的量測結果
+def run_once(sink, args, mode, contacts_path, certificate_dir, workdir):
+    config_path = Path(workdir) / f"config_{mode}.ini"
+    log_path = Path(workdir) / f"output_{mode}.log"
+    # main.py 的事件記錄結束時會寫入各階段耗時的彙總，作為用戶端的耗時分析
+    events_path = Path(workdir) / f"events_{mode}.jsonl"
+    events_path.unlink(missing_ok=True)
+    write_config(config_path, sink.port, args.tls, mode, args.concurrency,
+                 [f"METRICS.events_file={events_path}"] + args.set)
+    command = [sys.executable, str(REPO_DIR / 'main.py'), '--config', str(config_path),
+               '--contacts', str(contacts_path), '--certificate-dir', str(certificate_dir)]
+    if args.journal:
+        journal_path = Path(workdir) / f"journal_{mode}.jsonl"
+        journal_path.unlink(missing_ok=True)
+        command += ['--journal', str(journal_path)]
+    else:
+        command.append('--no-journal')
+
+    sink.reset()
+    with open(log_path, 'w', encoding='utf-8') as log:
+        start = time.monotonic()
+        process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, cwd=workdir)
+        # wait4 可取得這個子行程本身的資源使用量 (ru_maxrss 為尖峰常駐記憶體)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        wall = time.monotonic() - start
+
+    # Linux 的 ru_maxrss 單位為 KB，macOS 為 bytes
+    peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+    counters = dict(sink.counters)
+    delivered = counters['messages']
+    sending_seconds = (sink.last_delivery - sink.first_connection) if delivered else None
+    latencies = sink.latencies
+    result = {
+        'mode': mode,
+        'exit_code': process.returncode,
+        'rows': args.rows,
+        'delivered': delivered,
+        'wall_seconds': round(wall, 4),
+        'startup_seconds': round(sink.first_connection - start, 4) if sink.first_connection else None,
+        'messages_per_second': round(delivered / sending_seconds, 2) if sending_seconds else None,
+        'end_to_end_messages_per_second': round(delivered / wall, 2) if wall else None,
+        'latency_p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'peak_rss_mb': round(peak_rss / (1024 * 1024), 2),
+        'user_cpu_seconds': round(usage.ru_utime, 4),
+        'system_cpu_seconds': round(usage.ru_stime, 4),
+        'sink': counters,
+        'messages_by_user': dict(sink.messages_by_user),
+        'client_phases': read_phase_summary(events_path),
+    }
+    if process.returncode != 0:
+        tail = log_path.read_text(encoding='utf-8', errors='replace').splitlines()[-20:]
+        print(f"警告: 模式 {mode} 的 main.py 結束代碼為 {process.returncode}，最後的輸出:", file=sys.stderr)
+        print('\n'.join(tail), file=sys.stderr)
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="證書寄送效能測試：以本機模擬 SMTP 伺服器量測各寄送模式")
+    parser.add_argument('--modes', default='serial,thread,asyncio', help=f"要量測的模式，以逗號分隔 (可用: {', '.join(MODES)})")
+    parser.add_argument('--rows', type=int, default=200, help="模擬聯絡資料筆數")
+    parser.add_argument('--pdf-kb', type=int, default=100, help="每份模擬證書的大小 (KB)")
+    parser.add_argument('--domains', type=int, default=5, help="收件人分散的網域數")
+    parser.add_argument('--concurrency', type=int, default=4, help="thread / asyncio 模式的連線數與同時寄送數")
+    parser.add_argument('--tls', choices=['off', 'smtps', 'starttls'], default='off', help="模擬伺服器的加密方式")
+    parser.add_argument('--latency-ms', type=float, default=0, help="模擬伺服器在 DATA 完成後回應前的延遲")
+    parser.add_argument('--command-latency-ms', type=float, default=0, help="模擬伺服器每個指令的延遲")
+    parser.add_argument('--error-rate', type=float, default=0, help="RCPT / DATA 隨機回應 4xx 或 5xx 的機率")
+    parser.add_argument('--drop-rate', type=float, default=0, help="每個指令後隨機中斷連線的機率")
+    parser.add_argument('--reject-users', default='', help="模擬伺服器拒絕登入的帳號，以逗號分隔 (測試多帳號切換)")
+    parser.add_argument('--user-quota', type=int, default=0, help="模擬伺服器每個帳號可寄出的封數 (0 表示不限)")
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.key=value',
+                        help="額外覆寫產生的 config.ini 設定，可重複指定，例如 --set RETRY.base_delay_seconds=0.1")
+    parser.add_argument('--journal', action='store_true', help="量測時啟用寄送日誌 (預設以 --no-journal 執行)")
+    parser.add_argument('--workdir', help="模擬資料與輸出的資料夾 (預設為暫存資料夾，結束後刪除)")
+    parser.add_argument('--output', help="將結果寫入此 JSON 檔 (預設輸出到標準輸出)")
+    parser.add_argument('--history', help="另外將結果附加為一行 JSON 到此檔，用於追蹤效能變化")
+    parser.add_argument('--max-p50-ms', type=float, default=0,
+                        help="任一模式的交易時間 p50 超過此毫秒數時結束代碼為 1 (0 表示不檢查)；"
+                             "以 --latency-ms 0 執行時設為 20 可抓出 Nagle 演算法與延遲 ACK 造成的約 40 ms 等待")
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    unknown = [m for m in modes if m not in MODES]
+    if unknown:
+        parser.error(f"未知的模式: {', '.join(unknown)}")
+
+    temp_dir = None if args.workdir else tempfile.TemporaryDirectory(prefix='autosentmail-bench-')
+    workdir = Path(args.workdir or temp_dir.name).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    try:
+        contacts_path, certificate_dir = generate_dataset(workdir, args.rows, args.pdf_kb, args.domains)
+        sink = FakeSMTPServer(tls=args.tls, data_latency=args.latency_ms / 1000,
+                              command_latency=args.command_latency_ms / 1000,
+                              error_rate=args.error_rate, drop_rate=args.drop_rate,
+                              reject_users=[u for u in args.reject_users.split(',') if u],
+                              user_quota=args.user_quota, workdir=workdir)
+        with sink:
+            results = []
+            for mode in modes:
+                print(f"執行模式 {mode} ...", file=sys.stderr)
+                results.append(run_once(sink, args, mode, contacts_path, certificate_dir, workdir))
+    finally:
+        if temp_dir:
+            temp_dir.cleanup()
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'history', 'workdir')},
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + '\n', encoding='utf-8')
+    else:
+        print(text)
+    if args.history:
+        with open(args.history, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(report, ensure_ascii=False) + '\n')
+    failed = any(r['exit_code'] != 0 for r in results)
+    if args.max_p50_ms:
+        for r in results:
+            if r['latency_p50_ms'] is None or r['latency_p50_ms'] > args.max_p50_ms:
+                print(f"未通過: 模式 {r['mode']} 的交易時間 p50 為 {r['latency_p50_ms']} ms，超過 {args.max_p50_ms:g} ms", file=sys.stderr)
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,6 +7,8 @@ import os
 import configparser
 from pathlib import Path
 import ssl
+from autosentmail.cert_index import CertificateIndex
+from autosentmail.mail_template import MessageTemplate
 
 # 讀取配置文件
 def load_config():
@@ -172,28 +174,25 @@ if pd.isna(actual_recipient_email) or not str(actual_recipient_email).strip():
 # 3. 尋找對應的證書 (使用從聯絡資料中讀取的姓名)
 certificate_file_path = None
 try:
-    for file_name in os.listdir(CERTIFICATE_DIR):
-        if file_name.endswith('.pdf') and student_name_for_body_and_cert in file_name:
-            certificate_file_path = os.path.join(CERTIFICATE_DIR, file_name)
-            print(f"找到證書檔案: {certificate_file_path} 給 {student_name_for_body_and_cert}")
-            break
-    if not certificate_file_path:
+    certificate_file_path, _ = CertificateIndex(CERTIFICATE_DIR).build().lookup(str(student_name_for_body_and_cert))
+    if certificate_file_path:
+        print(f"找到證書檔案: {certificate_file_path} 給 {student_name_for_body_and_cert}")
+    else:
         print(f"警告: 找不到 {student_name_for_body_and_cert} 的證書檔案。郵件將不含附件。")
 except Exception as e:
     print(f"讀取證書目錄 '{CERTIFICATE_DIR}' 時發生錯誤: {str(e)}。郵件將不含附件。")
 
-# 4. 準備信件內容 (使用從聯絡資料中讀取的姓名)
-subject = f"「{COURSE_NAME}」課程證書寄發通知｜感謝您的參與！ (測試郵件)"
-body = (
-    f"{student_name_for_body_and_cert} 同學，您好：\n\n"
-    f"感謝您參加「{COURSE_NAME}」課程，我們很高興與您一同探索 AI 的應用，見證您的學習成長與成果！\n\n"
-    "您已順利完成本次課程，並依規定完成所有作品繳交，寄發電子課程證書，以茲證明。\n\n"
-    "如您發現證書內容有誤或無法順利下載，請於 7 日內回信通知，我們將協助您更正或補發。\n\n"
-    "再次感謝您的投入與參與，我們期待未來與您在更多課程中再次相見，共同開啟更多 AI 學習與實作的可能！\n\n"
-    "敬祝 學習順利！\n\n"
-    "自主學習與資訊專業成長教學團隊\n\n"
-    "📧 聯絡信箱：ncnu.webcamping@gmail.com"
-)
+# 4. 準備信件內容 (使用從聯絡資料中讀取的姓名，範本與 main.py 共用)
+template_dir = Path(__file__).parent / 'templates'
+message_template = MessageTemplate.from_files(template_dir / 'certificate_subject.txt', template_dir / 'certificate_body.txt')
+template_variables = {
+    '姓名': str(student_name_for_body_and_cert),
+    '課程名稱': COURSE_NAME,
+    '測試模式標記': " (測試郵件)",
+    '測試模式說明': ""
+}
+subject = message_template.subject.render(template_variables)
+body = message_template.body.render(template_variables)
 
 # 5. 發送郵件
 print(f"\n準備發送測試郵件..." )
@@ -0,0 +1,72 @@
+import asyncio
+import smtplib
+import sys
+import unittest
+from pathlib import Path
+
+from autosentmail.async_backend import AsyncSMTPConnection
+from autosentmail.batch_sender import envelope_commands, group_identical, send_pipelined
+from autosentmail.metrics import Metrics
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'bench'))
+from fake_smtp import FakeSMTPServer
+
+MESSAGE = b'Subject: hi\r\n\r\nbody\r\n'
+
+
+class EnvelopeCommandsTest(unittest.TestCase):
+    def test_ascii_addresses(self):
+        commands = envelope_commands('a@example.com', ['b@example.com'], 100, {'size'}.__contains__)
+        self.assertEqual(commands, [b'MAIL FROM:<a@example.com> SIZE=100\r\n', b'RCPT TO:<b@example.com>\r\n'])
+
+    def test_international_address_uses_smtputf8(self):
+        commands = envelope_commands('a@example.com', ['王小明@例子.tw'], 100, {'smtputf8'}.__contains__)
+        self.assertEqual(commands, [b'MAIL FROM:<a@example.com> SMTPUTF8 BODY=8BITMIME\r\n',
+                                    'RCPT TO:<王小明@例子.tw>\r\n'.encode('utf-8')])
+
+    def test_international_address_without_server_support(self):
+        with self.assertRaises(smtplib.SMTPNotSupportedError):
+            envelope_commands('a@example.com', ['王小明@例子.tw'], 100, set().__contains__)
+
+
+class SendPipelinedTest(unittest.TestCase):
+    def send(self, to_addrs, **sink_options):
+        with FakeSMTPServer(**sink_options) as sink:
+            server = smtplib.SMTP(sink.host, sink.port, timeout=5)
+            try:
+                refused = send_pipelined(server, 'sender@example.com', to_addrs, MESSAGE)
+            finally:
+                server.quit()
+            return refused, sink.counters['recipients']
+
+    def test_international_address(self):
+        for pipelining in (True, False):
+            refused, recipients = self.send(['王小明@例子.tw', 'b@example.com'], pipelining=pipelining)
+            self.assertEqual((refused, recipients), ({}, 2))
+
+    def test_international_address_not_supported(self):
+        with self.assertRaises(smtplib.SMTPNotSupportedError):
+            self.send(['王小明@例子.tw'], smtputf8=False)
+
+    def test_async_international_address(self):
+        async def send(sink):
+            conn = AsyncSMTPConnection(5, Metrics())
+            await conn.connect(sink.host, sink.port, None, 'plain')
+            try:
+                return await conn.sendmail('sender@example.com', ['王小明@例子.tw'], MESSAGE)
+            finally:
+                await conn.close()
+        with FakeSMTPServer() as sink:
+            self.assertEqual(asyncio.run(send(sink)), {})
+            self.assertEqual(sink.counters['recipients'], 1)
+
+
+class GroupIdenticalTest(unittest.TestCase):
+    def test_groups_by_key_and_size(self):
+        jobs = [('a', 1), ('b', 2), ('a', 3), ('a', 4)]
+        groups = list(group_identical(jobs, key_func=lambda job: job[0], max_recipients=2))
+        self.assertEqual(groups, [{'batch': [('a', 1), ('a', 3)]}, {'batch': [('b', 2)]}, {'batch': [('a', 4)]}])
+
+
+if __name__ == '__main__':
+    unittest.main()
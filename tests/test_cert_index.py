@@ -0,0 +1,57 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from autosentmail.cert_index import CertificateIndex, normalize_name
+
+
+class NormalizeNameTest(unittest.TestCase):
+    def test_fullwidth_spaces_and_case(self):
+        self.assertEqual(normalize_name('Ｍａｒｙ　Ｌｅｅ'), 'marylee')
+        self.assertEqual(normalize_name(' 王 小明 '), '王小明')
+        self.assertEqual(normalize_name('Ⅱ期'), normalize_name('II期'))
+
+
+class CertificateIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.certs = self.directory / 'certs'
+        self.certs.mkdir()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def index(self, file_names, **options):
+        for file_name in file_names:
+            (self.certs / file_name).write_bytes(b'%PDF')
+        return CertificateIndex(self.certs, cache_path=self.directory / 'index.json', **options).build()
+
+    def test_exact_lookup_is_nfkc_normalized(self):
+        index = self.index(['AI證書-王小明.pdf', '證書-Ｍａｒｙ Ｌｅｅ.pdf'])
+        self.assertEqual(index.lookup('王 小明'), (self.certs / 'AI證書-王小明.pdf', 'exact'))
+        self.assertEqual(index.lookup('mary lee'), (self.certs / '證書-Ｍａｒｙ Ｌｅｅ.pdf', 'exact'))
+        self.assertEqual(index.lookup('王大明'), (None, None))
+
+    def test_duplicate_names(self):
+        index = self.index(['AI證書-王小明.pdf', 'Python證書-王小明.pdf'])
+        self.assertEqual(index.lookup('王小明'), (None, 'duplicate'))
+
+    def test_fuzzy_lookup(self):
+        index = self.index(['證書-Christopher.pdf', '證書-王小明.pdf'], fuzzy=True)
+        self.assertEqual(index.lookup('Cristopher'), (self.certs / '證書-Christopher.pdf', 'fuzzy'))
+        self.assertEqual(index.lookup('王大明'), (None, None))  # 相似度低於預設的 0.85
+        strict = CertificateIndex(self.certs, cache_path=self.directory / 'index.json').build()
+        self.assertEqual(strict.lookup('Cristopher'), (None, None))
+
+    def test_cache_reused_until_directory_changes(self):
+        self.index(['證書-王小明.pdf'])
+        cached = CertificateIndex(self.certs, cache_path=self.directory / 'index.json').build()
+        self.assertEqual((cached.reused_count, cached.parsed_count), (1, 0))
+        updated = self.index(['證書-李大華.pdf'])
+        self.assertEqual((updated.reused_count, updated.parsed_count), (1, 1))
+        self.assertEqual(updated.lookup('李大華'), (self.certs / '證書-李大華.pdf', 'exact'))
+
+
+if __name__ == '__main__':
+    unittest.main()
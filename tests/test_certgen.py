@@ -0,0 +1,57 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from autosentmail.certgen import CertificateRenderer, parse_layout
+
+
+# 產生只有一頁空白頁面的最小 PDF 作為證書範本
+def minimal_pdf():
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>',
+               b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+               b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 842 595] >>']
+    data = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(data)
+    data += b'xref\n0 %d\n0000000000 65535 f\r\n' % (len(objects) + 1)
+    data += b''.join(b'%010d 00000 n\r\n' % offset for offset in offsets)
+    data += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(data)
+
+
+class RenderPathsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.template = self.directory / 'template.pdf'
+        self.template.write_bytes(minimal_pdf())
+        self.renderer = CertificateRenderer(self.template, parse_layout('${姓名} @ 421, 300, 36, center'),
+                                            filename='${課程名稱}證書-${姓名}.pdf', workers=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def render(self, names):
+        rows = [(row_num, {'姓名': name, '課程名稱': 'AI'}) for row_num, name in enumerate(names, 2)]
+        return self.renderer.render(self.directory / 'certs', rows)
+
+    def test_paths_for_hyphenated_and_substituted_names(self):
+        result = self.render(['Mary-Jane', 'A/B', '王小明', '王小明', ''])
+        certs = self.directory / 'certs'
+        self.assertEqual(result.paths, {2: certs / 'AI證書-Mary-Jane.pdf', 3: certs / 'AI證書-A_B.pdf',
+                                        4: certs / 'AI證書-王小明.pdf', 5: certs / 'AI證書-王小明.pdf'})
+        self.assertTrue(all(path.stat().st_size for path in result.paths.values()))
+        self.assertEqual((result.rendered, result.skipped), (3, 1))
+
+    def test_reused_certificates_keep_paths(self):
+        first = self.render(['Mary-Jane'])
+        second = self.render(['Mary-Jane'])
+        self.assertEqual((second.rendered, second.reused), (0, 1))
+        self.assertEqual(second.paths, first.paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
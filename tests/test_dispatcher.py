@@ -0,0 +1,36 @@
+import threading
+import time
+import unittest
+
+from autosentmail.dispatcher import dispatch
+
+
+class DispatchTest(unittest.TestCase):
+    def test_all_jobs_completed(self):
+        results = []
+        completed = dispatch(range(5), lambda job: job, lambda job, error: results.append((job, error)), workers=2)
+        self.assertTrue(completed)
+        self.assertEqual(sorted(results), [(i, None) for i in range(5)])
+
+    def test_keyboard_interrupt_waits_for_in_flight_jobs(self):
+        started = threading.Barrier(3)
+        results = []
+
+        def send(job):
+            started.wait()
+            time.sleep(0.05)
+
+        # 前兩個項目開始寄送後模擬 Ctrl-C
+        def jobs():
+            yield 'a'
+            yield 'b'
+            started.wait()
+            raise KeyboardInterrupt
+
+        completed = dispatch(jobs(), send, lambda job, error: results.append((job, error)), workers=2)
+        self.assertFalse(completed)
+        self.assertEqual(sorted(results), [('a', None), ('b', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
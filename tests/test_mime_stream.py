@@ -0,0 +1,46 @@
+import unittest
+
+from autosentmail.mime_stream import StreamingMessage
+
+
+# 模擬附件物件：提供 size 與 chunks()
+class FakeAttachment:
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+
+    def chunks(self, chunk_size):
+        return (self.data[i:i + chunk_size] for i in range(0, len(self.data), chunk_size))
+
+
+class DataChunksTest(unittest.TestCase):
+    def test_small_message_is_one_write_with_terminator(self):
+        message = StreamingMessage([b'Subject: hi\r\n\r\n', b'.hidden\r\nbody\r\n'])
+        self.assertEqual(list(message.data_chunks()), [b'Subject: hi\r\n\r\n..hidden\r\nbody\r\n.\r\n'])
+
+    def test_terminator_added_after_unterminated_line(self):
+        self.assertEqual(list(StreamingMessage([b'body']).data_chunks()), [b'body\r\n.\r\n'])
+
+    def test_segments_coalesced_up_to_chunk_size(self):
+        attachment = FakeAttachment(b'QUJD\r\n' * 5000)
+        message = StreamingMessage([b'head\r\n', attachment, b'tail\r\n'])
+        chunks = list(message.data_chunks(chunk_size=4096))
+        self.assertEqual(b''.join(chunks), b'head\r\n' + attachment.data + b'tail\r\n.\r\n')
+        # 除了最後一段外每次寫出都至少 chunk_size，結束符號不會單獨寫出
+        self.assertTrue(all(len(chunk) >= 4096 for chunk in chunks[:-1]))
+        self.assertTrue(chunks[-1].endswith(b'tail\r\n.\r\n'))
+
+    # 以 . 開頭的行不論落在哪一次寫出的開頭或中間都要加上一個 .；只有一個 . 的行不能被當成結束符號
+    def test_dot_stuffing_at_chunk_boundaries(self):
+        attachment = FakeAttachment(b'QUJD\r\n' * 3)
+        segments = [b'Subject: hi\r\n\r\n', b'.\r\n', attachment, b'.line\r\n..two\r\nend.\r\n.']
+        expected = (b'Subject: hi\r\n\r\n..\r\n' + attachment.data + b'..line\r\n...two\r\nend.\r\n..'
+                    + b'\r\n.\r\n')
+        for chunk_size in range(1, 64):
+            with self.subTest(chunk_size=chunk_size):
+                chunks = list(StreamingMessage(segments).data_chunks(chunk_size=chunk_size))
+                self.assertEqual(b''.join(chunks), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
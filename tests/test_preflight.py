@@ -0,0 +1,92 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from autosentmail.attachment_cache import encoded_size
+from autosentmail.preflight import check_email_syntax, run_preflight
+
+
+class EmailSyntaxTest(unittest.TestCase):
+    def test_valid_addresses(self):
+        for address in ('student@example.com', 'mary.lee+ai@mail.example.com.tw', 'a@xn--fsqu00a.tw', 'a@例子.tw'):
+            with self.subTest(address=address):
+                self.assertIsNone(check_email_syntax(address))
+
+    def test_invalid_addresses(self):
+        for address in ('student', 'a@@example.com', 'a@b@example.com', '@example.com', 'a.@example.com',
+                        'a..b@example.com', 'a b@example.com', 'a@localhost', 'a@-example.com', 'a@example.123',
+                        'a' * 65 + '@example.com'):
+            with self.subTest(address=address):
+                self.assertEqual(check_email_syntax(address), 'invalid_email')
+
+    # 中文輸入法常見的全形字元
+    def test_fullwidth_characters(self):
+        self.assertEqual(check_email_syntax('student＠example.com'), 'fullwidth_email')
+        self.assertEqual(check_email_syntax('ｓtudent@example.com'), 'fullwidth_email')
+
+
+class RowChecksTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.certificate = self.directory / '證書.pdf'
+        self.certificate.write_bytes(b'%PDF')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check(self, rows):
+        contacts = [(row_num, {'姓名': name, '電子郵件': email}) for row_num, (name, email) in enumerate(rows, 2)]
+        return run_preflight(contacts, None, {}, certificate_paths={row_num: self.certificate for row_num, _ in contacts})
+
+    def issues(self, result):
+        return [(issue['row'], issue['code']) for issue in result.issues]
+
+    # 相同姓名與 Email (不分大小寫) 只寄第一筆
+    def test_duplicate_rows(self):
+        result = self.check([('王小明', 'ming@example.com'), ('李大華', 'hua@example.com'),
+                             ('王小明', 'Ming@Example.com')])
+        self.assertEqual([row_num for row_num, _, _ in result.queue], [2, 3])
+        self.assertEqual(self.issues(result), [(4, 'duplicate')])
+        self.assertEqual(result.excluded_rows, 1)
+
+    # 不同姓名使用相同 Email 只列為警告，兩筆都會寄送
+    def test_shared_email_is_warning(self):
+        result = self.check([('王小明', 'family@example.com'), ('王小華', 'family@example.com')])
+        self.assertEqual(len(result.queue), 2)
+        self.assertEqual(self.issues(result), [(2, 'shared_email'), (3, 'shared_email')])
+        self.assertEqual(result.excluded_rows, 0)
+
+    def test_missing_and_invalid_fields(self):
+        result = self.check([('', 'a@example.com'), ('王小明', ''), ('李大華', 'hua＠example.com'),
+                             ('陳小美', 'mei@example')])
+        self.assertEqual(result.queue, [])
+        self.assertEqual(self.issues(result), [(2, 'missing_name'), (3, 'missing_email'), (4, 'fullwidth_email'),
+                                               (5, 'invalid_email')])
+
+
+class AttachmentSizeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check(self, raw_size):
+        path = self.directory / '證書-王小明.pdf'
+        path.write_bytes(b'\0' * raw_size)
+        contacts = [(2, {'姓名': '王小明', '電子郵件': 'student@example.com'})]
+        return run_preflight(contacts, None, {'max_attachment_mb': 1}, certificate_paths={2: path})
+
+    # 上限與寄送時的 base64 大小 (每 76 字元加 CRLF) 一致
+    def test_limit_uses_encoded_size_with_crlf(self):
+        self.assertLessEqual(encoded_size(766200), 1 << 20)
+        self.assertGreater(encoded_size(766300), 1 << 20)
+        self.assertEqual(len(self.check(766200).queue), 1)
+        result = self.check(766300)
+        self.assertEqual(result.queue, [])
+        self.assertEqual([issue['code'] for issue in result.issues], ['attachment_too_large'])
+
+
+if __name__ == '__main__':
+    unittest.main()
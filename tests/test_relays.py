@@ -0,0 +1,215 @@
+import asyncio
+import shutil
+import smtplib
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from autosentmail.batch_sender import send_pipelined
+from autosentmail.relays import NoRelayAvailable, RelaySet, relay_error_kind
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'bench'))
+from fake_smtp import FakeSMTPServer
+
+
+# 模擬連線池：依序回傳或拋出 results 中的結果，不連線 SMTP
+class FakePool:
+    def __init__(self, results):
+        self.results = list(results)
+
+    def execute(self, operation):
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def close(self):
+        pass
+
+
+# asyncio 後端使用的模擬連線池
+class FakeAsyncPool:
+    async def sendmail(self, sender, to_addrs, message):
+        return {}
+
+    async def close(self):
+        pass
+
+
+PROFILE = {'sender_email': 'sender@example.com', 'pool_size': 2}
+
+
+class RelayErrorKindTest(unittest.TestCase):
+    def test_recipient_mailbox_full_is_not_relay_failure(self):
+        self.assertIsNone(relay_error_kind(smtplib.SMTPDataError(552, b'5.2.2 mailbox over quota')))
+        self.assertIsNone(relay_error_kind(smtplib.SMTPDataError(452, b'4.2.2 The email account is over quota')))
+        self.assertIsNone(relay_error_kind(smtplib.SMTPDataError(550, b'5.1.1 user unknown')))
+        self.assertIsNone(relay_error_kind(smtplib.SMTPDataError(552, b'mailbox over quota')))
+
+    def test_greylisting_is_not_relay_failure(self):
+        self.assertIsNone(relay_error_kind(smtplib.SMTPDataError(451, b'4.7.1 greylisted, try again later')))
+
+    def test_sender_limits_are_quota(self):
+        self.assertEqual(relay_error_kind(smtplib.SMTPDataError(550, b'5.4.5 Daily user sending limit exceeded')), 'quota')
+        self.assertEqual(relay_error_kind(smtplib.SMTPDataError(451, b'4.7.0 sending quota exceeded')), 'quota')
+        self.assertEqual(relay_error_kind(smtplib.SMTPSenderRefused(550, b'daily sending limit exceeded', 'a@b')), 'quota')
+
+    def test_authentication(self):
+        self.assertEqual(relay_error_kind(smtplib.SMTPAuthenticationError(535, b'5.7.8 bad credentials')), 'auth')
+        self.assertEqual(relay_error_kind(smtplib.SMTPSenderRefused(530, b'5.7.0 Authentication required', 'a@b')), 'auth')
+
+
+class RelaySetTest(unittest.TestCase):
+    def test_mailbox_full_does_not_disable_relay(self):
+        relays = RelaySet({'SMTP': PROFILE})
+        relay = relays.relays[0]
+        relay.pool = FakePool([smtplib.SMTPDataError(552, b'5.2.2 mailbox over quota'), {}])
+        with self.assertRaises(smtplib.SMTPDataError):
+            relays.send('example.com', ['full@example.com'], lambda sender: b'', None)
+        self.assertIsNone(relay.disabled)
+        self.assertEqual(relays.send('example.com', ['ok@example.com'], lambda sender: b'', None), {})
+
+    def test_quota_fails_over_to_next_relay(self):
+        relays = RelaySet({'1': PROFILE, '2': PROFILE})
+        first, second = relays.relays
+        first.pool = FakePool([smtplib.SMTPSenderRefused(550, b'5.4.5 Daily sending quota exceeded', 'a@b')])
+        second.pool = FakePool([{}, smtplib.SMTPSenderRefused(550, b'5.4.5 Daily sending quota exceeded', 'a@b')])
+        self.assertEqual(relays.send('example.com', ['a@example.com'], lambda sender: b'', None), {})
+        self.assertIsNotNone(first.disabled)
+        with self.assertRaises(NoRelayAvailable):
+            relays.send('example.com', ['b@example.com'], lambda sender: b'', None)
+
+    def test_quota_usage_survives_restart_without_close(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        quota_path = Path(directory) / 'quota.json'
+        profile = dict(PROFILE, daily_quota=5)
+        relays = RelaySet({'SMTP': profile}, quota_path)
+        relays.relays[0].pool = FakePool([{}, {}, {}])
+        for i in range(3):
+            relays.send('example.com', [f'user{i}@example.com'], lambda sender: b'', None)
+        # 模擬程式被強制結束：不呼叫 close()，重新建立時仍讀到已寄出的數量
+        restarted = RelaySet({'SMTP': profile}, quota_path)
+        self.assertEqual(restarted.relays[0].used_today, 3)
+        self.assertEqual(restarted.relays[0].remaining(), 2)
+
+    def test_delivery_during_quota_write_is_saved(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        quota_path = Path(directory) / 'quota.json'
+        profile = dict(PROFILE, daily_quota=5)
+        relays = RelaySet({'SMTP': profile}, quota_path)
+        relays.relays[0].pool = FakePool([{}, {}])
+        write_quota = relays._write_quota
+        writing = threading.Event()
+
+        # 第一次寫檔時等待第二封寄出：第二個執行緒不等待寫檔，由第一個執行緒寫入最新的數量
+        def slow_write(usage):
+            if not writing.is_set():
+                writing.set()
+                time.sleep(0.1)
+            write_quota(usage)
+        relays._write_quota = slow_write
+
+        def send(i):
+            relays.send('example.com', [f'user{i}@example.com'], lambda sender: b'', None)
+        first = threading.Thread(target=send, args=(0,))
+        first.start()
+        writing.wait()
+        start = time.monotonic()
+        send(1)
+        self.assertLess(time.monotonic() - start, 0.05)
+        first.join()
+        self.assertEqual(RelaySet({'SMTP': profile}, quota_path).relays[0].used_today, 2)
+
+    def test_async_quota_usage_survives_restart_without_close(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        quota_path = Path(directory) / 'quota.json'
+        profile = dict(PROFILE, daily_quota=5)
+        relays = RelaySet({'SMTP': profile}, quota_path)
+        relays.relays[0].async_pool = FakeAsyncPool()
+
+        async def send_all():
+            await asyncio.gather(*(relays.send_async('example.com', [f'user{i}@example.com'], lambda sender: b'')
+                                   for i in range(3)))
+        asyncio.run(send_all())
+        self.assertEqual(RelaySet({'SMTP': profile}, quota_path).relays[0].used_today, 3)
+
+    def test_pool_created_once_across_threads(self):
+        relays = RelaySet({'SMTP': PROFILE})
+        relay = relays.relays[0]
+        barrier = threading.Barrier(8)
+        pools = []
+
+        # 建立連線池時稍微延遲，讓同時取用的執行緒一定會重疊
+        def slow_pool(*args):
+            time.sleep(0.05)
+            return FakePool([])
+
+        def worker():
+            barrier.wait()
+            pools.append(relays._pool(relay))
+        with mock.patch('autosentmail.relays.SMTPConnectionPool', side_effect=slow_pool):
+            threads = [threading.Thread(target=worker) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len({id(pool) for pool in pools}), 1)
+        self.assertIs(pools[0], relay.pool)
+
+
+# 以模擬的 SMTPS 伺服器實際連線：帳號 bad 登入時回應 535
+@unittest.skipUnless(shutil.which('openssl'), "需要 openssl 指令產生自簽憑證")
+class RelaySetSMTPSTest(unittest.TestCase):
+    def setUp(self):
+        self.sink = FakeSMTPServer(tls='smtps', reject_users=['bad']).start()
+
+    def tearDown(self):
+        self.sink.stop()
+
+    def profile(self, username):
+        return {'server': self.sink.host, 'port': self.sink.port, 'username': username, 'password': 'secret',
+                'sender_email': f'{username}@example.com', 'use_tls': True, 'pool_size': 1, 'timeout': 5}
+
+    def test_login_failure_fails_over_without_starttls_fallback(self):
+        relays = RelaySet({'1': self.profile('bad'), '2': self.profile('good')})
+        start = time.monotonic()
+        try:
+            for i in range(6):
+                refused = relays.send('example.com', [f'user{i}@example.com'],
+                                      lambda sender: b'Subject: hi\r\n\r\nbody\r\n', send_pipelined)
+                self.assertEqual(refused, {})
+        finally:
+            relays.close()
+        first, second = relays.relays
+        self.assertIsNotNone(first.disabled)
+        self.assertIsNone(second.disabled)
+        self.assertEqual(self.sink.messages_by_user, {'good': 6})
+        # 登入失敗不應改用 STARTTLS 而等到逾時
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_login_failure_fails_over_async(self):
+        relays = RelaySet({'1': self.profile('bad'), '2': self.profile('good')})
+
+        async def send_all():
+            try:
+                return [await relays.send_async('example.com', [f'user{i}@example.com'],
+                                                lambda sender: b'Subject: hi\r\n\r\nbody\r\n') for i in range(6)]
+            finally:
+                await relays.close_async()
+        start = time.monotonic()
+        self.assertEqual(asyncio.run(send_all()), [{}] * 6)
+        relays.close()
+        self.assertIsNotNone(relays.relays[0].disabled)
+        self.assertEqual(self.sink.messages_by_user, {'good': 6})
+        self.assertLess(time.monotonic() - start, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import asyncio
+import smtplib
+import socket
+import unittest
+
+from autosentmail.retry import classify_error
+
+
+class ClassifyErrorTest(unittest.TestCase):
+    def test_response_codes(self):
+        self.assertEqual(classify_error(smtplib.SMTPDataError(451, b'4.7.1 greylisted')), 'transient')
+        self.assertEqual(classify_error(smtplib.SMTPSenderRefused(421, b'4.7.0 try later', 'a@b')), 'transient')
+        self.assertEqual(classify_error(smtplib.SMTPDataError(550, b'5.1.1 no such user')), 'permanent')
+        self.assertEqual(classify_error(smtplib.SMTPDataError(552, b'5.3.4 message too big')), 'permanent')
+
+    # 所有收件人都是 4xx 才可重試，混有 5xx 時重試也無法寄給全部收件人
+    def test_recipients_refused(self):
+        transient = smtplib.SMTPRecipientsRefused({'a@b': (450, b'busy'), 'c@d': (452, b'full')})
+        mixed = smtplib.SMTPRecipientsRefused({'a@b': (450, b'busy'), 'c@d': (550, b'unknown')})
+        self.assertEqual(classify_error(transient), 'transient')
+        self.assertEqual(classify_error(mixed), 'permanent')
+        self.assertEqual(classify_error(smtplib.SMTPRecipientsRefused({})), 'permanent')
+
+    def test_connection_errors_are_transient(self):
+        for error in (smtplib.SMTPServerDisconnected('closed'), ConnectionResetError(), TimeoutError(),
+                      asyncio.TimeoutError(), socket.gaierror(-3, 'Temporary failure in name resolution')):
+            with self.subTest(error=type(error).__name__):
+                self.assertEqual(classify_error(error), 'transient')
+
+    def test_other_errors_are_permanent(self):
+        for error in (smtplib.SMTPNotSupportedError('SMTPUTF8 not supported'), FileNotFoundError('cert.pdf'),
+                      ValueError('bad template')):
+            with self.subTest(error=type(error).__name__):
+                self.assertEqual(classify_error(error), 'permanent')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from autosentmail.mime_stream import StreamingMessage
+from autosentmail.spool import Spool, parse_name
+
+
+# 模擬附件物件：提供 size 與 chunks()
+class FakeAttachment:
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+
+    def chunks(self, chunk_size):
+        return (self.data[i:i + chunk_size] for i in range(0, len(self.data), chunk_size))
+
+
+class ParseNameTest(unittest.TestCase):
+    def test_names(self):
+        self.assertEqual(parse_name('AI.2.0123456789.msg'), ('AI.2.0123456789', 1, 0))
+        self.assertEqual(parse_name('AI.2.0123456789,3,1700000000.msg'), ('AI.2.0123456789', 3, 1700000000))
+        self.assertIsNone(parse_name('AI.2.0123456789.msg.tmp'))
+
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.spool = Spool(self.directory / 'spool')
+        self.message_id = Spool.message_id('AI 課程', 2, 'Student@Example.com ')
+        self.name = f"{self.message_id}.msg"
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def put(self):
+        attachment = FakeAttachment(b'QUJD\r\n' * 4)
+        message = StreamingMessage([b'Subject: hi\r\n\r\n', attachment, b'--boundary--\r\n'])
+        self.spool.put(self.message_id, {'to': 'student@example.com'}, message)
+        return message
+
+    def test_message_id_is_stable_and_safe(self):
+        self.assertEqual(self.message_id, Spool.message_id('AI 課程', 2, 'student@example.com'))
+        self.assertNotIn(' ', self.message_id)
+        self.assertNotIn(',', Spool.message_id('a,b', 2, 'student@example.com'))
+
+    def test_put_and_read(self):
+        message = self.put()
+        self.assertEqual(self.spool.names('new'), [self.name])
+        self.assertEqual(os.listdir(self.directory / 'spool' / 'tmp'), [])
+        info, read_message = Spool.read(self.directory / 'spool' / 'new' / self.name)
+        self.assertEqual((info['id'], info['to']), (self.message_id, 'student@example.com'))
+        self.assertEqual(read_message.to_bytes(), message.to_bytes())
+        self.assertEqual(read_message.spans(), message.spans())
+
+    def test_claim_release_retry_and_finish(self):
+        self.put()
+        path = self.spool.claim(self.name)
+        self.assertEqual(path, self.directory / 'spool' / 'cur' / self.name)
+        self.assertIsNone(self.spool.claim(self.name))  # 已被取走
+        self.spool.release(self.name)
+        self.assertEqual(self.spool.counts(), {'new': 1, 'cur': 0, 'done': 0, 'failed': 0})
+
+        self.spool.claim(self.name)
+        self.spool.retry(self.name, 2, 1700000000.5)
+        retry_name = f"{self.message_id},2,1700000000.msg"
+        self.assertEqual(self.spool.names('new'), [retry_name])
+        self.assertEqual(self.spool.ids('new'), {self.message_id})
+
+        self.spool.claim(retry_name)
+        self.spool.finish(retry_name, 'done')
+        self.assertEqual(self.spool.names('done'), [self.name])  # 檔名去掉重試資訊
+        self.assertEqual(self.spool.counts(), {'new': 0, 'cur': 0, 'done': 1, 'failed': 0})
+
+    def test_finish_without_keep_deletes(self):
+        self.put()
+        self.spool.claim(self.name)
+        self.spool.finish(self.name, 'done', keep=False)
+        self.assertEqual(self.spool.counts(), {'new': 0, 'cur': 0, 'done': 0, 'failed': 0})
+
+    # 重新放入先前失敗的郵件時，failed 中的舊檔案移除
+    def test_put_replaces_failed(self):
+        self.put()
+        self.spool.claim(self.name)
+        self.spool.finish(self.name, 'failed')
+        self.assertEqual(self.spool.ids('failed'), {self.message_id})
+        self.put()
+        self.assertEqual(self.spool.counts(), {'new': 1, 'cur': 0, 'done': 0, 'failed': 0})
+
+    def test_clean_tmp_removes_only_old_files(self):
+        tmp = self.directory / 'spool' / 'tmp'
+        (tmp / 'old.msg').write_bytes(b'')
+        (tmp / 'writing.msg').write_bytes(b'')
+        old = time.time() - 7200
+        os.utime(tmp / 'old.msg', (old, old))
+        self.spool.clean_tmp()
+        self.assertEqual(os.listdir(tmp), ['writing.msg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
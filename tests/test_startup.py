@@ -0,0 +1,31 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'bench'))
+from check_startup import (COMMANDS, DRY_RUN_HEAVY_MODULES, HEAVY_MODULES, dry_run_arguments, heavy_imports,
+                           imported_modules)
+
+# import autosentmail (含子模組) 的匯入時間上限；實際約 3 ms，上限放寬以免在較慢的 CI 上誤判
+IMPORT_BUDGET_US = 50000
+
+
+# 與 bench/check_startup.py 相同的檢查，但只檢查載入的模組與匯入時間，不量測整個行程的執行時間
+class StartupImportsTest(unittest.TestCase):
+    def test_help_does_not_load_heavy_modules(self):
+        for name, arguments in COMMANDS:
+            with self.subTest(command=name):
+                modules = imported_modules(arguments)
+                self.assertEqual(heavy_imports(modules, HEAVY_MODULES), [])
+                self.assertLess(modules['autosentmail'], IMPORT_BUDGET_US)
+
+    def test_dry_run_does_not_load_smtp_or_certgen(self):
+        with tempfile.TemporaryDirectory() as directory:
+            modules = imported_modules(dry_run_arguments(directory))
+        self.assertEqual(heavy_imports(modules, DRY_RUN_HEAVY_MODULES), [])
+        self.assertIn('autosentmail.preflight', modules)
+
+
+if __name__ == '__main__':
+    unittest.main()